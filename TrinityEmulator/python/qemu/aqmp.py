@@ -0,0 +1,362 @@
+"""
+QEMU Monitor Protocol asyncio client
+
+AsyncQEMUMonitorProtocol keeps any number of commands in flight on one
+connection, matching replies by "id", and delivers events through
+subscriber queues instead of interleaving them with replies.  A single
+event loop can drive hundreds of VMs concurrently.
+"""
+# Copyright (C) 2025 Trinity Emulator authors
+#
+# This work is licensed under the terms of the GNU GPL, version 2.  See
+# the COPYING file in the top-level directory.
+
+import asyncio
+import itertools
+import json
+import logging
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    List,
+    Optional,
+    Set,
+)
+
+from .qmp import (
+    MessageBuffer,
+    QMPCapabilitiesError,
+    QMPConnectError,
+    QMPError,
+    QMPTimeoutError,
+)
+
+
+class QMPResponseError(QMPError):
+    """
+    The command completed with an "error" reply.
+    """
+    def __init__(self, reply: Dict[str, Any]):
+        super().__init__(reply['error'].get('desc', 'unknown error'))
+        self.reply = reply
+
+
+# Queued after the last event once the connection is gone
+_CLOSED: Dict[str, Any] = {}
+
+
+class EventListener:
+    """
+    Queue of events for one subscriber, optionally filtered by name.
+
+    When the queue is full the oldest event is dropped and counted, so a
+    slow consumer never stalls the reader or other subscribers.  Once the
+    connection is lost or closed, the remaining events are delivered and
+    then iteration stops and get() raises QMPConnectError.
+    """
+    def __init__(self, names: Optional[List[str]] = None, maxsize: int = 0):
+        self.names = set(names) if names else None
+        self.queue: 'asyncio.Queue[Dict[str, Any]]' = asyncio.Queue(maxsize)
+        self.dropped = 0
+        self.closed = False
+
+    def _put(self, item: Dict[str, Any]) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(item)
+
+    def put(self, event: Dict[str, Any]) -> None:
+        """
+        Queue an event if it matches this listener's filter.
+        """
+        if self.names is not None and event['event'] not in self.names:
+            return
+        self._put(event)
+
+    def close(self) -> None:
+        """
+        Wake up readers once the queued events are consumed.
+        """
+        if not self.closed:
+            self.closed = True
+            self._put(_CLOSED)
+
+    def reopen(self) -> None:
+        """
+        Accept events again after a reconnection.
+        """
+        if self.closed:
+            self.closed = False
+            items = [self.queue.get_nowait() for _ in range(self.queue.qsize())]
+            for item in items:
+                if item is not _CLOSED:
+                    self.queue.put_nowait(item)
+
+    async def _next(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        event = await asyncio.wait_for(self.queue.get(), timeout)
+        if event is _CLOSED:
+            # Leave it queued so that every later read ends too
+            self.queue.put_nowait(event)
+        return event
+
+    async def get(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Wait for the next event.
+
+        @raise QMPTimeoutError if no event arrives within timeout
+        @raise QMPConnectError if the connection is closed
+        """
+        try:
+            event = await self._next(timeout)
+        except asyncio.TimeoutError:
+            raise QMPTimeoutError("Timeout waiting for event")
+        if event is _CLOSED:
+            raise QMPConnectError("Connection closed")
+        return event
+
+    def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        event = await self._next()
+        if event is _CLOSED:
+            raise StopAsyncIteration
+        return event
+
+
+class AsyncQEMUMonitorProtocol:
+    """
+    asyncio QMP client with request pipelining.
+    """
+
+    #: Logger object for debugging messages
+    logger = logging.getLogger('QMP')
+
+    #: Bytes requested from the transport per read
+    read_size = 65536
+
+    def __init__(self, address, nickname: Optional[str] = None,
+                 event_queue_size: int = 1024):
+        """
+        Create an AsyncQEMUMonitorProtocol.
+
+        @param address: unix socket path (string) or (host, port) tuple
+        @param nickname: used to name the logger and command ids
+        @param event_queue_size: bound of the default event stream; once
+                                 nobody reads it, the oldest events are
+                                 dropped (0 = unbounded)
+        @note No connection is established, this is done by connect()
+        """
+        self._address = address
+        self._nickname = nickname
+        if nickname:
+            self.logger = logging.getLogger('QMP').getChild(nickname)
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional['asyncio.Task[None]'] = None
+        self._pending: Dict[str, 'asyncio.Future[Dict[str, Any]]'] = {}
+        self._ids = itertools.count(1)
+        self._listeners: Set[EventListener] = set()
+        self.greeting: Optional[Dict[str, Any]] = None
+        #: Default stream of every event received on this connection
+        self.events = self.listen(maxsize=event_queue_size)
+
+    async def connect(self, negotiate: bool = True,
+                      timeout: Optional[float] = 15.0) -> Optional[Dict[str, Any]]:
+        """
+        Connect to the QMP monitor and perform capabilities negotiation.
+
+        @return QMP greeting dict, or None if negotiate is false
+        @raise QMPConnectError if the greeting is not received
+        @raise QMPCapabilitiesError if fails to negotiate capabilities
+        """
+        if isinstance(self._address, tuple):
+            opening = asyncio.open_connection(*self._address)
+        else:
+            opening = asyncio.open_unix_connection(self._address)
+        try:
+            self._reader, self._writer = await asyncio.wait_for(opening, timeout)
+        except asyncio.TimeoutError:
+            raise QMPTimeoutError("Timeout connecting to %s" % (self._address,))
+
+        for listener in self._listeners:
+            listener.reopen()
+        greeting_future = asyncio.get_event_loop().create_future()
+        self._pending['__greeting__'] = greeting_future
+        self._reader_task = asyncio.ensure_future(self._read_loop())
+        if not negotiate:
+            self._pending.pop('__greeting__').cancel()
+            return None
+        try:
+            self.greeting = await asyncio.wait_for(greeting_future, timeout)
+        except asyncio.TimeoutError:
+            raise QMPConnectError("No QMP greeting received")
+        try:
+            await self.execute('qmp_capabilities', timeout=timeout)
+        except QMPResponseError:
+            raise QMPCapabilitiesError
+        return self.greeting
+
+    def listen(self, names: Optional[List[str]] = None,
+               maxsize: int = 0) -> EventListener:
+        """
+        Subscribe to events; names restricts the stream to those events.
+        """
+        listener = EventListener(names, maxsize)
+        self._listeners.add(listener)
+        return listener
+
+    def unlisten(self, listener: EventListener) -> None:
+        """
+        Remove a subscription created by listen().
+        """
+        self._listeners.discard(listener)
+
+    async def _read_loop(self) -> None:
+        assert self._reader is not None
+        buf = MessageBuffer()
+        error: Optional[BaseException] = None
+        try:
+            while True:
+                data = await self._reader.read(self.read_size)
+                if not data:
+                    break
+                buf.feed(data)
+                while True:
+                    msg = buf.pop()
+                    if msg is None:
+                        break
+                    self._dispatch(msg)
+        except asyncio.CancelledError:
+            error = QMPConnectError("Connection closed")
+            raise
+        except (OSError, ValueError) as err:
+            error = err
+        finally:
+            self._fail_pending(error or QMPConnectError("Connection closed by QEMU"))
+            for listener in self._listeners:
+                listener.close()
+
+    def _dispatch(self, msg: Dict[str, Any]) -> None:
+        if 'event' in msg:
+            self.logger.debug("<<< %s", msg)
+            for listener in list(self._listeners):
+                listener.put(msg)
+            return
+        if 'QMP' in msg:
+            key = '__greeting__'
+        else:
+            self.logger.debug("<<< %s", msg)
+            key = msg.get('id')
+        future = self._pending.pop(key, None) if isinstance(key, str) else None
+        if future is None:
+            # Reply to a cancelled or timed-out command
+            self.logger.debug("Discarding unmatched reply %s", msg)
+        elif not future.done():
+            future.set_result(msg)
+
+    def _fail_pending(self, error: BaseException) -> None:
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(QMPConnectError(str(error)))
+
+    async def execute_obj(self, qmp_cmd: Dict[str, Any],
+                          timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Send a QMP command object and wait for its reply.
+
+        An "id" is assigned if the command has none.  Cancelling the
+        caller, or a timeout, forgets the command: its reply is dropped
+        when it arrives.
+
+        @return the full reply dict
+        @raise QMPTimeoutError if timeout elapses first
+        @raise QMPConnectError if the connection is lost
+        """
+        if self._writer is None or self._reader_task is None or \
+                self._reader_task.done():
+            raise QMPConnectError("Not connected")
+        qmp_cmd = dict(qmp_cmd)
+        if 'id' not in qmp_cmd:
+            qmp_cmd['id'] = "%s-%d" % (self._nickname or 'aqmp', next(self._ids))
+        cmd_id = qmp_cmd['id']
+        if not isinstance(cmd_id, str) or cmd_id in self._pending:
+            raise ValueError("Command id must be a unique string: %r" % (cmd_id,))
+
+        future = asyncio.get_event_loop().create_future()
+        self._pending[cmd_id] = future
+        self.logger.debug(">>> %s", qmp_cmd)
+        self._writer.write(json.dumps(qmp_cmd).encode('utf-8'))
+        try:
+            await self._writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise QMPTimeoutError("Timeout waiting for reply to %s"
+                                  % qmp_cmd['execute'])
+        finally:
+            self._pending.pop(cmd_id, None)
+
+    async def execute(self, name: str, arguments: Optional[Dict[str, Any]] = None,
+                      timeout: Optional[float] = None) -> Any:
+        """
+        Run a QMP command and return its "return" value.
+
+        @raise QMPResponseError if QEMU replied with an error
+        """
+        qmp_cmd: Dict[str, Any] = {'execute': name}
+        if arguments:
+            qmp_cmd['arguments'] = arguments
+        reply = await self.execute_obj(qmp_cmd, timeout)
+        if 'error' in reply:
+            raise QMPResponseError(reply)
+        return reply['return']
+
+    async def command(self, cmd: str, **kwds: Any) -> Any:
+        """
+        Keyword-argument form of execute(), like QEMUMonitorProtocol.command.
+        """
+        return await self.execute(cmd, kwds)
+
+    async def wait_closed(self) -> None:
+        """
+        Wait until the connection is lost or closed.
+        """
+        if self._reader_task is not None:
+            try:
+                await asyncio.shield(self._reader_task)
+            except asyncio.CancelledError:
+                if not self._reader_task.cancelled():
+                    raise
+
+    async def close(self) -> None:
+        """
+        Close the connection; commands still in flight fail with
+        QMPConnectError.
+        """
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            # StreamWriter.wait_closed() is new in Python 3.7
+            if hasattr(self._writer, 'wait_closed'):
+                try:
+                    await self._writer.wait_closed()
+                except OSError:
+                    pass
+            self._writer = None
+        for listener in self._listeners:
+            listener.close()
+
+    async def __aenter__(self) -> 'AsyncQEMUMonitorProtocol':
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
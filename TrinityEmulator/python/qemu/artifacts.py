@@ -0,0 +1,332 @@
+"""
+QEMU artifacts module:
+
+The artifacts module provides ArtifactStore, a local content-addressed
+cache for guest images and ISOs.  Objects are keyed by SHA-256; URLs and
+imported local files are only aliases to a digest, so the same bytes are
+stored once no matter how many test VMs or Trinity VMs ask for them.
+"""
+
+# Copyright (C) 2025 Trinity Emulator authors
+#
+# This work is licensed under the terms of the GNU GPL, version 2.  See
+# the COPYING file in the top-level directory.
+#
+
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+from typing import Dict, List, Optional
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_ROOT = os.environ.get(
+    "QEMU_ARTIFACT_STORE", os.path.expanduser("~/.cache/qemu-vm/artifacts"))
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+class ArtifactStoreError(Exception):
+    """
+    Exception raised when an artifact cannot be fetched or verified.
+    """
+
+
+def file_digest(path: str, algorithm: str = "sha256") -> str:
+    """
+    Stream a file through hashlib and return its hex digest.
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def clone_file(src: str, dst: str, allow_copy: bool = True) -> Optional[str]:
+    """
+    Copy src to dst, sharing extents (reflink) when the filesystem allows it.
+
+    @param allow_copy: fall back to copying the bytes; if false and the
+                       extents cannot be shared, dst is left empty
+    @return "reflink", "copy", or None if no copy was allowed
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return "reflink"
+        except OSError:
+            if not allow_copy:
+                return None
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+            return "copy"
+
+
+class ArtifactStore:
+    """
+    Content-addressed store with hardlink/reflink materialization and
+    LRU eviction.
+
+    Layout under root:
+      objects/ab/cdef...  read-only object, mtime = last use
+      index.json          URL and local-file aliases to digests
+      tmp/                partial downloads and imports
+    """
+
+    def __init__(self, root: str = DEFAULT_ROOT,
+                 max_bytes: Optional[int] = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._objects = os.path.join(root, "objects")
+        self._tmp = os.path.join(root, "tmp")
+        self._index = os.path.join(root, "index.json")
+        os.makedirs(self._objects, exist_ok=True)
+        os.makedirs(self._tmp, exist_ok=True)
+
+    def _lock(self):
+        lock = open(os.path.join(self.root, "lock"), "w")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _load_index(self) -> Dict[str, Dict]:
+        try:
+            with open(self._index, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("urls", {})
+        index.setdefault("files", {})
+        return index
+
+    def _save_index(self, index: Dict[str, Dict]) -> None:
+        tmp = self._index + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp, self._index)
+
+    def path(self, digest: str) -> str:
+        """
+        Object path for a digest (which may not exist yet).
+        """
+        return os.path.join(self._objects, digest[:2], digest[2:])
+
+    def same_filesystem(self, path: str) -> bool:
+        """
+        True if path is on the store's filesystem, so that objects can be
+        hardlinked there instead of copied.
+        """
+        return os.stat(path).st_dev == os.stat(self.root).st_dev
+
+    def has(self, digest: Optional[str]) -> bool:
+        """
+        True if the object is present.
+        """
+        return bool(digest) and os.path.exists(self.path(digest))
+
+    def _touch(self, digest: str) -> str:
+        path = self.path(digest)
+        os.utime(path)
+        return path
+
+    def _commit(self, tmp: str, digest: str) -> str:
+        """
+        Move a verified temporary file into place as a read-only object.
+        """
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.unlink(tmp)
+            return self._touch(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, path)
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes, keep=[digest])
+        return path
+
+    def add_file(self, src: str, sha256: Optional[str] = None,
+                 move: bool = False,
+                 reflink_only: bool = False) -> Optional[str]:
+        """
+        Import a local file and return its digest.
+
+        Re-importing an unchanged file (same inode, size and mtime) is
+        answered from the index without hashing it again.  Unless move is
+        set, the source is left untouched: the object is a reflink or a
+        copy, never a hardlink, so later writes to src cannot corrupt it.
+        With move, src is renamed into the store, or cloned and removed
+        when it is on another filesystem.
+
+        @param reflink_only: do not import src if that would take a full
+                             copy of its bytes; None is returned instead
+        """
+        src = os.path.realpath(src)
+        st = os.stat(src)
+        signature = [st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns]
+        with self._lock():
+            index = self._load_index()
+            known = index["files"].get(src)
+            if known and known["signature"] == signature and \
+                    self.has(known["sha256"]):
+                self._touch(known["sha256"])
+                return known["sha256"]
+
+        digest = file_digest(src)
+        if sha256 and digest != sha256:
+            raise ArtifactStoreError("%s: sha256 mismatch (%s != %s)"
+                                     % (src, digest, sha256))
+        if not self.has(digest):
+            tmp = os.path.join(self._tmp, "%s.%d" % (digest, os.getpid()))
+            moved = False
+            if move:
+                try:
+                    os.replace(src, tmp)
+                    moved = True
+                except OSError as exc:
+                    if exc.errno != errno.EXDEV:
+                        raise
+            if not moved and \
+                    clone_file(src, tmp, allow_copy=not reflink_only) is None:
+                os.unlink(tmp)
+                return None
+            self._commit(tmp, digest)
+        if move and os.path.exists(src):
+            os.unlink(src)
+
+        with self._lock():
+            index = self._load_index()
+            if not move:
+                index["files"][src] = {"signature": signature,
+                                       "sha256": digest}
+            self._save_index(index)
+        self._touch(digest)
+        return digest
+
+    def fetch(self, url: str, sha256: Optional[str] = None,
+              sha512: Optional[str] = None, stdout=None, stderr=None) -> str:
+        """
+        Return the object path for url, downloading it only if neither the
+        expected digest nor a previous download of the URL is in the store.
+        """
+        with self._lock():
+            digest = sha256 or self._load_index()["urls"].get(url)
+        if self.has(digest) and \
+                (not sha512 or file_digest(self.path(digest), "sha512") == sha512):
+            return self._touch(digest)
+
+        partial = os.path.join(
+            self._tmp, hashlib.sha1(url.encode("utf-8")).hexdigest())
+        LOG.debug("Downloading %s to %s...", url, partial)
+        subprocess.check_call(["wget", "-c", url, "-O", partial],
+                              stdout=stdout, stderr=stderr)
+        if sha512 and file_digest(partial, "sha512") != sha512:
+            os.unlink(partial)
+            raise ArtifactStoreError("%s: sha512 mismatch" % url)
+        try:
+            digest = self.add_file(partial, sha256=sha256, move=True)
+        except ArtifactStoreError:
+            os.unlink(partial)
+            raise
+
+        with self._lock():
+            index = self._load_index()
+            index["urls"][url] = digest
+            self._save_index(index)
+        return self.path(digest)
+
+    def materialize(self, digest: str, dest: str,
+                    writable: bool = False) -> str:
+        """
+        Make the object available at dest without duplicating its bytes.
+
+        Read-only consumers get a hardlink; writable ones get a reflink,
+        falling back to a plain copy across filesystems or on filesystems
+        without extent sharing.
+
+        @return "hardlink", "reflink" or "copy"
+        """
+        src = self._touch(digest)
+        tmp = dest + ".materialize"
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        method = None
+        if not writable:
+            try:
+                os.link(src, tmp)
+                method = "hardlink"
+            except OSError as exc:
+                if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+        if method is None:
+            method = clone_file(src, tmp)
+            os.chmod(tmp, 0o644 if writable else 0o444)
+        os.replace(tmp, dest)
+        return method
+
+    def objects(self) -> List[Dict]:
+        """
+        All objects, least recently used first.
+        """
+        entries = []
+        for prefix in os.listdir(self._objects):
+            directory = os.path.join(self._objects, prefix)
+            for name in os.listdir(directory):
+                st = os.stat(os.path.join(directory, name))
+                entries.append({"sha256": prefix + name, "size": st.st_size,
+                                "last_used": st.st_mtime,
+                                "links": st.st_nlink})
+        return sorted(entries, key=lambda entry: entry["last_used"])
+
+    def usage(self) -> int:
+        """
+        Bytes held by the store.
+        """
+        return sum(entry["size"] for entry in self.objects())
+
+    def evict(self, max_bytes: int, keep: Optional[List[str]] = None) -> List[str]:
+        """
+        Remove least recently used objects until the store fits max_bytes.
+
+        Objects still hardlinked elsewhere are skipped: dropping them would
+        free nothing.  Aliases pointing at evicted digests are pruned.
+        """
+        keep = set(keep or [])
+        evicted = []
+        with self._lock():
+            entries = self.objects()
+            total = sum(entry["size"] for entry in entries)
+            for entry in entries:
+                if total <= max_bytes:
+                    break
+                if entry["sha256"] in keep or entry["links"] > 1:
+                    continue
+                os.unlink(self.path(entry["sha256"]))
+                total -= entry["size"]
+                evicted.append(entry["sha256"])
+            if evicted:
+                index = self._load_index()
+                for table in ("urls", "files"):
+                    index[table] = {
+                        key: value for key, value in index[table].items()
+                        if (value if table == "urls" else value["sha256"])
+                        not in evicted}
+                self._save_index(index)
+        for digest in evicted:
+            LOG.debug("Evicted %s", digest)
+        return evicted
+
+    def gc_tmp(self, max_age: float = 86400.0) -> None:
+        """
+        Remove partial downloads older than max_age seconds.
+        """
+        now = time.time()
+        for name in os.listdir(self._tmp):
+            path = os.path.join(self._tmp, name)
+            if now - os.path.getmtime(path) > max_age:
+                os.unlink(path)
@@ -0,0 +1,302 @@
+"""
+QEMU output capture
+
+OutputCapture drains a QEMU output stream (the stdout/stderr pipe or a
+console socket) in a background thread.  It keeps only the last bytes in
+memory, writes everything to a size-rotated log, and lets tests follow the
+output line by line or register callbacks on patterns while QEMU runs.
+"""
+
+# Copyright (C) 2025 Trinity Emulator authors
+#
+# This work is licensed under the terms of the GNU GPL, version 2.  See
+# the COPYING file in the top-level directory.
+#
+
+import logging
+import os
+import queue
+import re
+import socket
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+    List,
+    Optional,
+    Pattern,
+    Union,
+)
+
+LOG = logging.getLogger(__name__)
+
+# Pushed to line subscribers when the stream ends
+_EOF = object()
+
+
+class OutputCapture:
+    """
+    Bounded, streaming capture of one output stream.
+    """
+
+    #: Bytes requested from the source per read
+    read_size = 65536
+
+    #: A line longer than this is delivered in pieces
+    max_line = 65536
+
+    def __init__(self, source: Any, log_path: Optional[str] = None,
+                 ring_size: int = 1 << 20,
+                 log_max_bytes: Optional[int] = None,
+                 log_backups: int = 1, name: Optional[str] = None,
+                 close: bool = False):
+        """
+        Start capturing source.
+
+        @param source: socket, binary file object or file descriptor
+        @param log_path: file receiving all output (None = no log)
+        @param ring_size: bytes of most recent output kept in memory
+        @param log_max_bytes: rotate the log when it reaches this size;
+                              log_path.1 .. log_path.N keep log_backups
+                              older generations (None = never rotate)
+        @param name: thread name, for debugging
+        @param close: close source once it reaches EOF; closing it from
+                      another thread while a read is pending is unsafe
+        """
+        if isinstance(source, socket.socket):
+            self._read = lambda: source.recv(self.read_size)
+        else:
+            fd = source if isinstance(source, int) else source.fileno()
+            self._read = lambda: os.read(fd, self.read_size)
+        self._close_source = source.close if close else None
+        self.ring_size = ring_size
+        self.log_path = log_path
+        self.log_max_bytes = log_max_bytes
+        self.log_backups = log_backups
+        #: Total bytes captured
+        self.total_bytes = 0
+        #: Lines dropped because a subscriber queue was full
+        self.dropped_lines = 0
+        self._ring = bytearray()
+        self._lock = threading.Lock()
+        self._log = open(log_path, 'wb') if log_path else None
+        self._log_bytes = 0
+        self._subscribers: List['queue.Queue[Any]'] = []
+        self._callbacks: List[List[Any]] = []
+        self._eof = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name,
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        pending = b''
+        try:
+            while True:
+                try:
+                    data = self._read()
+                except socket.timeout:
+                    continue
+                if not data:
+                    break
+                self._record(data)
+                pending += data
+                *lines, pending = pending.split(b'\n')
+                while len(pending) > self.max_line:
+                    lines.append(pending[:self.max_line])
+                    pending = pending[self.max_line:]
+                for line in lines:
+                    self._dispatch(line)
+        except (OSError, ValueError):
+            # Source closed under us (e.g. the console socket on shutdown)
+            pass
+        finally:
+            if pending:
+                self._dispatch(pending)
+            with self._lock:
+                self._eof.set()
+                for subscriber in self._subscribers:
+                    self._offer(subscriber, _EOF)
+                if self._log is not None:
+                    self._log.close()
+                    self._log = None
+            if self._close_source is not None:
+                self._close_source()
+
+    def _record(self, data: bytes) -> None:
+        with self._lock:
+            self.total_bytes += len(data)
+            self._ring += data
+            excess = len(self._ring) - self.ring_size
+            if excess > 0:
+                del self._ring[:excess]
+            if self._log is not None:
+                self._log.write(data)
+                self._log.flush()
+                self._log_bytes += len(data)
+                if self.log_max_bytes is not None and \
+                        self._log_bytes >= self.log_max_bytes:
+                    self._rotate()
+
+    def _rotate(self) -> None:
+        assert self._log is not None and self.log_path is not None
+        self._log.close()
+        if self.log_backups > 0:
+            for index in range(self.log_backups - 1, 0, -1):
+                older = '%s.%d' % (self.log_path, index)
+                if os.path.exists(older):
+                    os.replace(older, '%s.%d' % (self.log_path, index + 1))
+            os.replace(self.log_path, self.log_path + '.1')
+        self._log = open(self.log_path, 'wb')
+        self._log_bytes = 0
+
+    def _offer(self, subscriber: 'queue.Queue[Any]', item: Any) -> None:
+        while True:
+            try:
+                subscriber.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    subscriber.get_nowait()
+                    self.dropped_lines += 1
+                except queue.Empty:
+                    pass
+
+    def _dispatch(self, raw: bytes) -> None:
+        line = raw.rstrip(b'\r').decode('utf-8', errors='replace')
+        with self._lock:
+            subscribers = list(self._subscribers)
+            callbacks = list(self._callbacks)
+        for subscriber in subscribers:
+            self._offer(subscriber, line)
+        for entry in callbacks:
+            pattern, callback, once = entry
+            match = pattern.search(line)
+            if match is None:
+                continue
+            if once:
+                with self._lock:
+                    if entry not in self._callbacks:
+                        continue
+                    self._callbacks.remove(entry)
+            try:
+                callback(match, line)
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception("Output callback for %r failed",
+                              pattern.pattern)
+
+    def on_match(self, pattern: Union[str, Pattern[str]],
+                 callback: Callable[[Any, str], None],
+                 once: bool = False) -> Any:
+        """
+        Call callback(match, line) from the capture thread for every new
+        line matching pattern (only the first one if once is set).
+
+        @return a handle for remove_callback()
+        """
+        entry = [re.compile(pattern), callback, once]
+        with self._lock:
+            self._callbacks.append(entry)
+        return entry
+
+    def remove_callback(self, handle: Any) -> None:
+        """
+        Unregister a callback added by on_match().
+        """
+        with self._lock:
+            if handle in self._callbacks:
+                self._callbacks.remove(handle)
+
+    def lines(self, timeout: Optional[float] = None,
+              maxsize: int = 10000) -> Iterator[str]:
+        """
+        Iterate over lines captured from now on, until the stream ends.
+
+        Subscription happens on the call, not on the first next(), so no
+        line is lost in between.  If the consumer falls more than maxsize
+        lines behind, the oldest are dropped and counted in dropped_lines.
+
+        @raise TimeoutError if no line arrives within timeout seconds
+        """
+        subscriber: 'queue.Queue[Any]' = queue.Queue(maxsize)
+        with self._lock:
+            if self._eof.is_set():
+                subscriber.put(_EOF)
+            self._subscribers.append(subscriber)
+
+        def follow():
+            try:
+                while True:
+                    try:
+                        line = subscriber.get(timeout=timeout)
+                    except queue.Empty:
+                        raise TimeoutError("No output for %s seconds"
+                                           % timeout)
+                    if line is _EOF:
+                        return
+                    yield line
+            finally:
+                with self._lock:
+                    self._subscribers.remove(subscriber)
+
+        return follow()
+
+    def wait_for(self, pattern: Union[str, Pattern[str]],
+                 timeout: Optional[float] = None) -> Any:
+        """
+        Wait for a new line matching pattern.
+
+        @return the re match object
+        @raise TimeoutError if nothing matches within timeout seconds
+        @raise EOFError if the stream ends first
+        """
+        found = threading.Event()
+        result = []
+
+        def matched(match, _line):
+            result.append(match)
+            found.set()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        handle = self.on_match(pattern, matched, once=True)
+        try:
+            while not found.wait(0.05):
+                # Lines are dispatched before EOF is flagged, so a match on
+                # the last line has already set found.
+                if self._eof.is_set() and not found.is_set():
+                    raise EOFError("Output ended before %r" % pattern)
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError("Timeout waiting for %r" % pattern)
+        finally:
+            self.remove_callback(handle)
+        return result[0]
+
+    def tail(self) -> bytes:
+        """
+        The last ring_size bytes of output.
+        """
+        with self._lock:
+            return bytes(self._ring)
+
+    def text(self) -> str:
+        """
+        tail() decoded as text.
+        """
+        return self.tail().decode('utf-8', errors='replace')
+
+    @property
+    def closed(self) -> bool:
+        """
+        True once the stream has ended.
+        """
+        return self._eof.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the stream to end.
+
+        @return False if it is still open after timeout seconds
+        """
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
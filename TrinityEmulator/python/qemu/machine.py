@@ -18,16 +18,20 @@ which provides facilities for managing the lifetime of a QEMU VM.
 #
 
 import errno
+import json
 import logging
 import os
+import shlex
 import subprocess
 import shutil
 import socket
 import tempfile
+import time
 from typing import Optional, Type
 from types import TracebackType
 
 from . import qmp
+from .capture import OutputCapture
 
 LOG = logging.getLogger(__name__)
 
@@ -75,7 +79,9 @@ class QEMUMachine:
 
     def __init__(self, binary, args=None, wrapper=None, name=None,
                  test_dir="/var/tmp", monitor_address=None,
-                 socket_scm_helper=None, sock_dir=None):
+                 socket_scm_helper=None, sock_dir=None, max_events=None,
+                 log_ring_size=1 << 20, log_max_bytes=64 << 20,
+                 qmp_latency=None):
         '''
         Initialize a QEMUMachine
 
@@ -86,6 +92,10 @@ class QEMUMachine:
         @param test_dir: where to create socket and log file
         @param monitor_address: address for QMP monitor
         @param socket_scm_helper: helper program, required for send_fd_scm()
+        @param max_events: bound on queued QMP events (None = unbounded)
+        @param log_ring_size: bytes of QEMU output kept in memory for get_log()
+        @param log_max_bytes: size at which the output log file is rotated
+        @param qmp_latency: QMPLatencyStats recording QMP command latency
         @note: Qemu process is not started until launch() is used.
         '''
         if args is None:
@@ -100,12 +110,17 @@ class QEMUMachine:
         self._monitor_address = monitor_address
         self._vm_monitor = None
         self._qemu_log_path = None
-        self._qemu_log_file = None
+        self._log_ring_size = log_ring_size
+        self._log_max_bytes = log_max_bytes
+        self._output = None
+        self._console_capture = None
         self._popen = None
         self._binary = binary
         self._args = list(args)     # Force copy args in case we modify them
         self._wrapper = wrapper
-        self._events = []
+        self._max_events = max_events
+        self._events = qmp.EventStore(max_events)
+        self._qmp_latency = qmp_latency
         self._iolog = None
         self._socket_scm_helper = socket_scm_helper
         self._qmp_set = True   # Enable QMP monitor by default.
@@ -122,6 +137,9 @@ class QEMUMachine:
         self._console_address = None
         self._console_socket = None
         self._remove_files = []
+        self._template_memory = None
+        self._template_args = []
+        self._incoming = False
 
     def __enter__(self):
         return self
@@ -230,9 +248,11 @@ class QEMUMachine:
         return self._popen.pid
 
     def _load_io_log(self):
-        if self._qemu_log_path is not None:
-            with open(self._qemu_log_path, "r") as iolog:
-                self._iolog = iolog.read()
+        if self._output is not None:
+            # A child process inheriting QEMU's stdout may keep it open
+            if not self._output.wait(timeout=5):
+                LOG.debug("QEMU output still open after exit")
+            self._iolog = self._output.text()
 
     def _base_args(self):
         args = ['-display', 'none', '-vga', 'none']
@@ -261,12 +281,23 @@ class QEMUMachine:
             else:
                 device = '%s,chardev=console' % self._console_device_type
                 args.extend(['-device', device])
+        if self._template_memory is not None:
+            path, size, share = self._template_memory
+            backend = ('memory-backend-file,id=template-ram,size=%s,'
+                       'mem-path=%s,share=%s' %
+                       (size, os.path.join(path, 'memory'),
+                        'on' if share else 'off'))
+            args.extend(['-object', backend,
+                         '-machine', 'memory-backend=template-ram',
+                         '-m', size])
+        args.extend(self._template_args)
+        if self._incoming:
+            args.extend(['-incoming', 'defer'])
         return args
 
     def _pre_launch(self):
         self._temp_dir = tempfile.mkdtemp(dir=self._test_dir)
         self._qemu_log_path = os.path.join(self._temp_dir, self._name + ".log")
-        self._qemu_log_file = open(self._qemu_log_path, 'wb')
 
         if self._qmp_set:
             if self._monitor_address is not None:
@@ -276,16 +307,26 @@ class QEMUMachine:
                                                 self._name + "-monitor.sock")
                 self._remove_files.append(self._vm_monitor)
             self._qmp = qmp.QEMUMonitorProtocol(self._vm_monitor, server=True,
-                                                nickname=self._name)
+                                                nickname=self._name,
+                                                max_events=self._max_events,
+                                                latency=self._qmp_latency)
 
     def _post_launch(self):
         if self._qmp:
             self._qmp.accept()
 
     def _post_shutdown(self):
-        if self._qemu_log_file is not None:
-            self._qemu_log_file.close()
-            self._qemu_log_file = None
+        if self._console_capture is not None:
+            if not self._console_capture.wait(timeout=1) and \
+                    self._console_socket is not None:
+                # QEMU is gone but the console did not reach EOF: wake
+                # the capture, which then closes the socket itself
+                try:
+                    self._console_socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                self._console_capture.wait(timeout=1)
+            self._console_socket = None
 
         self._qemu_log_path = None
 
@@ -307,6 +348,8 @@ class QEMUMachine:
 
         self._iolog = None
         self._qemu_full_args = None
+        self._output = None
+        self._console_capture = None
         try:
             self._launch()
             self._launched = True
@@ -331,10 +374,16 @@ class QEMUMachine:
         LOG.debug('VM launch command: %r', ' '.join(self._qemu_full_args))
         self._popen = subprocess.Popen(self._qemu_full_args,
                                        stdin=devnull,
-                                       stdout=self._qemu_log_file,
+                                       stdout=subprocess.PIPE,
                                        stderr=subprocess.STDOUT,
                                        shell=False,
                                        close_fds=False)
+        self._output = OutputCapture(self._popen.stdout,
+                                     log_path=self._qemu_log_path,
+                                     ring_size=self._log_ring_size,
+                                     log_max_bytes=self._log_max_bytes,
+                                     name=self._name + "-output",
+                                     close=True)
         self._post_launch()
 
     def wait(self):
@@ -353,8 +402,9 @@ class QEMUMachine:
         """
         # If we keep the console socket open, we may deadlock waiting
         # for QEMU to exit, while QEMU is waiting for the socket to
-        # become writeable.
-        if self._console_socket is not None:
+        # become writeable.  A console capture keeps draining it and owns
+        # it (closing it under a pending recv() is unsafe), so leave it be.
+        if self._console_socket is not None and self._console_capture is None:
             self._console_socket.close()
             self._console_socket = None
 
@@ -435,7 +485,7 @@ class QEMUMachine:
         Poll for one queued QMP events and return it
         """
         if self._events:
-            return self._events.pop(0)
+            return self._events.popleft()
         return self._qmp.pull_event(wait=wait)
 
     def get_qmp_events(self, wait=False):
@@ -443,11 +493,19 @@ class QEMUMachine:
         Poll for queued QMP events and return a list of dicts
         """
         events = self._qmp.get_events(wait=wait)
-        events.extend(self._events)
-        del self._events[:]
+        events.extend(self._events.drain())
         self._qmp.clear_events()
         return events
 
+    def dropped_qmp_events(self):
+        """
+        Number of QMP events discarded because an event store was full
+        """
+        dropped = self._events.dropped
+        if self._qmp is not None:
+            dropped += self._qmp.dropped_events()
+        return dropped
+
     @staticmethod
     def event_match(event, match=None):
         """
@@ -501,17 +559,20 @@ class QEMUMachine:
                 See event_match for details.
         timeout: QEMUMonitorProtocol.pull_event timeout parameter.
         """
+        matchers = {}
+        for name, match in events:
+            matchers.setdefault(name, []).append(match)
+
         def _match(event):
-            for name, match in events:
-                if event['event'] == name and self.event_match(event, match):
-                    return True
-            return False
+            return any(self.event_match(event, match)
+                       for match in matchers.get(event['event'], ()))
 
-        # Search cached events
-        for event in self._events:
-            if _match(event):
-                self._events.remove(event)
-                return event
+        # Search cached events, then events QMP has already read
+        event = self._events.pop_match(matchers, _match)
+        if event is None:
+            event = self._qmp.pull_matching_event(matchers, _match)
+        if event is not None:
+            return event
 
         # Poll for new events
         while True:
@@ -525,10 +586,39 @@ class QEMUMachine:
     def get_log(self):
         """
         After self.shutdown or failed qemu execution, this returns the output
-        of the qemu process.
+        of the qemu process (its last log_ring_size bytes).
         """
         return self._iolog
 
+    @property
+    def output(self):
+        """
+        OutputCapture of QEMU's stdout and stderr while the VM runs, for
+        following them with lines() or on_match()
+        """
+        return self._output
+
+    def capture_console(self, log_path=None, ring_size=1 << 20,
+                        log_max_bytes=64 << 20):
+        """
+        Start capturing the console (see set_console()) in the background
+        and return its OutputCapture.  Once capturing, read the console
+        through the capture, not console_socket.  The capture owns the
+        socket and closes it once QEMU closes the console.
+
+        @param log_path: console log file (default: in the VM temporary
+                         directory, removed on shutdown)
+        """
+        if self._console_capture is None:
+            if log_path is None:
+                log_path = os.path.join(self._temp_dir,
+                                        self._name + "-console.log")
+            self._console_capture = OutputCapture(
+                self.console_socket, log_path=log_path, ring_size=ring_size,
+                log_max_bytes=log_max_bytes, name=self._name + "-console",
+                close=True)
+        return self._console_capture
+
     def add_args(self, *args):
         """
         Adds to the list of extra arguments to be given to the QEMU binary
@@ -574,6 +664,130 @@ class QEMUMachine:
         self._console_device_type = device_type
         self._console_index = console_index
 
+    def set_template_memory(self, path, size):
+        """
+        Back guest RAM with a shared file in the template directory path,
+        so that save_template() can turn this machine into a template.
+
+        @param path: template directory; best on tmpfs or hugetlbfs
+        @param size: guest RAM size, in -m syntax (e.g. "2048M")
+        @note: call this function before launch().
+        """
+        os.makedirs(path, exist_ok=True)
+        self._template_memory = (os.path.abspath(path), size, True)
+
+    def _wait_migration(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.command('query-migrate').get('status')
+            if status == 'completed':
+                return
+            if status in ('failed', 'cancelled'):
+                raise QEMUMachineError("Migration %s" % status)
+            if time.monotonic() > deadline:
+                raise QEMUMachineError("Timeout waiting for migration")
+            time.sleep(0.01)
+
+    @staticmethod
+    def _drive_options(value):
+        return dict(option.partition('=')[::2] for option in value.split(','))
+
+    def _clone_args(self):
+        """
+        The template's arguments with every writable -drive opened with
+        snapshot=on, so clones never write to the template's disks.
+        """
+        args = list(self._args)
+        for index, arg in enumerate(args[:-1]):
+            if arg != '-drive':
+                continue
+            options = self._drive_options(args[index + 1])
+            if options.get('readonly') != 'on' and \
+                    options.get('snapshot') != 'on':
+                args[index + 1] += ',snapshot=on'
+        return args
+
+    def save_template(self, timeout=300.0):
+        """
+        Save this machine, paused, as a template for launch_from_template().
+
+        Guest RAM already lives in the template memory file, so with
+        x-ignore-shared only device state is written out.  Disk contents
+        are not copied: stopping the machine flushes them to its images,
+        which must therefore persist (e.g. qcow2 overlays kept next to the
+        template); clones open them with snapshot=on.  The machine is left
+        paused; it should be shut down, not resumed, since resuming it
+        would modify the template RAM and disks under its clones.
+
+        @note: requires set_template_memory() before launch().
+        @raise QEMUMachineError if a writable disk uses snapshot=on: the
+               clones' RAM and page cache would assume writes that were
+               thrown away
+        """
+        if self._template_memory is None or not self._template_memory[2]:
+            raise QEMUMachineError("Guest RAM is not template memory, "
+                                   "call set_template_memory() before launch()")
+        throwaway = '-snapshot' in self._args or any(
+            prev == '-drive' and
+            self._drive_options(arg).get('snapshot') == 'on' and
+            self._drive_options(arg).get('readonly') != 'on'
+            for prev, arg in zip(self._args, self._args[1:]))
+        if throwaway:
+            raise QEMUMachineError("Template disks must persist their writes, "
+                                   "boot the template without snapshot=on")
+        path, size, _ = self._template_memory
+        state = os.path.join(path, 'state')
+        self.command('stop')
+        self.command('migrate-set-capabilities', capabilities=[
+            {'capability': 'x-ignore-shared', 'state': True}])
+        self.command('migrate', uri='exec:cat > %s' % shlex.quote(state + '.tmp'))
+        self._wait_migration(timeout)
+        os.replace(state + '.tmp', state)
+        template = {'size': size, 'machine': self._machine,
+                    'args': self._clone_args()}
+        with open(os.path.join(path, 'template.json'), 'w') as outfile:
+            json.dump(template, outfile, indent=2)
+
+    def launch_from_template(self, path, start=True, timeout=60.0):
+        """
+        Launch the VM as a clone of the template saved in path.
+
+        The clone gets the template's command line, followed by this
+        machine's own arguments, which must not change the guest-visible
+        configuration.  Guest RAM maps the template memory file privately:
+        pages are shared with the template and copied on first write, so
+        only device state is loaded and the clone is ready in milliseconds.
+
+        The template's writable drives are opened with snapshot=on, so the
+        disk state saved with the template is shared by all clones and
+        never modified by them.
+
+        @param start: resume the guest once the state is loaded
+        """
+        path = os.path.abspath(path)
+        with open(os.path.join(path, 'template.json'), 'r') as infile:
+            template = json.load(infile)
+        # Only this launch is a clone: a later launch() starts afresh
+        saved = (self._template_memory, self._template_args,
+                 self._machine, self._incoming)
+        self._template_memory = (path, template['size'], False)
+        self._template_args = template['args']
+        if self._machine is None:
+            self._machine = template['machine']
+        self._incoming = True
+        try:
+            self.launch()
+        finally:
+            (self._template_memory, self._template_args,
+             self._machine, self._incoming) = saved
+        self.command('migrate-set-capabilities', capabilities=[
+            {'capability': 'x-ignore-shared', 'state': True}])
+        self.command('migrate-incoming', uri='exec:cat %s' %
+                     shlex.quote(os.path.join(path, 'state')))
+        self._wait_migration(timeout)
+        if start:
+            self.command('cont')
+
     @property
     def console_socket(self):
         """
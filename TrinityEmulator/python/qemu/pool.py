@@ -0,0 +1,246 @@
+"""
+QEMU machine pool
+
+QEMUMachinePool launches a set of identical QEMUMachine instances in
+parallel and leases them to callers, resetting each machine between
+leases and relaunching it after a configurable number of uses, so test
+suites pay for process start, QMP negotiation and firmware init once per
+machine instead of once per test.
+"""
+
+# Copyright (C) 2025 Trinity Emulator authors
+#
+# This work is licensed under the terms of the GNU GPL, version 2.  See
+# the COPYING file in the top-level directory.
+#
+
+import contextlib
+import itertools
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+)
+
+from . import qmp
+from .machine import QEMUMachine, QEMUMachineError
+
+LOG = logging.getLogger(__name__)
+
+
+class QEMUMachinePool:
+    """
+    Pool of pre-launched, reusable QEMU machines.
+
+    Use it as a context manager::
+
+        def factory(index):
+            return QEMUMachine(binary, args, name='pool-%d' % index)
+
+        with QEMUMachinePool(factory, size=8, max_uses=50) as pool:
+            with pool.lease() as vm:
+                vm.command('query-status')
+            results = pool.map(run_test, tests)
+
+    Between leases a machine is reverted to the snapshot taken right after
+    launch (when snapshot is set; this needs a writable qcow2 disk) or
+    otherwise system_reset, and its pending QMP events are discarded.
+    Machines that exited, failed to reset, were released as broken or
+    reached max_uses are shut down and replaced in the background.
+    """
+
+    def __init__(self, factory: Callable[[int], QEMUMachine],
+                 size: Optional[int] = None,
+                 max_uses: Optional[int] = None,
+                 snapshot: Optional[str] = None):
+        """
+        @param factory: returns a new, not yet launched QEMUMachine; it is
+                        passed a serial number that must be used to make
+                        the machine name (and so its sockets) unique
+        @param size: number of machines (default: host CPU count)
+        @param max_uses: leases before a machine is relaunched
+                         (None = never)
+        @param snapshot: internal snapshot name to savevm after launch and
+                         loadvm on every reset (None = system_reset only)
+        """
+        self._factory = factory
+        self.size = size or os.cpu_count() or 1
+        self.max_uses = max_uses
+        self.snapshot = snapshot
+        self._idle: 'queue.Queue[Any]' = queue.Queue()
+        self._uses: Dict[QEMUMachine, int] = {}
+        self._machines: Set[QEMUMachine] = set()
+        self._lock = threading.Lock()
+        self._serial = itertools.count()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._closed = False
+        #: Counters: machines launched, leases, resets and recycled machines
+        self.stats = {'launched': 0, 'leases': 0, 'resets': 0, 'recycled': 0}
+
+    def __enter__(self) -> 'QEMUMachinePool':
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.shutdown()
+
+    def _hmp(self, vm: QEMUMachine, command_line: str) -> None:
+        # savevm/loadvm only exist in HMP; errors come back as text
+        output = vm.command('human-monitor-command', command_line=command_line)
+        if output.strip():
+            raise QEMUMachineError("%s: %s" % (command_line, output.strip()))
+
+    def _spawn(self) -> QEMUMachine:
+        vm = self._factory(next(self._serial))
+        vm.launch()
+        try:
+            if self.snapshot is not None:
+                self._hmp(vm, 'savevm %s' % self.snapshot)
+        except:
+            vm.shutdown()
+            raise
+        with self._lock:
+            self._machines.add(vm)
+            self._uses[vm] = 0
+            self.stats['launched'] += 1
+        self._idle.put(vm)
+        return vm
+
+    def _respawn(self) -> None:
+        try:
+            self._spawn()
+        except Exception as err:  # pylint: disable=broad-except
+            LOG.warning("Failed to relaunch pooled machine: %s", err)
+            # Hand the failure to the next acquire() instead of letting
+            # callers wait for a machine that will never come.
+            self._idle.put(err)
+
+    def _retire(self, vm: QEMUMachine) -> None:
+        with self._lock:
+            self._machines.discard(vm)
+            self._uses.pop(vm, None)
+        vm.shutdown()
+
+    def _recycle(self, vm: QEMUMachine) -> None:
+        self._retire(vm)
+        with self._lock:
+            self.stats['recycled'] += 1
+        if not self._closed:
+            self._respawn()
+
+    def _reset(self, vm: QEMUMachine) -> None:
+        try:
+            if self.snapshot is not None:
+                self._hmp(vm, 'loadvm %s' % self.snapshot)
+            else:
+                vm.command('system_reset')
+            vm.get_qmp_events()
+        except (qmp.QMPError, QEMUMachineError, OSError) as err:
+            LOG.debug("Reset of %s failed, relaunching: %s", vm, err)
+            self._recycle(vm)
+            return
+        with self._lock:
+            self.stats['resets'] += 1
+        self._idle.put(vm)
+
+    def start(self) -> 'QEMUMachinePool':
+        """
+        Launch all machines concurrently and wait until they are ready.
+
+        @raise the first launch error; machines already up are shut down
+        """
+        self._executor = ThreadPoolExecutor(max_workers=self.size)
+        futures = [self._executor.submit(self._spawn)
+                   for _ in range(self.size)]
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                self.shutdown()
+                raise error
+        return self
+
+    def acquire(self, timeout: Optional[float] = None) -> QEMUMachine:
+        """
+        Lease an idle machine, waiting up to timeout seconds for one.
+
+        @raise QEMUMachineError on timeout, if the pool is shut down or if
+               a replacement machine failed to launch
+        """
+        if self._closed or self._executor is None:
+            raise QEMUMachineError("Machine pool is not running")
+        try:
+            item = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise QEMUMachineError("Timeout waiting for a pooled machine")
+        if isinstance(item, Exception):
+            raise QEMUMachineError("Pooled machine failed to launch") from item
+        with self._lock:
+            self._uses[item] += 1
+            self.stats['leases'] += 1
+        return item
+
+    def release(self, vm: QEMUMachine, broken: bool = False) -> None:
+        """
+        Return a leased machine.  It is reset (or replaced, if broken,
+        dead or worn out) in the background.
+        """
+        if self._closed or self._executor is None:
+            self._retire(vm)
+            return
+        worn_out = self.max_uses is not None and \
+            self._uses.get(vm, 0) >= self.max_uses
+        if broken or worn_out or not vm.is_running():
+            self._executor.submit(self._recycle, vm)
+        else:
+            self._executor.submit(self._reset, vm)
+
+    @contextlib.contextmanager
+    def lease(self, timeout: Optional[float] = None) -> Iterator[QEMUMachine]:
+        """
+        Context manager around acquire()/release(); the machine is
+        replaced if the block raises.
+        """
+        vm = self.acquire(timeout)
+        try:
+            yield vm
+        except:
+            self.release(vm, broken=True)
+            raise
+        self.release(vm)
+
+    def map(self, func: Callable[[QEMUMachine, Any], Any],
+            items: Iterable[Any]) -> List[Any]:
+        """
+        Run func(vm, item) for every item on pooled machines, size at a
+        time, and return the results in order.
+        """
+        def run(item):
+            with self.lease() as vm:
+                return func(vm, item)
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(run, items))
+
+    def shutdown(self) -> None:
+        """
+        Stop handing out machines and shut all of them down.
+        """
+        self._closed = True
+        if self._executor is not None:
+            # Let pending resets and relaunches finish first
+            self._executor.shutdown(wait=True)
+        with self._lock:
+            machines = list(self._machines)
+        if machines:
+            with ThreadPoolExecutor(max_workers=len(machines)) as executor:
+                list(executor.map(self._retire, machines))
+        self._idle = queue.Queue()
@@ -11,13 +11,114 @@ import json
 import errno
 import socket
 import logging
+import time
+from collections import deque
 from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
     Optional,
-    TextIO,
     Type,
+    Union,
 )
 from types import TracebackType
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    perf_counter_ns = time.perf_counter_ns
+except AttributeError:
+    # Python 3.6
+    def perf_counter_ns() -> int:
+        """
+        time.perf_counter() in integer nanoseconds.
+        """
+        return int(time.perf_counter() * 1e9)
+
+
+def json_loads(data: Union[bytes, bytearray, memoryview]) -> Any:
+    """
+    Parse one JSON document from a bytes-like object, using orjson when it
+    is installed (it parses memoryviews in place, without copying).
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+class MessageBuffer:
+    """
+    Byte buffer that splits a QMP stream into messages.
+
+    QEMU terminates every QMP message with CRLF and escapes newlines inside
+    JSON strings, so a message ends at the first b'\\n'.  Data is received
+    straight into a reusable chunk with recv_into, appended to one
+    bytearray, and each message is parsed from a memoryview of it; the
+    search for a terminator resumes where the previous one stopped, so a
+    multi-megabyte reply arriving in many chunks is scanned once.
+    """
+
+    #: Bytes requested from the socket per read
+    read_size = 65536
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+        self._chunk = bytearray(self.read_size)
+        self._scanned = 0
+
+    def __len__(self) -> int:
+        return len(self._buf)
+
+    def feed(self, data: Union[bytes, bytearray, memoryview]) -> None:
+        """
+        Append data received by other means (e.g. an asyncio transport).
+        """
+        self._buf += data
+
+    def recv(self, sock: socket.socket) -> int:
+        """
+        Receive once from sock into the buffer.
+
+        @return number of bytes received, 0 on EOF
+        @raise OSError (including socket.timeout and BlockingIOError) as
+               raised by sock.recv_into; buffered data is kept
+        """
+        count = sock.recv_into(self._chunk)
+        if count:
+            with memoryview(self._chunk) as view, view[:count] as data:
+                self._buf += data
+        return count
+
+    def pop(self) -> Optional[Any]:
+        """
+        Remove and return the next complete message, or None if the buffer
+        holds only part of one.
+        """
+        buf = self._buf
+        while True:
+            end = buf.find(b'\n', self._scanned)
+            if end < 0:
+                self._scanned = len(buf)
+                return None
+            self._scanned = 0
+            # Anything but a stray blank line is at least "{}"
+            if end > 2 or buf[:end].strip():
+                break
+            del buf[:end + 1]
+        with memoryview(buf) as view, view[:end] as data:
+            msg = json_loads(data)
+        del buf[:end + 1]
+        return msg
+
 
 class QMPError(Exception):
     """
@@ -43,6 +144,147 @@ class QMPTimeoutError(QMPError):
     """
 
 
+class EventStore:
+    """
+    FIFO of QMP events indexed by event name.
+
+    Events are kept in arrival order and, in addition, in one deque per
+    event name, so taking the oldest event is O(1) and looking for a given
+    event only scans events of that name.  If capacity is set the oldest
+    events are dropped to make room, and counted in the dropped attribute.
+    """
+
+    def __init__(self, capacity: Optional[int] = None):
+        """
+        @param capacity: maximum number of queued events (None = unbounded)
+        """
+        self.capacity = capacity
+        #: Number of events discarded because the store was full
+        self.dropped = 0
+        # Entries are [seq, event]; consumed entries have event set to None
+        # and are skipped and trimmed lazily from both indexes.
+        self._order: Deque[List[Any]] = deque()
+        self._by_name: Dict[str, Deque[List[Any]]] = {}
+        self._seq = 0
+        self._live = 0
+        # Entries consumed since the last compaction
+        self._dead = 0
+
+    def __len__(self) -> int:
+        return self._live
+
+    def __bool__(self) -> bool:
+        return self._live > 0
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return (entry[1] for entry in self._order if entry[1] is not None)
+
+    def _consume(self, entry: List[Any]) -> Dict[str, Any]:
+        event = entry[1]
+        entry[1] = None
+        self._live -= 1
+        self._dead += 1
+        order = self._order
+        while order and order[0][1] is None:
+            order.popleft()
+        self._head(event.get('event'))
+        # Removals from the middle of either index leave holes behind;
+        # compact once more entries were consumed than are still live.
+        if self._dead > self._live + 64:
+            self._compact()
+        return event
+
+    def _compact(self) -> None:
+        self._dead = 0
+        self._order = deque(e for e in self._order if e[1] is not None)
+        for name in list(self._by_name):
+            queue = deque(e for e in self._by_name[name] if e[1] is not None)
+            if queue:
+                self._by_name[name] = queue
+            else:
+                del self._by_name[name]
+
+    def _head(self, name: str) -> Optional[Deque[List[Any]]]:
+        queue = self._by_name.get(name)
+        if queue is None:
+            return None
+        while queue and queue[0][1] is None:
+            queue.popleft()
+        if not queue:
+            del self._by_name[name]
+            return None
+        return queue
+
+    def append(self, event: Dict[str, Any]) -> None:
+        """
+        Queue an event, dropping the oldest one if the store is full.
+        """
+        if self.capacity is not None and self._live >= self.capacity:
+            self.popleft()
+            self.dropped += 1
+        entry = [self._seq, event]
+        self._seq += 1
+        self._live += 1
+        self._order.append(entry)
+        self._by_name.setdefault(event.get('event'), deque()).append(entry)
+
+    def extend(self, events: Iterable[Dict[str, Any]]) -> None:
+        """
+        Queue several events in order.
+        """
+        for event in events:
+            self.append(event)
+
+    def popleft(self) -> Optional[Dict[str, Any]]:
+        """
+        Remove and return the oldest event, or None if the store is empty.
+        """
+        if not self._live:
+            return None
+        return self._consume(self._order[0])
+
+    def pop_match(self, names: Iterable[str],
+                  match: Optional[Callable[[Dict[str, Any]], bool]] = None
+                  ) -> Optional[Dict[str, Any]]:
+        """
+        Remove and return the oldest event whose name is in names and for
+        which match (if given) returns true.
+
+        Only events carrying one of the requested names are examined.
+        """
+        found = None
+        for name in set(names):
+            queue = self._head(name)
+            if queue is None:
+                continue
+            for entry in queue:
+                if found is not None and entry[0] > found[0]:
+                    break
+                if entry[1] is not None and (match is None or match(entry[1])):
+                    found = entry
+                    break
+        if found is None:
+            return None
+        return self._consume(found)
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """
+        Remove and return all queued events, oldest first.
+        """
+        events = list(self)
+        self.clear()
+        return events
+
+    def clear(self) -> None:
+        """
+        Discard all queued events.  The dropped counter is kept.
+        """
+        self._order.clear()
+        self._by_name.clear()
+        self._live = 0
+        self._dead = 0
+
+
 class QEMUMonitorProtocol:
     """
     Provide an API to connect to QEMU via QEMU Monitor Protocol (QMP) and then
@@ -52,7 +294,8 @@ class QEMUMonitorProtocol:
     #: Logger object for debugging messages
     logger = logging.getLogger('QMP')
 
-    def __init__(self, address, server=False, nickname=None):
+    def __init__(self, address, server=False, nickname=None,
+                 max_events=None, latency=None):
         """
         Create a QEMUMonitorProtocol class.
 
@@ -60,14 +303,22 @@ class QEMUMonitorProtocol:
                         or a tuple in the form ( address, port ) for a TCP
                         connection
         @param server: server mode listens on the socket (bool)
+        @param max_events: bound on queued events; the oldest are dropped
+                           beyond it (None = unbounded)
+        @param latency: QMPLatencyStats (or any object with the same
+                        record() method) timing every cmd_obj() round trip
         @raise OSError on socket connection errors
         @note No connection is established, this is done by the connect() or
               accept() methods
         """
-        self.__events = []
+        self.__events = EventStore(max_events)
         self.__address = address
         self.__sock = self.__get_sock()
-        self.__sockfile: Optional[TextIO] = None
+        self.__buffer = MessageBuffer()
+        #: Latency recorder for cmd_obj(); may be changed at any time
+        self.latency = latency
+        # Arrival of the first reply byte; 0 while not timing a command
+        self.__first_byte = 0
         self._nickname = nickname
         if self._nickname:
             self.logger = logging.getLogger('QMP').getChild(self._nickname)
@@ -94,12 +345,14 @@ class QEMUMonitorProtocol:
         raise QMPCapabilitiesError
 
     def __json_read(self, only_event=False):
-        assert self.__sockfile is not None
         while True:
-            data = self.__sockfile.readline()
-            if not data:
-                return None
-            resp = json.loads(data)
+            resp = self.__buffer.pop()
+            if resp is None:
+                if not self.__buffer.recv(self.__sock):
+                    return None
+                if self.__first_byte is None:
+                    self.__first_byte = perf_counter_ns()
+                continue
             if 'event' in resp:
                 self.logger.debug("<<< %s", resp)
                 self.__events.append(resp)
@@ -168,7 +421,6 @@ class QEMUMonitorProtocol:
         @raise QMPCapabilitiesError if fails to negotiate capabilities
         """
         self.__sock.connect(self.__address)
-        self.__sockfile = self.__sock.makefile(mode='r')
         if negotiate:
             return self.__negotiate_capabilities()
         return None
@@ -191,7 +443,6 @@ class QEMUMonitorProtocol:
         """
         self.__sock.settimeout(timeout)
         self.__sock, _ = self.__sock.accept()
-        self.__sockfile = self.__sock.makefile(mode='r')
         return self.__negotiate_capabilities()
 
     def cmd_obj(self, qmp_cmd):
@@ -202,6 +453,9 @@ class QEMUMonitorProtocol:
         @return QMP response as a Python dict or None if the connection has
                 been closed
         """
+        latency = self.latency
+        if latency is not None:
+            start = perf_counter_ns()
         self.logger.debug(">>> %s", qmp_cmd)
         try:
             self.__sock.sendall(json.dumps(qmp_cmd).encode('utf-8'))
@@ -209,7 +463,20 @@ class QEMUMonitorProtocol:
             if err.errno == errno.EPIPE:
                 return None
             raise err
-        resp = self.__json_read()
+        if latency is None:
+            resp = self.__json_read()
+        else:
+            sent = perf_counter_ns()
+            self.__first_byte = None
+            try:
+                resp = self.__json_read()
+                first_byte = self.__first_byte or sent
+            finally:
+                self.__first_byte = 0
+            if resp is not None:
+                name = qmp_cmd.get('execute') or qmp_cmd.get('exec-oob', '')
+                latency.record(name, start, sent, first_byte,
+                               perf_counter_ns())
         self.logger.debug("<<< %s", resp)
         return resp
 
@@ -253,9 +520,16 @@ class QEMUMonitorProtocol:
         """
         self.__get_events(wait)
 
-        if self.__events:
-            return self.__events.pop(0)
-        return None
+        return self.__events.popleft()
+
+    def pull_matching_event(self, names, match=None):
+        """
+        Remove and return the oldest queued event named in names for which
+        match(event), if given, is true.  Does not read from the socket.
+
+        @return The event, or None.
+        """
+        return self.__events.pop_match(names, match)
 
     def get_events(self, wait=False):
         """
@@ -272,22 +546,30 @@ class QEMUMonitorProtocol:
         @return The list of available QMP events.
         """
         self.__get_events(wait)
-        return self.__events
+        return list(self.__events)
 
     def clear_events(self):
         """
         Clear current list of pending events.
         """
-        self.__events = []
+        self.__events.clear()
+
+    def dropped_events(self):
+        """
+        Number of events discarded because the event store was full.
+        """
+        return self.__events.dropped
 
     def close(self):
         """
-        Close the socket and socket file.
+        Close the socket, logging the latency table first if the latency
+        recorder asks for it (dump_on_close).
         """
         if self.__sock:
+            if getattr(self.latency, 'dump_on_close', False) and \
+                    self.__sock.fileno() >= 0:
+                self.latency.dump(self.logger)
             self.__sock.close()
-        if self.__sockfile:
-            self.__sockfile.close()
 
     def settimeout(self, timeout):
         """
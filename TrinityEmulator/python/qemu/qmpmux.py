@@ -0,0 +1,355 @@
+"""
+QEMU Monitor Protocol multiplexer
+
+QMPMultiplexer holds the single QMP connection QEMU allows per monitor
+and serves any number of downstream QMP clients on its own sockets.  The
+greeting and capabilities negotiation are answered locally, command ids
+are rewritten so clients can have commands in flight concurrently, and
+events are broadcast to every negotiated client, optionally filtered by
+name with the local x-mux-filter-events command.
+"""
+# Copyright (C) 2025 Trinity Emulator authors
+#
+# This work is licensed under the terms of the GNU GPL, version 2.  See
+# the COPYING file in the top-level directory.
+
+import asyncio
+import codecs
+import json
+import logging
+import os
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from .aqmp import AsyncQEMUMonitorProtocol
+from .qmp import QMPError
+
+LOG = logging.getLogger(__name__)
+
+
+def _error(cls: str, desc: str) -> Dict[str, Any]:
+    return {'error': {'class': cls, 'desc': desc}}
+
+
+class _JSONStreamer:
+    """
+    Split a character stream into top-level JSON values, like QEMU's
+    json-streamer: objects and arrays end when their brackets balance,
+    outside of strings, so a malformed value costs one error and parsing
+    resumes right after it.  Input past the size or nesting limits is
+    dropped up to the next newline.
+    """
+
+    #: Largest value accepted, in characters
+    max_size = 16 << 20
+
+    #: Deepest object/array nesting accepted
+    max_nesting = 1024
+
+    def __init__(self) -> None:
+        self._pending = ''
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._skip_line = False
+
+    def _reset(self, skip_line: bool = False) -> None:
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._skip_line = skip_line
+
+    def feed(self, text: str) -> List[Tuple[bool, str]]:
+        """
+        Scan more input.
+
+        @return (True, value text) for each complete value and
+                (False, error description) for each rejected one
+        """
+        results: List[Tuple[bool, str]] = []
+        buf = self._pending + text
+        start: Optional[int] = 0 if self._pending else None
+        i = len(self._pending)
+        while i < len(buf):
+            c = buf[i]
+            if self._skip_line:
+                newline = buf.find('\n', i)
+                if newline < 0:
+                    break
+                self._skip_line = False
+                i = newline + 1
+                continue
+            if start is None:
+                if c.isspace():
+                    i += 1
+                    continue
+                start = i
+            elif self._depth == 0 and not self._in_string and \
+                    buf[start] not in '{["' and (c.isspace() or c in '{}[]"'):
+                # End of a top-level scalar; c starts the next value
+                results.append((True, buf[start:i]))
+                start = None
+                continue
+            i += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in '{[':
+                self._depth += 1
+                if self._depth > self.max_nesting:
+                    results.append((False, 'JSON nesting too deep'))
+                    self._reset(skip_line=True)
+                    start = None
+                    continue
+            elif c in '}]':
+                self._depth -= 1
+                if self._depth < 0:
+                    results.append((False, "JSON parse error, unexpected "
+                                    "'%s'" % c))
+                    self._reset()
+                    start = None
+                    continue
+            if start is not None and self._depth == 0 and \
+                    not self._in_string and c in '}]"':
+                results.append((True, buf[start:i]))
+                start = None
+            elif start is not None and i - start > self.max_size:
+                results.append((False, 'JSON input too large'))
+                self._reset(skip_line=True)
+                start = None
+        self._pending = buf[start:] if start is not None else ''
+        return results
+
+
+class MuxClient:
+    """
+    One downstream connection.
+    """
+
+    #: A client this far behind on output is disconnected
+    max_backlog = 16 << 20
+
+    def __init__(self, mux: 'QMPMultiplexer', reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter, name: str):
+        self.mux = mux
+        self.reader = reader
+        self.writer = writer
+        self.name = name
+        self.negotiated = False
+        #: Event names this client receives (None = all)
+        self.events: Optional[Set[str]] = None
+        self.commands = 0
+        self._tasks: Set['asyncio.Task[None]'] = set()
+
+    def send(self, msg: Dict[str, Any]) -> None:
+        """
+        Queue a message to the client.
+        """
+        if self.writer.transport.is_closing():
+            return
+        if self.writer.transport.get_write_buffer_size() > self.max_backlog:
+            LOG.warning("%s is not reading its output, disconnecting",
+                        self.name)
+            self.writer.close()
+            return
+        self.writer.write(json.dumps(msg).encode('utf-8') + b'\r\n')
+
+    async def serve(self) -> None:
+        """
+        Send the greeting, then read and dispatch commands until EOF.
+        """
+        greeting = dict(self.mux.greeting)
+        greeting['QMP'] = dict(greeting['QMP'], capabilities=[])
+        self.send(greeting)
+        streamer = _JSONStreamer()
+        # Incremental, so a character split across two reads is not an
+        # error; invalid bytes become U+FFFD and fail as bad JSON
+        utf8 = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                for complete, text in streamer.feed(utf8.decode(data)):
+                    if not complete:
+                        self.send(_error('GenericError', text))
+                        continue
+                    try:
+                        msg = json.loads(text)
+                    except ValueError as err:
+                        self.send(_error('GenericError',
+                                         'JSON parse error, %s' % err))
+                        continue
+                    self.dispatch(msg)
+                await self.writer.drain()
+        except OSError as err:
+            LOG.debug("%s: %s", self.name, err)
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            self.writer.close()
+
+    def dispatch(self, msg: Any) -> None:
+        """
+        Answer a command locally or forward it upstream.
+        """
+        if not isinstance(msg, dict) or 'execute' not in msg:
+            self.send(_error('GenericError', 'QMP input must be a JSON '
+                             'object with an "execute" member'))
+            return
+        arguments = msg.get('arguments', {})
+        if not isinstance(msg['execute'], str):
+            reply = _error('GenericError', "QMP input member 'execute' "
+                           "must be a string")
+        elif not isinstance(arguments, dict):
+            reply = _error('GenericError', "QMP input member 'arguments' "
+                           "must be an object")
+        else:
+            reply = self._local(msg['execute'], arguments)
+        if reply is not None:
+            if 'id' in msg:
+                reply['id'] = msg['id']
+            self.send(reply)
+            return
+
+        task = asyncio.ensure_future(self.forward(msg))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _local(self, name: str,
+               arguments: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # Reply to commands the multiplexer answers itself, None to forward
+        if name == 'qmp_capabilities':
+            if self.negotiated:
+                return _error('CommandNotFound', 'Capabilities negotiation '
+                              'is already complete, command ignored')
+            if arguments.get('enable'):
+                return _error('GenericError', 'Capability is not available')
+            self.negotiated = True
+            return {'return': {}}
+        if not self.negotiated:
+            return _error('CommandNotFound', "Expecting capabilities "
+                          "negotiation with 'qmp_capabilities'")
+        if name == 'x-mux-filter-events':
+            events = arguments.get('events')
+            if events is None:
+                self.events = None
+            elif (isinstance(events, list) and
+                  all(isinstance(event, str) for event in events)):
+                self.events = set(events)
+            else:
+                return _error('GenericError', "Parameter 'events' expects "
+                              "a list of strings or null")
+            return {'return': {}}
+        return None
+
+    async def forward(self, msg: Dict[str, Any]) -> None:
+        """
+        Run a command upstream under a multiplexer id and pass the reply
+        back under the client's own id.
+        """
+        self.commands += 1
+        upstream_cmd = {key: value for key, value in msg.items()
+                        if key != 'id'}
+        try:
+            reply = await self.mux.upstream.execute_obj(upstream_cmd)
+        except QMPError as err:
+            reply = _error('GenericError', 'QMP multiplexer: %s' % err)
+        reply = {key: value for key, value in reply.items() if key != 'id'}
+        if 'id' in msg:
+            reply['id'] = msg['id']
+        self.send(reply)
+
+
+class QMPMultiplexer:
+    """
+    Share one upstream QMP monitor among many clients.
+    """
+
+    def __init__(self, upstream: Any, listen: List[Any]):
+        """
+        @param upstream: QEMU's QMP socket path or (host, port)
+        @param listen: addresses (paths or (host, port)) to serve clients on
+        """
+        self.upstream = AsyncQEMUMonitorProtocol(upstream, nickname='mux')
+        self.listen = listen
+        self.greeting: Dict[str, Any] = {}
+        self.clients: Set[MuxClient] = set()
+        self._servers: List[asyncio.AbstractServer] = []
+        self._serial = 0
+        self._events_task: Optional['asyncio.Task[None]'] = None
+
+    async def start(self) -> None:
+        """
+        Connect upstream and start listening.
+        """
+        greeting = await self.upstream.connect()
+        assert greeting is not None
+        self.greeting = greeting
+        self._events_task = asyncio.ensure_future(self._broadcast())
+        for address in self.listen:
+            if isinstance(address, tuple):
+                server = await asyncio.start_server(self._accept, *address)
+            else:
+                if os.path.exists(address):
+                    os.unlink(address)
+                server = await asyncio.start_unix_server(self._accept, address)
+            self._servers.append(server)
+            LOG.info("Serving QMP on %s", address)
+
+    async def _accept(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+        self._serial += 1
+        client = MuxClient(self, reader, writer, 'client-%d' % self._serial)
+        self.clients.add(client)
+        LOG.debug("%s connected", client.name)
+        try:
+            await client.serve()
+        finally:
+            self.clients.discard(client)
+            LOG.debug("%s disconnected after %d commands",
+                      client.name, client.commands)
+
+    async def _broadcast(self) -> None:
+        async for event in self.upstream.events:
+            for client in list(self.clients):
+                if client.negotiated and (client.events is None or
+                                          event['event'] in client.events):
+                    client.send(event)
+
+    async def serve_forever(self) -> None:
+        """
+        Run until the upstream connection is lost.
+        """
+        try:
+            await self.upstream.wait_closed()
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        """
+        Stop listening, drop all clients and close the upstream connection.
+        """
+        for server in self._servers:
+            server.close()
+        for address in self.listen:
+            if not isinstance(address, tuple) and os.path.exists(address):
+                os.unlink(address)
+        for client in list(self.clients):
+            client.writer.close()
+        if self._events_task is not None:
+            self._events_task.cancel()
+        await self.upstream.close()
+
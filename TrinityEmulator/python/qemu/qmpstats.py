@@ -0,0 +1,295 @@
+"""
+QMP round-trip latency statistics
+
+QMPLatencyStats collects, per command name, how long each QMP round trip
+spent in three phases and keeps them in HDR-style log-linear histograms:
+
+- send: encoding the command and writing it to the socket (Python side);
+- wait: from the end of the write to the first byte of the reply (QEMU
+  executing the command, plus socket latency);
+- read: from the first byte to the parsed reply (transfer of the rest of
+  the reply and JSON parsing in Python).
+
+Recording a round trip costs a few clock reads and one deque append; the
+samples are folded into the histograms in batches, so it can stay enabled
+in long-running tools.  Pass an instance as the
+latency argument of QEMUMonitorProtocol or QEMUMachine and call
+summary(), format() or dump() whenever percentiles are wanted.
+"""
+
+# Copyright (C) 2025 Trinity Emulator authors
+#
+# This work is licensed under the terms of the GNU GPL, version 2.  See
+# the COPYING file in the top-level directory.
+#
+
+import logging
+import math
+import threading
+from collections import Counter, deque
+from typing import (
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+LOG = logging.getLogger(__name__)
+
+#: Phases recorded for every command, in histogram order
+PHASES = ('send', 'wait', 'read', 'total')
+
+#: Percentiles reported by default
+DEFAULT_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of non-negative integers (nanoseconds here).
+
+    As in HdrHistogram, values are grouped by power of two and every power
+    of two is split into 2**(sub_bucket_bits - 1) linear buckets, so any
+    recorded value is reported to within 2**-(sub_bucket_bits - 1) of its
+    true value (under 1.6% with the default 7 bits) whatever its
+    magnitude.  Only non-empty buckets are stored.
+    """
+
+    def __init__(self, sub_bucket_bits: int = 7):
+        self._bits = sub_bucket_bits
+        self._mask = (1 << sub_bucket_bits) - 1
+        self._counts: 'Counter[int]' = Counter()
+        #: Number of recorded values
+        self.count = 0
+        #: Sum of recorded values
+        self.total = 0
+        #: Smallest and largest recorded values
+        self.min: Optional[int] = None
+        self.max = 0
+
+    def record(self, value: int) -> None:
+        """
+        Add one value.
+        """
+        self.record_many([value])
+
+    def record_many(self, values: Sequence[int]) -> None:
+        """
+        Add a batch of values, all non-negative.
+        """
+        if not values:
+            return
+        bits = self._bits
+        buckets = []
+        for value in values:
+            shift = value.bit_length() - bits
+            if shift > 0:
+                value = (shift << bits) | (value >> shift)
+            buckets.append(value)
+        self._counts.update(buckets)
+        self.count += len(values)
+        self.total += sum(values)
+        low = min(values)
+        if self.min is None or low < self.min:
+            self.min = low
+        self.max = max(self.max, max(values))
+
+    def _highest(self, index: int) -> int:
+        # Highest value that falls in the bucket at index
+        shift = index >> self._bits
+        if shift == 0:
+            return index
+        return (((index & self._mask) + 1) << shift) - 1
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        """
+        Add all values of other, which must use the same sub_bucket_bits.
+        """
+        if other._bits != self._bits:
+            raise ValueError("Cannot merge histograms of different precision")
+        self._counts.update(other._counts)
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or
+                                      other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def mean(self) -> float:
+        """
+        Average recorded value (0 when empty).
+        """
+        return self.total / self.count if self.count else 0.0
+
+    def percentiles(self, percentiles: Iterable[float]) -> List[int]:
+        """
+        Values below which the given percentages of recorded values fall.
+
+        @return one value per percentile, each the highest value of its
+                bucket capped to the recorded maximum (0 when empty)
+        """
+        wanted = list(percentiles)
+        if not self.count:
+            return [0] * len(wanted)
+        buckets = sorted(self._counts)
+        results = [0] * len(wanted)
+        seen = 0
+        position = 0
+        for i in sorted(range(len(wanted)), key=wanted.__getitem__):
+            target = max(1, math.ceil(wanted[i] / 100.0 * self.count))
+            while seen < target and position < len(buckets):
+                seen += self._counts[buckets[position]]
+                position += 1
+            results[i] = min(self._highest(buckets[position - 1]), self.max)
+        return results
+
+    def percentile(self, percentile: float) -> int:
+        """
+        Single-value form of percentiles().
+        """
+        return self.percentiles([percentile])[0]
+
+
+class QMPLatencyStats:
+    """
+    Per-command QMP latency histograms, shareable between connections
+    and threads.
+    """
+
+    #: Samples buffered before they are folded into the histograms
+    batch_size = 1024
+
+    def __init__(self, sub_bucket_bits: int = 7, dump_on_close: bool = False,
+                 percentiles: Iterable[float] = DEFAULT_PERCENTILES):
+        """
+        @param sub_bucket_bits: histogram precision (see LatencyHistogram)
+        @param dump_on_close: log the table when a QEMUMonitorProtocol using
+                              these stats is closed
+        @param percentiles: percentiles reported by summary() and format()
+        """
+        self.sub_bucket_bits = sub_bucket_bits
+        self.dump_on_close = dump_on_close
+        self.percentiles = tuple(percentiles)
+        self._commands: Dict[str, List[LatencyHistogram]] = {}
+        self._pending: Deque[Tuple[str, int, int, int, int]] = deque()
+        self._lock = threading.Lock()
+
+    def record(self, command: str, start: int, sent: int, first_byte: int,
+               done: int) -> None:
+        """
+        Record one round trip; timestamps are qmp.perf_counter_ns() values.
+
+        @param command: QMP command name
+        @param start: before the command was encoded
+        @param sent: after it was written to the socket
+        @param first_byte: when the first byte of the reply arrived
+                           (sent, if the reply was already buffered)
+        @param done: after the reply was parsed
+        """
+        # deque.append is atomic, so recording threads never take the lock
+        self._pending.append((command, start, sent, first_byte, done))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Fold buffered samples into the histograms.
+        """
+        with self._lock:
+            pending = self._pending
+            samples: Dict[str, List[Tuple[int, int, int, int]]] = {}
+            for _ in range(len(pending)):
+                command, start, sent, first_byte, done = pending.popleft()
+                samples.setdefault(command, []).append(
+                    (sent - start, first_byte - sent, done - first_byte,
+                     done - start))
+            for command, rows in samples.items():
+                histograms = self._commands.get(command)
+                if histograms is None:
+                    histograms = [LatencyHistogram(self.sub_bucket_bits)
+                                  for _ in PHASES]
+                    self._commands[command] = histograms
+                for histogram, values in zip(histograms, zip(*rows)):
+                    histogram.record_many(values)
+
+    def histogram(self, command: Optional[str] = None,
+                  phase: str = 'total') -> LatencyHistogram:
+        """
+        Copy of the histogram of one phase for one command, or merged
+        over all commands when command is None.
+        """
+        result = LatencyHistogram(self.sub_bucket_bits)
+        position = PHASES.index(phase)
+        self.flush()
+        with self._lock:
+            if command is None:
+                sources = [hists[position] for hists in self._commands.values()]
+            elif command in self._commands:
+                sources = [self._commands[command][position]]
+            else:
+                sources = []
+            for source in sources:
+                result.merge(source)
+        return result
+
+    def commands(self) -> List[str]:
+        """
+        Names of the commands recorded so far.
+        """
+        self.flush()
+        with self._lock:
+            return sorted(self._commands)
+
+    def reset(self) -> None:
+        """
+        Forget everything recorded so far.
+        """
+        with self._lock:
+            self._pending.clear()
+            self._commands = {}
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        Statistics in milliseconds, as
+        {command: {phase: {'count', 'mean', 'min', 'max', 'p50', ...}}}.
+        """
+        result = {}
+        for command in self.commands():
+            phases = {}
+            for phase in PHASES:
+                hist = self.histogram(command, phase)
+                stats = {'count': hist.count,
+                         'mean': round(hist.mean() / 1e6, 3),
+                         'min': round((hist.min or 0) / 1e6, 3),
+                         'max': round(hist.max / 1e6, 3)}
+                values = hist.percentiles(self.percentiles)
+                for percentile, value in zip(self.percentiles, values):
+                    stats['p%g' % percentile] = round(value / 1e6, 3)
+                phases[phase] = stats
+            result[command] = phases
+        return result
+
+    def format(self) -> str:
+        """
+        summary() as a text table, one row per command and phase.
+        """
+        columns = ['mean'] + ['p%g' % p for p in self.percentiles] + ['max']
+        lines = ['%-32s %-5s %8s ' % ('command', 'phase', 'count') +
+                 ' '.join('%9s' % column for column in columns) + '  (ms)']
+        for command, phases in self.summary().items():
+            for phase in PHASES:
+                stats = phases[phase]
+                lines.append('%-32s %-5s %8d ' % (command, phase,
+                                                  stats['count']) +
+                             ' '.join('%9.3f' % stats[column]
+                                      for column in columns))
+        return '\n'.join(lines)
+
+    def dump(self, logger: Optional[logging.Logger] = None) -> None:
+        """
+        Log format() at INFO level, if anything was recorded.
+        """
+        if self.commands():
+            (logger or LOG).info("QMP latency:\n%s", self.format())
@@ -17,9 +17,12 @@ subclass of QEMUMachine, respectively.
 # Based on qmp.py.
 #
 
+import base64
+import binascii
+import select
 import socket
 import os
-from typing import Optional, TextIO
+from typing import Any, List
 
 from .machine import QEMUMachine
 
@@ -41,7 +44,9 @@ class QEMUQtestProtocol:
     def __init__(self, address, server=False):
         self._address = address
         self._sock = self._get_sock()
-        self._sockfile: Optional[TextIO] = None
+        self._buf = bytearray()
+        #: Asynchronous "IRQ raise/lower" notifications seen between replies
+        self.irq_events: List[str] = []
         if server:
             self._sock.bind(self._address)
             self._sock.listen(1)
@@ -60,7 +65,6 @@ class QEMUQtestProtocol:
         @raise socket.error on socket connection errors
         """
         self._sock.connect(self._address)
-        self._sockfile = self._sock.makefile(mode='r')
 
     def accept(self):
         """
@@ -69,7 +73,58 @@ class QEMUQtestProtocol:
         @raise socket.error on socket connection errors
         """
         self._sock, _ = self._sock.accept()
-        self._sockfile = self._sock.makefile(mode='r')
+
+    def _pop_replies(self, replies, count):
+        buf = self._buf
+        start = 0
+        while len(replies) < count:
+            end = buf.find(b'\n', start)
+            if end < 0:
+                break
+            line = buf[start:end + 1].decode('utf-8')
+            start = end + 1
+            if line.startswith('IRQ '):
+                self.irq_events.append(line.rstrip('\n'))
+            else:
+                replies.append(line)
+        del buf[:start]
+
+    def cmds(self, qtest_cmds: List[str]) -> List[str]:
+        """
+        Send several qtest commands in one write and return their replies
+        in order.
+
+        Replies are read while the commands are still being sent, so QEMU
+        never blocks writing replies to a client that is blocked writing
+        commands.
+
+        @param qtest_cmds: qtest command texts to be sent
+        """
+        payload = memoryview(''.join(cmd + "\n" for cmd in qtest_cmds)
+                             .encode('utf-8'))
+        replies: List[str] = []
+        self._pop_replies(replies, len(qtest_cmds))
+        timeout = self._sock.gettimeout()
+        self._sock.setblocking(False)
+        try:
+            while len(replies) < len(qtest_cmds):
+                wlist = [self._sock] if payload else []
+                readable, writable, _ = select.select([self._sock], wlist, [],
+                                                      timeout)
+                if not readable and not writable:
+                    raise socket.timeout("timed out")
+                if writable:
+                    sent = self._sock.send(payload[:65536])
+                    payload = payload[sent:]
+                if readable:
+                    data = self._sock.recv(65536)
+                    if not data:
+                        raise ConnectionError("qtest socket closed")
+                    self._buf += data
+                    self._pop_replies(replies, len(qtest_cmds))
+        finally:
+            self._sock.settimeout(timeout)
+        return replies
 
     def cmd(self, qtest_cmd):
         """
@@ -77,23 +132,182 @@ class QEMUQtestProtocol:
 
         @param qtest_cmd: qtest command text to be sent
         """
-        assert self._sockfile is not None
-        self._sock.sendall((qtest_cmd + "\n").encode('utf-8'))
-        resp = self._sockfile.readline()
-        return resp
+        return self.cmds([qtest_cmd])[0]
+
+    def batch(self) -> 'QEMUQtestBatch':
+        """
+        Start a batch of pipelined commands, see QEMUQtestBatch.
+        """
+        return QEMUQtestBatch(self)
+
+    def bulk_write(self, addr: int, data: bytes,
+                   chunk_size: int = 65536) -> None:
+        """
+        Write data to guest memory at addr with pipelined b64write commands.
+
+        @param chunk_size: bytes per command; QEMU scans each command line
+                           from the start on every 1 KiB it receives, so
+                           very long lines get slow
+        """
+        batch = self.batch()
+        for offset in range(0, len(data), chunk_size):
+            batch.b64write(addr + offset, data[offset:offset + chunk_size])
+        batch.flush()
+
+    def bulk_read(self, addr: int, size: int,
+                  chunk_size: int = 65536) -> bytes:
+        """
+        Read size bytes of guest memory at addr with pipelined b64read
+        commands.
+        """
+        batch = self.batch()
+        for offset in range(0, size, chunk_size):
+            batch.b64read(addr + offset, min(chunk_size, size - offset))
+        return b''.join(batch.flush())
 
     def close(self):
         """Close this socket."""
         self._sock.close()
-        if self._sockfile:
-            self._sockfile.close()
-            self._sockfile = None
+        self._buf = bytearray()
 
     def settimeout(self, timeout):
         """Set a timeout, in seconds."""
         self._sock.settimeout(timeout)
 
 
+class QEMUQtestBatch:
+    """
+    Queue of qtest commands sent together by flush().
+
+    Every method queues one command; flush() writes the whole queue in one
+    go, reads the replies in order and returns one result per command:
+    None for writes, an int for readb/w/l/q and inb/w/l, bytes for read
+    and b64read.
+
+    :raise RuntimeError: from flush(), if any command failed
+    """
+    def __init__(self, protocol: QEMUQtestProtocol):
+        self._protocol = protocol
+        self._cmds: List[str] = []
+        self._parsers: List[Any] = []
+
+    def __len__(self) -> int:
+        return len(self._cmds)
+
+    def _queue(self, qtest_cmd: str, parser=None) -> 'QEMUQtestBatch':
+        self._cmds.append(qtest_cmd)
+        self._parsers.append(parser)
+        return self
+
+    @staticmethod
+    def _int(value: str) -> int:
+        return int(value, 16)
+
+    @staticmethod
+    def _hex(value: str) -> bytes:
+        return binascii.unhexlify(value[2:])
+
+    def writeb(self, addr: int, value: int) -> 'QEMUQtestBatch':
+        """Queue a byte write."""
+        return self._queue('writeb 0x%x 0x%x' % (addr, value))
+
+    def writew(self, addr: int, value: int) -> 'QEMUQtestBatch':
+        """Queue a 16-bit write."""
+        return self._queue('writew 0x%x 0x%x' % (addr, value))
+
+    def writel(self, addr: int, value: int) -> 'QEMUQtestBatch':
+        """Queue a 32-bit write."""
+        return self._queue('writel 0x%x 0x%x' % (addr, value))
+
+    def writeq(self, addr: int, value: int) -> 'QEMUQtestBatch':
+        """Queue a 64-bit write."""
+        return self._queue('writeq 0x%x 0x%x' % (addr, value))
+
+    def readb(self, addr: int) -> 'QEMUQtestBatch':
+        """Queue a byte read."""
+        return self._queue('readb 0x%x' % addr, self._int)
+
+    def readw(self, addr: int) -> 'QEMUQtestBatch':
+        """Queue a 16-bit read."""
+        return self._queue('readw 0x%x' % addr, self._int)
+
+    def readl(self, addr: int) -> 'QEMUQtestBatch':
+        """Queue a 32-bit read."""
+        return self._queue('readl 0x%x' % addr, self._int)
+
+    def readq(self, addr: int) -> 'QEMUQtestBatch':
+        """Queue a 64-bit read."""
+        return self._queue('readq 0x%x' % addr, self._int)
+
+    def outb(self, port: int, value: int) -> 'QEMUQtestBatch':
+        """Queue a byte port write."""
+        return self._queue('outb 0x%x 0x%x' % (port, value))
+
+    def outw(self, port: int, value: int) -> 'QEMUQtestBatch':
+        """Queue a 16-bit port write."""
+        return self._queue('outw 0x%x 0x%x' % (port, value))
+
+    def outl(self, port: int, value: int) -> 'QEMUQtestBatch':
+        """Queue a 32-bit port write."""
+        return self._queue('outl 0x%x 0x%x' % (port, value))
+
+    def inb(self, port: int) -> 'QEMUQtestBatch':
+        """Queue a byte port read."""
+        return self._queue('inb 0x%x' % port, self._int)
+
+    def inw(self, port: int) -> 'QEMUQtestBatch':
+        """Queue a 16-bit port read."""
+        return self._queue('inw 0x%x' % port, self._int)
+
+    def inl(self, port: int) -> 'QEMUQtestBatch':
+        """Queue a 32-bit port read."""
+        return self._queue('inl 0x%x' % port, self._int)
+
+    def read(self, addr: int, size: int) -> 'QEMUQtestBatch':
+        """Queue a hex-encoded memory read of size bytes."""
+        return self._queue('read 0x%x 0x%x' % (addr, size), self._hex)
+
+    def write(self, addr: int, data: bytes) -> 'QEMUQtestBatch':
+        """Queue a hex-encoded memory write."""
+        return self._queue('write 0x%x 0x%x 0x%s' %
+                           (addr, len(data), binascii.hexlify(data).decode()))
+
+    def memset(self, addr: int, size: int, value: int) -> 'QEMUQtestBatch':
+        """Queue filling size bytes at addr with value."""
+        return self._queue('memset 0x%x 0x%x 0x%x' % (addr, size, value))
+
+    def b64read(self, addr: int, size: int) -> 'QEMUQtestBatch':
+        """Queue a base64-encoded memory read of size bytes."""
+        return self._queue('b64read 0x%x 0x%x' % (addr, size),
+                           base64.b64decode)
+
+    def b64write(self, addr: int, data: bytes) -> 'QEMUQtestBatch':
+        """Queue a base64-encoded memory write."""
+        return self._queue('b64write 0x%x 0x%x %s' %
+                           (addr, len(data), base64.b64encode(data).decode()))
+
+    def flush(self) -> List[Any]:
+        """
+        Send the queued commands and return their results in order.
+        The batch is empty afterwards and can be reused.
+        """
+        cmds, parsers = self._cmds, self._parsers
+        self._cmds, self._parsers = [], []
+        if not cmds:
+            return []
+        results = []
+        for qtest_cmd, parser, reply in zip(cmds, parsers,
+                                            self._protocol.cmds(cmds)):
+            words = reply.split()
+            if not words or words[0] != 'OK':
+                raise RuntimeError("qtest command %r failed: %s"
+                                   % (qtest_cmd.split(' ', 1)[0],
+                                      reply.strip()))
+            results.append(parser(words[1] if len(words) > 1 else '')
+                           if parser else None)
+        return results
+
+
 class QEMUQtestMachine(QEMUMachine):
     """
     A QEMU VM, with a qtest socket available.
@@ -140,3 +354,27 @@ class QEMUQtestMachine(QEMUMachine):
         if self._qtest is None:
             raise RuntimeError("qtest socket not available")
         return self._qtest.cmd(cmd)
+
+    def qtest_batch(self) -> QEMUQtestBatch:
+        """
+        Start a batch of pipelined qtest commands.
+        """
+        if self._qtest is None:
+            raise RuntimeError("qtest socket not available")
+        return self._qtest.batch()
+
+    def bulk_write(self, addr: int, data: bytes) -> None:
+        """
+        Write data to guest memory with pipelined b64write commands.
+        """
+        if self._qtest is None:
+            raise RuntimeError("qtest socket not available")
+        self._qtest.bulk_write(addr, data)
+
+    def bulk_read(self, addr: int, size: int) -> bytes:
+        """
+        Read size bytes of guest memory with pipelined b64read commands.
+        """
+        if self._qtest is None:
+            raise RuntimeError("qtest socket not available")
+        return self._qtest.bulk_read(addr, size)
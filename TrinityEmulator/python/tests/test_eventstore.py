@@ -0,0 +1,76 @@
+"""
+Tests for qemu.qmp.EventStore
+"""
+# Copyright (C) 2025 Trinity Emulator authors
+#
+# This work is licensed under the terms of the GNU GPL, version 2.  See
+# the COPYING file in the top-level directory.
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from qemu.qmp import EventStore
+
+
+def stored_entries(store):
+    # Entries held by both indexes, live or consumed
+    # pylint: disable=protected-access
+    return len(store._order) + sum(len(queue)
+                                   for queue in store._by_name.values())
+
+
+class EventStoreTest(unittest.TestCase):
+
+    def test_order(self):
+        store = EventStore()
+        store.extend({'event': name} for name in 'ABAB')
+        self.assertEqual(store.pop_match(['B'])['event'], 'B')
+        self.assertEqual([e['event'] for e in store], ['A', 'A', 'B'])
+        self.assertEqual(store.popleft()['event'], 'A')
+        self.assertEqual(len(store), 2)
+
+    def test_pop_match_oldest(self):
+        store = EventStore()
+        store.extend({'event': name, 'data': {'n': n}}
+                     for n, name in enumerate('ABAB'))
+        event = store.pop_match(['A', 'B'], lambda e: e['data']['n'] > 0)
+        self.assertEqual(event['data']['n'], 1)
+
+    def test_capacity(self):
+        store = EventStore(capacity=3)
+        store.extend({'event': 'E', 'data': {'n': n}} for n in range(5))
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.dropped, 2)
+        self.assertEqual(store.popleft()['data']['n'], 2)
+
+    def test_bounded_memory(self):
+        # pull_event() / get_qmp_event() and eviction consume with
+        # popleft(), events_wait() with pop_match(); neither may leave
+        # consumed entries behind in the per-name index.
+        store = EventStore(capacity=100)
+        names = ['BLOCK_JOB_READY', 'BLOCK_JOB_COMPLETED', 'RESET']
+        for i in range(200000):
+            store.append({'event': names[i % 3], 'data': {'n': i}})
+            if i % 5 == 0:
+                store.popleft()
+            elif i % 7 == 0:
+                store.pop_match(['RESET'])
+            elif i % 11 == 0:
+                store.pop_match(['BLOCK_JOB_READY'],
+                                lambda e: e['data']['n'] % 2 == 0)
+        self.assertLessEqual(len(store), 100)
+        self.assertLess(stored_entries(store), 4 * 100 + 256)
+
+    def test_bounded_memory_eviction(self):
+        store = EventStore(capacity=100)
+        for i in range(200000):
+            store.append({'event': 'BLOCK_JOB_READY', 'data': {'n': i}})
+        self.assertEqual(len(store), 100)
+        self.assertEqual(store.dropped, 200000 - 100)
+        self.assertLess(stored_entries(store), 4 * 100 + 256)
+
+
+if __name__ == '__main__':
+    unittest.main()
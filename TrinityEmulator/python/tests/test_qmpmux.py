@@ -0,0 +1,56 @@
+"""
+Tests for the input framing of qemu.qmpmux
+"""
+# Copyright (C) 2025 Trinity Emulator authors
+#
+# This work is licensed under the terms of the GNU GPL, version 2.  See
+# the COPYING file in the top-level directory.
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from qemu.qmpmux import _JSONStreamer
+
+
+class JSONStreamerTest(unittest.TestCase):
+
+    def test_split_values(self):
+        streamer = _JSONStreamer()
+        self.assertEqual(streamer.feed('{"execute": "a"}{"exec'),
+                         [(True, '{"execute": "a"}')])
+        self.assertEqual(streamer.feed('ute": "b}{"}\r\n[1, [2]] 3 '),
+                         [(True, '{"execute": "b}{"}'),
+                          (True, '[1, [2]]'), (True, '3')])
+
+    def test_escaped_quote(self):
+        streamer = _JSONStreamer()
+        self.assertEqual(streamer.feed(r'{"a": "\"}"}'),
+                         [(True, r'{"a": "\"}"}')])
+
+    def test_resync_after_stray_brace(self):
+        streamer = _JSONStreamer()
+        results = streamer.feed('} {"execute": "a"}')
+        self.assertFalse(results[0][0])
+        self.assertEqual(results[1:], [(True, '{"execute": "a"}')])
+
+    def test_size_limit(self):
+        streamer = _JSONStreamer()
+        streamer.max_size = 100
+        results = streamer.feed('{"a": "' + 'x' * 200)
+        self.assertEqual(results, [(False, 'JSON input too large')])
+        # pylint: disable=protected-access
+        self.assertLess(len(streamer._pending), 200)
+        self.assertEqual(streamer.feed('x' * 50 + '\n{"execute": "a"}'),
+                         [(True, '{"execute": "a"}')])
+
+    def test_nesting_limit(self):
+        streamer = _JSONStreamer()
+        streamer.max_nesting = 4
+        results = streamer.feed('[[[[[')
+        self.assertEqual(results, [(False, 'JSON nesting too deep')])
+
+
+if __name__ == '__main__':
+    unittest.main()
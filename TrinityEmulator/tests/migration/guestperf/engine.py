@@ -30,12 +30,13 @@ from guestperf.timings import TimingRecord, Timings
 sys.path.append(os.path.join(os.path.dirname(__file__),
                              '..', '..', '..', 'python'))
 from qemu.machine import QEMUMachine
+from qemu.qmpstats import QMPLatencyStats
 
 
 class Engine(object):
 
     def __init__(self, binary, dst_host, kernel, initrd, transport="tcp",
-                 sleep=15, verbose=False, debug=False):
+                 sleep=15, verbose=False, debug=False, qmp_latency=False):
 
         self._binary = binary # Path to QEMU binary
         self._dst_host = dst_host # Hostname of target host
@@ -45,6 +46,7 @@ class Engine(object):
         self._sleep = sleep
         self._verbose = verbose
         self._debug = debug
+        self._qmp_latency = qmp_latency # Print QMP latency percentiles
 
         if debug:
             self._verbose = debug
@@ -385,17 +387,21 @@ class Engine(object):
             dstmonaddr = "/var/tmp/qemu-dst-%d-monitor.sock" % os.getpid()
         srcmonaddr = "/var/tmp/qemu-src-%d-monitor.sock" % os.getpid()
 
+        latency = QMPLatencyStats() if self._qmp_latency else None
+
         src = QEMUMachine(self._binary,
                           args=self._get_src_args(hardware),
                           wrapper=self._get_src_wrapper(hardware),
                           name="qemu-src-%d" % os.getpid(),
-                          monitor_address=srcmonaddr)
+                          monitor_address=srcmonaddr,
+                          qmp_latency=latency)
 
         dst = QEMUMachine(self._binary,
                           args=self._get_dst_args(hardware, uri),
                           wrapper=self._get_dst_wrapper(hardware),
                           name="qemu-dst-%d" % os.getpid(),
-                          monitor_address=dstmonaddr)
+                          monitor_address=dstmonaddr,
+                          qmp_latency=latency)
 
         try:
             src.launch()
@@ -413,6 +419,10 @@ class Engine(object):
             src.shutdown()
             dst.shutdown()
 
+            if latency is not None:
+                print("QMP latency for %s:" % scenario._name)
+                print(latency.format())
+
             return Report(hardware, scenario, progress_history,
                           Timings(self._get_timings(src) + self._get_timings(dst)),
                           Timings(qemu_timings),
@@ -48,6 +48,7 @@ class BaseShell(object):
         parser.add_argument("--kernel", dest="kernel", default="/boot/vmlinuz-%s" % platform.release())
         parser.add_argument("--initrd", dest="initrd", default="tests/migration/initrd-stress.img")
         parser.add_argument("--transport", dest="transport", default="unix")
+        parser.add_argument("--qmp-latency", dest="qmp_latency", default=False, action="store_true")
 
 
         # Hardware args
@@ -71,7 +72,8 @@ class BaseShell(object):
                       transport=args.transport,
                       sleep=args.sleep,
                       debug=args.debug,
-                      verbose=args.verbose)
+                      verbose=args.verbose,
+                      qmp_latency=args.qmp_latency)
 
     def get_hardware(self, args):
         def split_map(value):
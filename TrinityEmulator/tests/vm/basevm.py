@@ -21,6 +21,7 @@ import datetime
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'python'))
 from qemu.accel import kvm_available
 from qemu.machine import QEMUMachine
+from qemu.artifacts import ArtifactStore, ArtifactStoreError
 import subprocess
 import hashlib
 import optparse
@@ -101,30 +102,14 @@ class BaseVM(object):
         self._data_args = []
 
     def _download_with_cache(self, url, sha256sum=None, sha512sum=None):
-        def check_sha256sum(fname):
-            if not sha256sum:
-                return True
-            checksum = subprocess.check_output(["sha256sum", fname]).split()[0]
-            return sha256sum == checksum.decode("utf-8")
-
-        def check_sha512sum(fname):
-            if not sha512sum:
-                return True
-            checksum = subprocess.check_output(["sha512sum", fname]).split()[0]
-            return sha512sum == checksum.decode("utf-8")
-
-        cache_dir = os.path.expanduser("~/.cache/qemu-vm/download")
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-        fname = os.path.join(cache_dir,
-                             hashlib.sha1(url.encode("utf-8")).hexdigest())
-        if os.path.exists(fname) and check_sha256sum(fname) and check_sha512sum(fname):
-            return fname
-        logging.debug("Downloading %s to %s...", url, fname)
-        subprocess.check_call(["wget", "-c", url, "-O", fname + ".download"],
-                              stdout=self._stdout, stderr=self._stderr)
-        os.rename(fname + ".download", fname)
-        return fname
+        # Images are shared by digest with every other user of the store,
+        # so the same cloud image is downloaded and stored only once.
+        store = ArtifactStore()
+        try:
+            return store.fetch(url, sha256=sha256sum, sha512=sha512sum,
+                               stdout=self._stdout, stderr=self._stderr)
+        except ArtifactStoreError as e:
+            raise Exception("Failed to fetch %s: %s" % (url, e))
 
     def _ssh_do(self, user, cmd, check):
         ssh_cmd = ["ssh",
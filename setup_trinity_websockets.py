@@ -13,6 +13,15 @@ from pathlib import Path
 class TrinityWebSocketSetup:
     def __init__(self):
         self.novnc_dir = Path("noVNC_integrated")
+        self.routes_file = Path("trinity_workspace") / "websockify_tokens.cfg"
+        self.stats_dir = Path("trinity_workspace") / "gateway_stats"
+        # وضع البوابة: طابور محدود لكل عميل ودمج تحديثات الإطارات المتأخرة
+        self.backpressure = True
+        self.queue_limit = 1024 * 1024
+        # permessage-deflate للعملاء البعيدين؛ المستوى 1 يحافظ على زمن الاستجابة
+        self.deflate = True
+        self.deflate_level = 1
+        self.deflate_threshold = 256
         self.websocket_processes = []
         
     def log(self, message):
@@ -21,23 +30,57 @@ class TrinityWebSocketSetup:
     def kill_existing_websockets(self):
         """إنهاء جميع عمليات websockify الموجودة"""
         try:
-            result = subprocess.run(['pkill', '-f', 'websockify'], capture_output=True)
+            result = subprocess.run(['pkill', '-f', 'websockify|trinity_novnc_assets'], capture_output=True)
             if result.returncode == 0:
                 self.log("✅ Killed existing websocket processes")
             time.sleep(2)
         except:
             pass
             
+    def gateway_options(self):
+        """خيارات البوابة (الضغط العكسي و permessage-deflate) الممررة إلى trinity_novnc_assets.py"""
+        options = ["--stats-dir", str(self.stats_dir)]
+        if self.backpressure:
+            options += ["--backpressure", "--queue-limit", str(self.queue_limit)]
+        if self.deflate:
+            options += ["--deflate", "--deflate-level", str(self.deflate_level),
+                        "--deflate-threshold", str(self.deflate_threshold)]
+        return options
+        
+    def gateway_stats(self):
+        """عمق الطوابير والإطارات المسقطة عبر كل الجلسات"""
+        from trinity_novnc_assets import read_gateway_stats
+        return read_gateway_stats(self.stats_dir)
+        
     def start_websocket_proxy(self, web_port, vnc_port, description):
         """تشغيل websocket proxy لمنفذ VNC محدد"""
         cmd = [
-            "python3", "-m", "websockify",
+            "python3", "trinity_novnc_assets.py",
             "--web", str(self.novnc_dir),
             "--verbose",
+            *self.gateway_options(),
             f"0.0.0.0:{web_port}",
             f"localhost:{vnc_port}"
         ]
+        return self.start_gateway_process(cmd, web_port, vnc_port, description)
+        
+    def start_token_gateway(self, web_port, description="Trinity Gateway"):
+        """تشغيل بوابة websockify موجهة بالـ token (مسارات قابلة للنقل بين المضيفين)"""
+        self.routes_file.parent.mkdir(exist_ok=True)
+        self.routes_file.touch()
+        cmd = [
+            "python3", "trinity_novnc_assets.py",
+            "--web", str(self.novnc_dir),
+            "--verbose",
+            "--token-plugin", "TokenFile",
+            "--token-source", str(self.routes_file),
+            *self.gateway_options(),
+            f"0.0.0.0:{web_port}"
+        ]
+        return self.start_gateway_process(cmd, web_port, "tokens", description)
         
+    def start_gateway_process(self, cmd, web_port, vnc_port, description):
+        """تشغيل عملية websockify ومتابعتها"""
         self.log(f"🌐 Starting WebSocket for {description} (Web:{web_port} -> VNC:{vnc_port})")
         
         try:
@@ -89,7 +132,11 @@ class TrinityWebSocketSetup:
             if self.start_websocket_proxy(web_port, vnc_port, description):
                 successful += 1
                 
-        self.log(f"🎉 Setup complete: {successful}/{len(configs)} WebSocket proxies running")
+        # بوابة المسارات: ?path=websockify?token=<vm name>
+        if self.start_token_gateway(5006):
+            successful += 1
+                
+        self.log(f"🎉 Setup complete: {successful}/{len(configs) + 1} WebSocket proxies running")
         
         if successful > 0:
             self.log("🌐 Access URLs:")
@@ -98,6 +145,7 @@ class TrinityWebSocketSetup:
             self.log("   🎮 Android Gaming: http://localhost:5002/vnc.html")
             self.log("   💻 Android Dev: http://localhost:5003/vnc.html")
             self.log("   🧪 Android Demo: http://localhost:5004/vnc.html")
+            self.log("   🔀 Gateway: http://localhost:5006/vnc.html?path=websockify?token=<VM>")
             
         return successful > 0
         
@@ -117,6 +165,12 @@ class TrinityWebSocketSetup:
                         self.log(f"⚠️ WebSocket for {ws['description']} stopped")
                         
                 self.log(f"💗 WebSocket Status: {active_count}/{len(self.websocket_processes)} active")
+                stats = self.gateway_stats()
+                self.log(f"📊 Gateway: {stats['active']} sessions, "
+                         f"queue {stats['queue_depth'] // 1024} KB, "
+                         f"{stats['dropped_frames']} frames coalesced, "
+                         f"deflate ratio {stats['compression_ratio']:.2f} "
+                         f"({stats['compression_cpu_seconds']:.1f}s CPU)")
                 
             except KeyboardInterrupt:
                 self.log("🛑 Stopping WebSocket monitoring...")
@@ -12,6 +12,10 @@ import hashlib
 import json
 from pathlib import Path
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "TrinityEmulator", "python"))
+from qemu.artifacts import ArtifactStore
+
 class TrinityAndroidSetup:
     def __init__(self):
         self.workspace = Path("trinity_workspace")
@@ -36,6 +40,12 @@ class TrinityAndroidSetup:
             # Write minimal ISO structure
             f.write(b'\x00' * iso_size)
             
+        # نقل الـ ISO إلى المخزن وربطه (hardlink): كل workspace يشارك نفس البايتات؛
+        # على نظام ملفات آخر يبقى في مكانه بدل نسخة ثانية كاملة
+        store = ArtifactStore()
+        if store.same_filesystem(str(self.workspace)):
+            store.materialize(store.add_file(str(iso_path), move=True), str(iso_path))
+            
         self.log("✅ Created minimal Android ISO")
         return str(iso_path)
         
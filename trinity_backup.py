@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Trinity Backup - Live incremental backup of Android VM disks
+Persistent dirty bitmaps track changed clusters between backups; each run
+pushes only those clusters with blockdev-backup while the VM keeps running
+
+    python3 trinity_backup.py [--full] [VM ...]
+
+Backups land in trinity_workspace/backups/<vm>/<drive>/ as a qcow2 chain
+(full image, then incremental overlays backed by the previous backup).
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+from datetime import datetime
+
+from trinity_comprehensive_launcher import TrinityComprehensiveLauncher
+
+BITMAP = "trinity-backup"
+
+
+class TrinityBackup:
+    def __init__(self, launcher=None, parallel=4):
+        self.launcher = launcher or TrinityComprehensiveLauncher()
+        self.backup_dir = self.launcher.workspace_dir / "backups"
+        # نسخ كل الأسطول دفعة واحدة يشبع القرص؛ عدد محدود من الـ VMs في آن واحد
+        self.slots = threading.Semaphore(parallel)
+
+    def log(self, message):
+        print(f"[Backup] {message}")
+
+    def load_manifest(self, vm_name):
+        manifest_file = self.backup_dir / vm_name / "manifest.json"
+        if not manifest_file.exists():
+            return {"drives": {}}
+        with open(manifest_file, "r") as f:
+            return json.load(f)
+
+    def save_manifest(self, vm_name, manifest):
+        manifest_file = self.backup_dir / vm_name / "manifest.json"
+        tmp_file = manifest_file.with_suffix(".json.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_file, manifest_file)
+
+    @staticmethod
+    def writable_drives(qmp):
+        """أقراص VM القابلة للكتابة مع حالة bitmap النسخ الاحتياطي عليها"""
+        drives = []
+        for device in qmp.command("query-block"):
+            inserted = device.get("inserted")
+            if not inserted or inserted.get("ro"):
+                continue
+            bitmaps = inserted.get("dirty-bitmaps", device.get("dirty-bitmaps", []))
+            bitmap = next((b for b in bitmaps if b["name"] == BITMAP), None)
+            drives.append({
+                "device": device["device"],
+                "size": inserted["image"]["virtual-size"],
+                "bitmap": bitmap,
+            })
+        return drives
+
+    def create_target(self, vm_name, drive, parent):
+        """صورة الهدف: كاملة، أو overlay فوق النسخة السابقة للسلسلة"""
+        drive_dir = self.backup_dir / vm_name / drive["device"]
+        drive_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        target = drive_dir / f"{stamp}.{'inc' if parent else 'full'}.qcow2"
+        cmd = ["qemu-img", "create", "-f", "qcow2"]
+        if parent:
+            cmd.extend(["-b", os.path.abspath(parent), "-F", "qcow2"])
+        cmd.extend([str(target), str(drive["size"])])
+        subprocess.run(cmd, check=True, capture_output=True)
+        return target
+
+    def wait_for_jobs(self, qmp, job_ids, poll_interval=0.5):
+        """متابعة المهام حتى تنتهي، ثم قراءة نتيجتها من أحداث BLOCK_JOB_*"""
+        pending = set(job_ids)
+        while pending:
+            running = {job["device"] for job in qmp.command("query-block-jobs")}
+            pending &= running
+            if pending:
+                time.sleep(poll_interval)
+        results = {}
+        for event in qmp.get_events():
+            data = event.get("data", {})
+            if data.get("device") in job_ids and event["event"] in (
+                    "BLOCK_JOB_COMPLETED", "BLOCK_JOB_CANCELLED"):
+                results[data["device"]] = {
+                    "ok": event["event"] == "BLOCK_JOB_COMPLETED" and "error" not in data,
+                    "bytes": data.get("offset", 0),
+                    "error": data.get("error", event["event"].lower()),
+                }
+        qmp.clear_events()
+        return results
+
+    def backup_vm(self, vm, full=False):
+        """نسخة لكل أقراص VM في transaction واحدة (completion-mode=grouped)"""
+        start = time.monotonic()
+        manifest = self.load_manifest(vm["name"])
+        qmp = self.launcher.connect_vm_qmp(vm)
+        targets = {}
+        try:
+            drives = self.writable_drives(qmp)
+            actions = []
+            for drive in drives:
+                chain = manifest["drives"].get(drive["device"], [])
+                bitmap = drive["bitmap"]
+                # bitmap غير متسقة (إيقاف غير نظيف) لا يمكن الوثوق بها: نسخة كاملة جديدة
+                if bitmap and bitmap.get("inconsistent"):
+                    qmp.command("block-dirty-bitmap-remove", node=drive["device"], name=BITMAP)
+                    bitmap = None
+                # نسخة كاملة فشلت بعد تصفير الـ bitmap: السلسلة القديمة لا تغطي ما كُتب قبلها
+                must_be_full = drive["device"] in manifest.get("full_required", [])
+                incremental = not full and bitmap is not None and chain and not must_be_full
+                drive["mode"] = "incremental" if incremental else "full"
+
+                target = self.create_target(vm["name"], drive,
+                                            chain[-1]["file"] if incremental else None)
+                node = f"backup-{drive['device']}"
+                qmp.command("blockdev-add", **{
+                    "driver": "qcow2", "node-name": node,
+                    "file": {"driver": "file", "filename": str(target)},
+                    "backing": None,
+                })
+                targets[drive["device"]] = (target, node)
+
+                backup = {"job-id": node, "device": drive["device"], "target": node}
+                if incremental:
+                    # sync=incremental: تُصفّر الـ bitmap عند النجاح وتُستعاد عند الفشل
+                    backup.update(sync="incremental", bitmap=BITMAP)
+                else:
+                    # نقطة بداية السلسلة: bitmap فارغة في نفس لحظة النسخة الكاملة
+                    actions.append({
+                        "type": "block-dirty-bitmap-clear" if bitmap else "block-dirty-bitmap-add",
+                        "data": {"node": drive["device"], "name": BITMAP,
+                                 **({} if bitmap else {"persistent": True})},
+                    })
+                    backup["sync"] = "full"
+                actions.append({"type": "blockdev-backup", "data": backup})
+
+            if not actions:
+                qmp.close()
+                return {"name": vm["name"], "drives": []}
+            qmp.command("transaction", actions=actions,
+                        properties={"completion-mode": "grouped"})
+        except Exception:
+            # الـ transaction لم تبدأ: إزالة الأهداف فقط، الـ bitmaps لم تتغير
+            for target, node in targets.values():
+                try:
+                    qmp.command("blockdev-del", **{"node-name": node})
+                except Exception:
+                    pass
+                target.unlink()
+            qmp.close()
+            raise
+
+        try:
+            results = self.wait_for_jobs(qmp, [node for _, node in targets.values()])
+
+            report = []
+            for drive in drives:
+                target, node = targets[drive["device"]]
+                qmp.command("blockdev-del", **{"node-name": node})
+                result = results.get(node, {"ok": False, "bytes": 0, "error": "no job event"})
+                entry = {"device": drive["device"], "mode": drive["mode"],
+                         "bytes_copied": result["bytes"], "disk_size": drive["size"],
+                         "file": str(target), "ok": result["ok"]}
+                full_required = manifest.setdefault("full_required", [])
+                if result["ok"]:
+                    manifest["drives"].setdefault(drive["device"], [])
+                    if drive["mode"] == "full":
+                        manifest["drives"][drive["device"]] = []
+                        if drive["device"] in full_required:
+                            full_required.remove(drive["device"])
+                    manifest["drives"][drive["device"]].append({
+                        "file": str(target), "mode": drive["mode"],
+                        "time": datetime.now().isoformat(), "bytes": result["bytes"]})
+                else:
+                    entry["error"] = result["error"]
+                    target.unlink()
+                    if drive["mode"] == "full":
+                        # الـ transaction صفّرت الـ bitmap عند بدايتها؛ التغييرات منذ آخر نسخة
+                        # ناجحة لم تعد مسجلة فيها: إزالتها وإلزام التشغيل التالي بنسخة كاملة
+                        if drive["device"] not in full_required:
+                            full_required.append(drive["device"])
+                        try:
+                            qmp.command("block-dirty-bitmap-remove",
+                                        node=drive["device"], name=BITMAP)
+                        except Exception:
+                            pass
+                report.append(entry)
+            self.save_manifest(vm["name"], manifest)
+        finally:
+            qmp.close()
+
+        copied = sum(entry["bytes_copied"] for entry in report)
+        size = sum(entry["disk_size"] for entry in report)
+        self.log(f"💾 {vm['name']}: {copied / 1024 ** 2:.1f} MB copied of "
+                 f"{size / 1024 ** 3:.1f} GB ({100.0 * copied / size if size else 0:.1f}%)")
+        return {"name": vm["name"], "drives": report, "bytes_copied": copied,
+                "disk_size": size, "seconds": round(time.monotonic() - start, 2)}
+
+    def backup_fleet(self, names=None, full=False):
+        vms = self.launcher.load_running_vms()
+        if names:
+            vms = [vm for vm in vms if vm["name"] in names]
+        self.log(f"🗄️ Backing up {len(vms)} VMs ({'full' if full else 'incremental'})...")
+        results = [None] * len(vms)
+
+        def worker(index, vm):
+            with self.slots:
+                try:
+                    results[index] = self.backup_vm(vm, full)
+                except Exception as e:
+                    self.log(f"❌ {vm['name']}: {e}")
+                    results[index] = {"name": vm["name"], "error": str(e)}
+
+        threads = [threading.Thread(target=worker, args=(index, vm))
+                   for index, vm in enumerate(vms)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        copied = sum(result.get("bytes_copied", 0) for result in results)
+        size = sum(result.get("disk_size", 0) for result in results)
+        failed = [result["name"] for result in results if "error" in result
+                  or not all(drive["ok"] for drive in result["drives"])]
+        self.log(f"✅ Fleet backup: {copied / 1024 ** 2:.1f} MB copied of "
+                 f"{size / 1024 ** 3:.1f} GB, {len(failed)} failed")
+        return {"bytes_copied": copied, "disk_size": size, "failed": failed, "vms": results}
+
+
+def main():
+    args = sys.argv[1:]
+    full = "--full" in args
+    names = [arg for arg in args if not arg.startswith("--")]
+    report = TrinityBackup().backup_fleet(names, full)
+    return 1 if report["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
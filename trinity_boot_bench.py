@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Trinity Boot Benchmark - Repeatable Android boot timing with phase breakdown
+Boots a Trinity VM through QEMUMachine, timestamps console/QMP milestones and
+records host CPU and I/O per phase
+
+    python3 trinity_boot_bench.py --runs 5 --label baseline -o baseline.json
+    python3 trinity_boot_bench.py --runs 5 --label host-cpu --cpu host -o host.json
+    python3 trinity_boot_bench.py --compare baseline.json host.json
+    python3 trinity_boot_bench.py --runs 5 --template /dev/shm/android-template -o template.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import threading
+import statistics
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "TrinityEmulator", "python"))
+from qemu.machine import QEMUMachine
+
+from trinity_comprehensive_launcher import TrinityComprehensiveLauncher
+
+# المراحل بالترتيب: كل مرحلة تنتهي عند ظهور نمطها على الـ console
+# (firmware تبدأ عند حدث RESUME، ونهاية zygote هي boot-completed)
+DEFAULT_PHASES = [
+    ("firmware", r"Linux version"),
+    ("kernel", r"Run /init|Freeing unused kernel (image )?memory"),
+    ("init", r"init: .*(Starting service 'zygote|zygote)"),
+    ("zygote", r"sys\.boot_completed=1|Boot is finished"),
+]
+
+
+def proc_counters(pid):
+    """وقت CPU (ثوان) وبايتات القراءة/الكتابة لعملية QEMU"""
+    ticks = os.sysconf("SC_CLK_TCK")
+    counters = {"cpu_s": 0.0, "read_bytes": 0, "write_bytes": 0}
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        counters["cpu_s"] = (int(fields[11]) + int(fields[12])) / ticks
+        with open(f"/proc/{pid}/io") as f:
+            for line in f:
+                key, value = line.split(":")
+                if key in ("read_bytes", "write_bytes"):
+                    counters[key] = int(value)
+    except (OSError, IndexError, ValueError):
+        pass
+    return counters
+
+
+class BootRun:
+    """تشغيل واحد: قراءة الـ console وتسجيل حدود المراحل"""
+
+    def __init__(self, vm, phases):
+        self.vm = vm
+        self.phases = [(name, re.compile(pattern)) for name, pattern in phases]
+        self.marks = []
+        self.t0 = None
+        self.completed = False
+        self.launch_s = 0.0
+        self.done = threading.Event()
+
+    def mark(self, name, source):
+        pid = self.vm.get_pid()
+        self.marks.append({"phase": name, "source": source,
+                           "t": time.monotonic() - self.t0,
+                           "counters": proc_counters(pid) if pid else {}})
+
+    def read_console(self):
+        console = self.vm.console_socket.makefile(errors="replace")
+        next_phase = 0
+        try:
+            for line in console:
+                if next_phase >= len(self.phases):
+                    break
+                # قد تُطبع عدة مراحل بسرعة؛ نفحص المرحلة المتوقعة فقط للحفاظ على الترتيب
+                while next_phase < len(self.phases) and \
+                        self.phases[next_phase][1].search(line):
+                    self.mark(self.phases[next_phase][0], "console")
+                    next_phase += 1
+            self.completed = next_phase >= len(self.phases)
+        except OSError:
+            pass
+        finally:
+            self.done.set()
+
+    def run(self, timeout, on_ready=None):
+        start = time.monotonic()
+        self.vm.launch()
+        self.t0 = time.monotonic()
+        self.launch_s = self.t0 - start
+        self.mark("launch", "qmp")
+        reader = threading.Thread(target=self.read_console, daemon=True)
+        reader.start()
+        self.vm.command("cont")
+        self.vm.event_wait("RESUME", timeout=10)
+        self.mark("resume", "qmp")
+        self.done.wait(timeout)
+        if self.completed and on_ready:
+            on_ready(self.vm)
+        self.vm.shutdown()
+        return self.completed
+
+    def breakdown(self):
+        """مدة واستهلاك كل مرحلة = الفرق بين علامتين متتاليتين"""
+        phases = {}
+        for previous, current in zip(self.marks, self.marks[1:]):
+            delta = {key: current["counters"].get(key, 0) - previous["counters"].get(key, 0)
+                     for key in ("cpu_s", "read_bytes", "write_bytes")}
+            delta["seconds"] = current["t"] - previous["t"]
+            phases[current["phase"]] = delta
+        return phases
+
+
+class TrinityBootBenchmark:
+    def __init__(self, args):
+        self.args = args
+        self.launcher = TrinityComprehensiveLauncher()
+
+    def log(self, message):
+        print(f"[Boot Bench] {message}", file=sys.stderr)
+
+    def disk_images(self):
+        images = self.launcher.create_android_images("BootBench", 99)
+        return [self.args.system_image or images["system_disk"],
+                self.args.data_image or images["data_disk"]]
+
+    def template_disks(self, template_dir):
+        """overlays دائمة للقالب: كتابات إقلاعه يجب أن تبقى لأن النسخ تستأنف ذاكرته وpage cache"""
+        os.makedirs(template_dir, exist_ok=True)
+        disks = []
+        for index, image in enumerate(self.disk_images()):
+            image = os.path.abspath(image)
+            overlay = os.path.join(os.path.abspath(template_dir), f"disk-{index}.qcow2")
+            info = json.loads(subprocess.run(["qemu-img", "info", "--output=json", image],
+                                             check=True, capture_output=True, text=True).stdout)
+            subprocess.run(["qemu-img", "create", "-f", "qcow2", "-b", image,
+                            "-F", info["format"], overlay], check=True, capture_output=True)
+            disks.append(overlay)
+        return disks
+
+    def machine_args(self, disks=None):
+        """disks: أقراص دائمة (قالب)؛ بدونها كل تشغيل يبدأ من نفس حالة القرص (snapshot=on)"""
+        args = self.args
+        if disks is None:
+            drives = [f"file={image},if=ide,snapshot=on" for image in self.disk_images()]
+        else:
+            drives = [f"file={image},if=ide" for image in disks]
+        qemu_args = [
+            "-S",
+            "-m", args.memory,
+            "-smp", args.cores,
+            "-cpu", args.cpu,
+            "-vga", "std",
+        ]
+        for drive in drives:
+            qemu_args.extend(["-drive", drive])
+        if os.path.exists("/dev/kvm"):
+            qemu_args.append("-enable-kvm")
+        else:
+            qemu_args.extend(["-accel", "tcg"])
+        if args.kernel:
+            qemu_args.extend(["-kernel", args.kernel, "-append", args.append])
+            if args.initrd:
+                qemu_args.extend(["-initrd", args.initrd])
+        qemu_args.extend(args.extra)
+        return qemu_args
+
+    def run(self):
+        args = self.args
+        phases = DEFAULT_PHASES
+        if args.phases:
+            with open(args.phases) as f:
+                phases = [tuple(item) for item in json.load(f)]
+        binary = args.binary or self.launcher.check_trinity_binary()
+        if args.template:
+            return self.run_template(binary, phases)
+        runs = []
+        for index in range(args.runs):
+            with tempfile.TemporaryDirectory() as tmp:
+                vm = QEMUMachine(binary, args=self.machine_args(),
+                                 name=f"bootbench-{index}", test_dir=tmp)
+                vm.set_console()
+                boot = BootRun(vm, phases)
+                completed = boot.run(args.timeout)
+            result = self.boot_result(index, boot, completed)
+            self.log(f"run {index}: {'ok' if completed else 'TIMEOUT'} "
+                     f"{result['total_s']:.2f}s")
+            runs.append(result)
+        return self.report(binary, runs)
+
+    @staticmethod
+    def boot_result(index, boot, completed):
+        total_s = boot.marks[-1]["t"] if boot.marks else None
+        return {"run": index, "completed": completed, "total_s": total_s,
+                "ready_s": boot.launch_s + total_s if total_s is not None else None,
+                "phases": boot.breakdown()}
+
+    def run_template(self, binary, phases):
+        """إقلاع بارد واحد يحفظ القالب ثم نسخ من القالب عبر -incoming؛ المقارنة بزمن الجاهزية"""
+        args = self.args
+        runs = []
+        if not os.path.exists(os.path.join(args.template, "template.json")):
+            with tempfile.TemporaryDirectory() as tmp:
+                vm = QEMUMachine(binary, args=self.machine_args(self.template_disks(args.template)),
+                                 name="bootbench-template", test_dir=tmp)
+                vm.set_console()
+                vm.set_template_memory(args.template, f"{args.memory}M")
+                boot = BootRun(vm, phases)
+                completed = boot.run(args.timeout, on_ready=lambda machine: machine.save_template())
+            if not completed:
+                self.log("❌ Cold boot for the template did not complete")
+                return self.report(binary, [self.boot_result(0, boot, completed)])
+            cold = self.boot_result(0, boot, completed)
+            cold["mode"] = "cold"
+            runs.append(cold)
+            self.log(f"cold boot: {cold['ready_s']:.2f}s, template saved in {args.template}")
+
+        for index in range(args.runs):
+            with tempfile.TemporaryDirectory() as tmp:
+                vm = QEMUMachine(binary, name=f"bootbench-clone-{index}", test_dir=tmp)
+                start = time.monotonic()
+                try:
+                    vm.launch_from_template(args.template)
+                    ready_s = time.monotonic() - start
+                    pid = vm.get_pid()
+                    counters = proc_counters(pid) if pid else {}
+                finally:
+                    vm.shutdown()
+            runs.append({"run": len(runs), "mode": "clone", "completed": True,
+                         "total_s": ready_s, "ready_s": ready_s,
+                         "phases": {"clone": dict(counters, seconds=ready_s)}})
+            self.log(f"clone {index}: {ready_s * 1000:.1f}ms")
+        report = self.report(binary, runs)
+        report["template"] = {mode: describe([run["ready_s"] for run in runs
+                                              if run.get("mode") == mode])
+                              for mode in ("cold", "clone")}
+        return report
+
+    def report(self, binary, runs):
+        args = self.args
+        return {"label": args.label, "binary": binary,
+                "config": {"memory": args.memory, "cores": args.cores, "cpu": args.cpu,
+                           "append": args.append if args.kernel else None,
+                           "extra": args.extra},
+                "runs": runs,
+                "summary": summarize(runs)}
+
+
+def describe(values):
+    if not values:
+        return None
+    return {"n": len(values), "mean": round(statistics.mean(values), 4),
+            "median": round(statistics.median(values), 4),
+            "stdev": round(statistics.stdev(values), 4) if len(values) > 1 else 0.0,
+            "min": round(min(values), 4), "max": round(max(values), 4)}
+
+
+def summarize(runs):
+    """إحصائيات كل مرحلة عبر التشغيلات المكتملة"""
+    completed = [run for run in runs if run["completed"]]
+    names = []
+    for run in completed:
+        for name in run["phases"]:
+            if name not in names:
+                names.append(name)
+    summary = {"completed_runs": len(completed), "total_s": describe(
+        [run["total_s"] for run in completed]), "ready_s": describe(
+        [run["ready_s"] for run in completed if run.get("ready_s") is not None])}
+    for name in names:
+        summary[name] = {metric: describe([run["phases"][name][metric]
+                                           for run in completed if name in run["phases"]])
+                         for metric in ("seconds", "cpu_s", "read_bytes", "write_bytes")}
+    return summary
+
+
+def compare(paths):
+    """جدول مقارنة متوسط زمن كل مرحلة بين عدة نتائج"""
+    results = []
+    for path in paths:
+        with open(path) as f:
+            results.append(json.load(f))
+    base = results[0]["summary"]
+    names = [name for name in base if isinstance(base[name], dict) and "seconds" in base[name]]
+    names += ["total_s"] + (["ready_s"] if base.get("ready_s") else [])
+    print(f"{'phase':<16}" + "".join(f"{r['label']:>18}" for r in results))
+    for name in names:
+        row = f"{name:<16}"
+        whole = name in ("total_s", "ready_s")
+        base_stats = base[name] if whole else base[name]["seconds"]
+        for result in results:
+            stats = result["summary"].get(name)
+            stats = stats.get("seconds") if stats and not whole else stats
+            if not stats or not base_stats:
+                row += f"{'-':>18}"
+                continue
+            change = 100.0 * (stats["mean"] - base_stats["mean"]) / base_stats["mean"] \
+                if base_stats["mean"] else 0.0
+            row += f"{stats['mean']:>9.2f}s {change:>+6.1f}%"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trinity Android boot benchmark")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--label", default="default")
+    parser.add_argument("--binary")
+    parser.add_argument("--memory", default="2048")
+    parser.add_argument("--cores", default="2")
+    parser.add_argument("--cpu", default="qemu64")
+    parser.add_argument("--system-image")
+    parser.add_argument("--data-image")
+    parser.add_argument("--kernel")
+    parser.add_argument("--initrd")
+    parser.add_argument("--append", default="console=ttyS0 quiet=0 androidboot.selinux=permissive")
+    parser.add_argument("--phases", help="JSON list of [name, regex] pairs")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--template", metavar="DIR",
+                        help="time clones started from a saved template (cold boot once to create it)")
+    parser.add_argument("--compare", nargs="+", metavar="RESULT")
+    parser.add_argument("-o", "--output")
+    parser.add_argument("extra", nargs="*", help="extra QEMU arguments (after --)")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return 0
+
+    result = TrinityBootBenchmark(args).run()
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0 if result["summary"]["completed_runs"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
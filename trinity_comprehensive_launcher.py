@@ -10,22 +10,51 @@ import subprocess
 import socket
 import time
 import json
+import signal
 import threading
 from pathlib import Path
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "TrinityEmulator", "python"))
+from qemu.qmp import QEMUMonitorProtocol, QMPError, QMPTimeoutError
+from qemu.artifacts import ArtifactStore, DEFAULT_ROOT
+from qemu.qmpstats import QMPLatencyStats
+
+from trinity_image_baker import TrinityImageBaker
+from trinity_storage_daemon import TrinityStorageDaemon
+
 class TrinityComprehensiveLauncher:
-    def __init__(self):
+    def __init__(self, workspace_dir="trinity_workspace", vnc_base_port=5910,
+                 adb_base_port=5555):
         self.trinity_dir = Path("TrinityEmulator")
-        self.workspace_dir = Path("trinity_workspace")
+        self.workspace_dir = Path(workspace_dir)
         self.workspace_dir.mkdir(exist_ok=True)
+        self.registry_lock = threading.Lock()
+        # زمن كل أمر QMP (إرسال/انتظار QEMU/قراءة) لكل اتصالات هذه العملية
+        self.qmp_latency = QMPLatencyStats()
         
         # Trinity configuration
         self.config = {
             "memory": "2048",  # 2GB RAM
             "cores": "2",
-            "vnc_base_port": 5910,  # Start from 5910
+            "max_cores": "4",  # سقف vCPU hotplug
+            "data_disk_size": "2G",
+            "data_staging_dir": None,  # مجلد userdata يُخبز مسبقا (mkfs.ext4 -d)
+            "data_template": None,  # أو صورة userdata جاهزة
+            "system_image": None,  # صورة Android أساسية تُبنى فوقها أقراص النظام (overlay)
+            "shared_base": False,  # صورة النظام عبر qemu-storage-daemon (NBD) بدل الملف مباشرة
+            "headless": False,  # -display none: بدون VNC حتى يطلبه مشاهد (attach_display)
+            "artifact_store": DEFAULT_ROOT,  # مخزن الصور حسب SHA-256 (مشترك مع tests/vm)
+            "artifact_store_max_bytes": None,  # سقف المخزن؛ الأقدم استخداما يُحذف أولا
+            "vnc_base_port": vnc_base_port,  # Start from 5910
+            "adb_base_port": adb_base_port,
             "android_vms": [],
-            "trinity_features": True
+            "trinity_features": True,
+            "trim_interval": 6 * 3600,  # دورة guest-fstrim لكل VM (ثوان)
+            "trim_stagger": 60,  # فاصل بين VM وأخرى حتى لا تتزامن عمليات TRIM
+            "trim_idle_cpu": 10.0,  # VM خاملة: أقل من هذه النسبة من CPU
+            "input_api_port": 5005,
+            "session_broker_port": 5007
         }
         
     def log(self, message, level="INFO"):
@@ -53,14 +82,59 @@ class TrinityComprehensiveLauncher:
         self.log("⚠️ Trinity binary not found, using system QEMU")
         return "qemu-system-x86_64"
         
-    def create_android_images(self, vm_name, vm_index):
+    def artifact_store(self):
+        return ArtifactStore(self.config["artifact_store"],
+                             self.config["artifact_store_max_bytes"])
+        
+    def base_image_backing(self, base_image):
+        """مسار صورة النظام التي تُبنى فوقها overlays الـ VMs
+        
+        نسخ الصورة نفسها في أماكن مختلفة تُخزن مرة واحدة في المخزن، لكن فقط إذا أمكن
+        استيرادها بدون نسخ كامل (reflink) وربطها بـ hardlink في مساحة العمل: الـ hardlink
+        يمنع evict() من حذف كائن تعتمد عليه overlays. غير ذلك: الصورة الأصلية مباشرة.
+        """
+        base_image = os.path.abspath(base_image)
+        store = self.artifact_store()
+        if not store.same_filesystem(str(self.workspace_dir)):
+            return base_image
+        digest = store.add_file(base_image, reflink_only=True)
+        if digest is None:
+            return base_image
+        pinned = (self.workspace_dir / "base-images" / digest).absolute()
+        if not pinned.exists():
+            pinned.parent.mkdir(exist_ok=True)
+            store.materialize(digest, str(pinned))
+        return str(pinned)
+        
+    def create_android_images(self, vm_name, vm_index, base_image=None,
+                              data_staging_dir=None, data_template=None, shared_base=False):
         """إنشاء صور Android VM"""
         vm_dir = self.workspace_dir / f"vm_{vm_index}_{vm_name}"
         vm_dir.mkdir(exist_ok=True)
         
         # إنشاء قرص النظام
         system_disk = vm_dir / "system.img"
-        if not system_disk.exists():
+        if not system_disk.exists() and base_image and shared_base:
+            # overlay فوق تصدير NBD واحد مشترك من qemu-storage-daemon
+            backing = TrinityStorageDaemon(self.workspace_dir).ensure_export(base_image)
+            self.log(f"💾 Creating system overlay for {vm_name} on {backing}...")
+            subprocess.run([
+                "qemu-img", "create", "-f", "qcow2",
+                "-b", backing, "-F", "raw",
+                str(system_disk)
+            ], check=True, capture_output=True)
+        elif not system_disk.exists() and base_image:
+            backing = self.base_image_backing(base_image)
+            self.log(f"💾 Creating system overlay for {vm_name} on {base_image}...")
+            info = json.loads(subprocess.run([
+                "qemu-img", "info", "--output=json", backing
+            ], check=True, capture_output=True, text=True).stdout)
+            subprocess.run([
+                "qemu-img", "create", "-f", "qcow2",
+                "-b", backing, "-F", info["format"],
+                str(system_disk)
+            ], check=True, capture_output=True)
+        elif not system_disk.exists():
             self.log(f"💾 Creating system disk for {vm_name}...")
             subprocess.run([
                 "qemu-img", "create", "-f", "qcow2",
@@ -69,11 +143,23 @@ class TrinityComprehensiveLauncher:
             
         # إنشاء قرص البيانات
         data_disk = vm_dir / "data.img"
-        if not data_disk.exists():
+        data_staging_dir = data_staging_dir or self.config["data_staging_dir"]
+        data_template = data_template or self.config["data_template"]
+        if not data_disk.exists() and (data_staging_dir or data_template):
+            # userdata مخبوزة مسبقا: الإقلاع الأول لا يحتاج تهيئة نظام الملفات
+            baked = TrinityImageBaker(self.workspace_dir / "baked", store=self.artifact_store()).bake(
+                data_staging_dir, data_template, self.config["data_disk_size"])
+            self.log(f"💾 Creating data overlay for {vm_name} on {baked}...")
+            subprocess.run([
+                "qemu-img", "create", "-f", "qcow2",
+                "-b", os.path.abspath(baked), "-F", "qcow2",
+                str(data_disk)
+            ], check=True, capture_output=True)
+        elif not data_disk.exists():
             self.log(f"💾 Creating data disk for {vm_name}...")
             subprocess.run([
                 "qemu-img", "create", "-f", "qcow2",
-                str(data_disk), "2G"
+                str(data_disk), self.config["data_disk_size"]
             ], check=True, capture_output=True)
             
         return {
@@ -82,26 +168,53 @@ class TrinityComprehensiveLauncher:
             "data_disk": str(data_disk)
         }
         
-    def launch_trinity_vm(self, vm_config, vm_index):
+    def launch_trinity_vm(self, vm_config, vm_index, extra_args=None):
         """تشغيل Trinity VM مع إعدادات متقدمة"""
         trinity_binary = self.check_trinity_binary()
         vnc_port = self.config["vnc_base_port"] + vm_index
+        adb_port = self.config["adb_base_port"] + vm_index
         
         vm_name = vm_config["name"]
-        images = self.create_android_images(vm_name, vm_index)
+        images = self.create_android_images(vm_name, vm_index, vm_config.get("image"),
+                                            vm_config.get("data_staging_dir"),
+                                            vm_config.get("data_template"),
+                                            vm_config.get("shared_base", self.config["shared_base"]))
+        memory = vm_config.get("memory", self.config["memory"])
+        max_memory = vm_config.get("max_memory", memory)
+        cores = vm_config.get("cores", self.config["cores"])
+        max_cores = str(max(int(cores), int(vm_config.get("max_cores", self.config["max_cores"]))))
+        headless = vm_config.get("headless", self.config["headless"])
+        if headless:
+            # VNC مهيأ لكن لا يستمع (-vnc none)؛ الوصول عبر QMP و serial فقط
+            display_args = ["-display", "none", "-vnc", "none",
+                            "-serial", f"unix:{images['vm_dir']}/serial.sock,server,nowait"]
+        else:
+            display_args = ["-display", f"vnc=:{vnc_port - 5900},password=off"]
         
         # إعداد الأمر الأساسي
         cmd = [
             trinity_binary,
             "-name", f"Trinity-{vm_name}",
-            "-m", self.config["memory"],
-            "-smp", self.config["cores"],
-            "-hda", images["system_disk"],
-            "-hdb", images["data_disk"],
-            "-display", f"vnc=:{vnc_port - 5900},password=off",
+            "-m", max_memory,
+            "-smp", f"{cores},maxcpus={max_cores}",
+            # discard=unmap: TRIM من الضيف يحرر clusters الـ qcow2 (راجع trinity_trim.py)
+            "-drive", f"file={images['system_disk']},if=ide,index=0,media=disk,"
+                      "discard=unmap,detect-zeroes=unmap",
+            "-drive", f"file={images['data_disk']},if=ide,index=1,media=disk,"
+                      "discard=unmap,detect-zeroes=unmap",
+            *display_args,
             "-vga", "std",
-            "-netdev", f"user,id=net0,hostfwd=tcp::{5555 + vm_index}-:5555",
+            "-netdev", f"user,id=net0,hostfwd=tcp::{adb_port}-:5555",
             "-device", "e1000,netdev=net0",
+            "-device", "virtio-balloon-pci,id=balloon0",
+            # مؤشر مطلق: input-send-event يرفض أحداث abs (اللمس) بدون جهاز يستقبلها
+            "-device", "qemu-xhci,id=xhci",
+            "-device", "usb-tablet,bus=xhci.0",
+            "-qmp", f"unix:{images['vm_dir']}/qmp.sock,server,nowait",
+            # قناة qemu-ga (guest-fstrim وغيرها)
+            "-chardev", f"socket,path={images['vm_dir']}/qga.sock,server,nowait,id=qga0",
+            "-device", "virtio-serial",
+            "-device", "virtserialport,chardev=qga0,name=org.qemu.guest_agent.0",
             "-daemonize",
             "-pidfile", f"{images['vm_dir']}/vm.pid"
         ]
@@ -131,9 +244,16 @@ class TrinityComprehensiveLauncher:
             cmd.extend(["-accel", "tcg"])
             self.log("⚠️ Using TCG (software emulation)")
             
-        self.log(f"🚀 Launching {vm_name} on VNC port {vnc_port}...")
+        if extra_args:
+            cmd.extend(extra_args)
+            
+        self.log(f"🚀 Launching {vm_name} " +
+                 ("headless (QMP/serial only)..." if headless else f"on VNC port {vnc_port}..."))
         self.log(f"Command: {' '.join(cmd)}")
         
+        pid_file = f"{images['vm_dir']}/vm.pid"
+        # QEMU قديم ما زال يملك الملف ليس دليلا على نجاح هذا التشغيل
+        previous_pid = self.vm_pid({"pid_file": pid_file})
         try:
             subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
             
@@ -141,18 +261,38 @@ class TrinityComprehensiveLauncher:
             time.sleep(5)
             
             # فحص إذا كان VM يعمل
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            result = sock.connect_ex(('localhost', vnc_port))
-            sock.close()
+            if headless:
+                pid = self.vm_pid({"pid_file": pid_file})
+                result = 0 if pid and pid != previous_pid else 1
+            else:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                result = sock.connect_ex(('localhost', vnc_port))
+                sock.close()
             
             if result == 0:
-                self.log(f"✅ {vm_name} running on VNC :{vnc_port}")
+                if headless:
+                    self.log(f"✅ {vm_name} running headless")
+                else:
+                    self.log(f"✅ {vm_name} running on VNC :{vnc_port}")
+                    self.update_gateway_route(vm_name, f"localhost:{vnc_port}")
                 return {
                     "name": vm_name,
-                    "vnc_port": vnc_port,
-                    "adb_port": 5555 + vm_index,
+                    "index": vm_index,
+                    "memory": memory,
+                    "max_memory": max_memory,
+                    "cores": cores,
+                    "max_cores": max_cores,
+                    "image": vm_config.get("image"),
+                    "profile": vm_config.get("profile", vm_config.get("type")),
+                    "vnc_port": None if headless else vnc_port,
+                    "adb_port": adb_port,
                     "status": "running",
-                    "pid_file": f"{images['vm_dir']}/vm.pid"
+                    "headless": headless,
+                    "vnc_socket": f"{images['vm_dir']}/vnc.sock" if headless else None,
+                    "serial_socket": f"{images['vm_dir']}/serial.sock" if headless else None,
+                    "pid_file": f"{images['vm_dir']}/vm.pid",
+                    "qmp_socket": f"{images['vm_dir']}/qmp.sock",
+                    "qga_socket": f"{images['vm_dir']}/qga.sock"
                 }
             else:
                 self.log(f"❌ Failed to start {vm_name}")
@@ -173,6 +313,9 @@ class TrinityComprehensiveLauncher:
             {"name": "Android-Dev", "type": "development"}
         ]
         
+        if self.config["system_image"]:
+            vm_configs = [dict(config, image=self.config["system_image"]) for config in vm_configs]
+            
         running_vms = []
         for i, config in enumerate(vm_configs):
             vm_info = self.launch_trinity_vm(config, i)
@@ -183,18 +326,280 @@ class TrinityComprehensiveLauncher:
             self.log("🎉 Trinity VMs launched successfully!")
             self.log("📋 Running instances:")
             for vm in running_vms:
-                self.log(f"   📱 {vm['name']}: VNC localhost:{vm['vnc_port']}, ADB localhost:{vm['adb_port']}")
+                display = "headless" if vm.get("headless") else f"VNC localhost:{vm['vnc_port']}"
+                self.log(f"   📱 {vm['name']}: {display}, ADB localhost:{vm['adb_port']}")
                 
             # حفظ معلومات VMs
-            vm_status_file = self.workspace_dir / "running_vms.json"
-            with open(vm_status_file, 'w') as f:
-                json.dump(running_vms, f, indent=2)
+            self.save_running_vms(running_vms)
                 
             return running_vms
         else:
             self.log("❌ Failed to start any Trinity VMs")
             return []
             
+    def load_running_vms(self):
+        """قراءة سجل VMs العاملة من running_vms.json"""
+        vm_status_file = self.workspace_dir / "running_vms.json"
+        if not vm_status_file.exists():
+            return []
+        try:
+            with open(vm_status_file, 'r') as f:
+                return json.load(f)
+        except:
+            return []
+            
+    def save_running_vms(self, running_vms):
+        """حفظ سجل VMs بشكل ذري (ملف مؤقت ثم os.replace)"""
+        vm_status_file = self.workspace_dir / "running_vms.json"
+        tmp_file = vm_status_file.with_suffix(".json.tmp")
+        with open(tmp_file, 'w') as f:
+            json.dump(running_vms, f, indent=2)
+        os.replace(tmp_file, vm_status_file)
+        
+    def update_running_vms(self, update):
+        """تعديل السجل داخل قفل: update تستقبل القائمة وتعيد القائمة الجديدة"""
+        with self.registry_lock:
+            running_vms = update(self.load_running_vms())
+            self.save_running_vms(running_vms)
+            return running_vms
+            
+    def next_free_index(self):
+        """أول رقم VM غير مستخدم في السجل"""
+        used = {vm.get("index") for vm in self.load_running_vms()}
+        index = 0
+        while index in used:
+            index += 1
+        return index
+        
+    def update_gateway_route(self, vm_name, target=None):
+        """تحديث مسار websockify (TokenFile) للـ VM بشكل ذري؛ target=None يحذف المسار"""
+        with self.registry_lock:
+            routes_file = self.workspace_dir / "websockify_tokens.cfg"
+            routes = {}
+            if routes_file.exists():
+                for line in routes_file.read_text().splitlines():
+                    if ":" in line:
+                        token, route = line.split(":", 1)
+                        routes[token.strip()] = route.strip()
+            if target is None:
+                routes.pop(vm_name, None)
+            else:
+                routes[vm_name] = target
+            tmp_file = routes_file.with_suffix(".cfg.tmp")
+            tmp_file.write_text("".join(f"{token}: {route}\n"
+                                        for token, route in routes.items()))
+            os.replace(tmp_file, routes_file)
+            
+    def attach_display(self, vm):
+        """مسار البوابة لشاشة VM؛ VM بدون شاشة تفتح VNC على UNIX socket عند أول طلب"""
+        if not vm.get("headless"):
+            return f"localhost:{vm['vnc_port']}"
+        route = f"unix_socket:{vm['vnc_socket']}"
+        if not os.path.exists(vm["vnc_socket"]):
+            qmp = self.connect_vm_qmp(vm)
+            try:
+                qmp.command("change", device="vnc", target=f"unix:{vm['vnc_socket']}")
+            finally:
+                qmp.close()
+            self.log(f"🖥️ {vm['name']}: VNC attached on {vm['vnc_socket']}")
+        self.update_gateway_route(vm["name"], route)
+        return route
+        
+    def detach_display(self, vm):
+        """إيقاف VNC لـ VM بدون شاشة بعد مغادرة آخر مشاهد"""
+        if not vm.get("headless"):
+            return
+        qmp = self.connect_vm_qmp(vm)
+        try:
+            qmp.command("change", device="vnc", target="none")
+        finally:
+            qmp.close()
+        if os.path.exists(vm["vnc_socket"]):
+            os.unlink(vm["vnc_socket"])
+        self.update_gateway_route(vm["name"], None)
+        
+    def connect_vm_qmp(self, vm):
+        """فتح اتصال QMP مع VM عاملة"""
+        qmp_socket = vm.get("qmp_socket")
+        if not qmp_socket:
+            raise RuntimeError(f"{vm['name']} has no QMP socket")
+        qmp = QEMUMonitorProtocol(qmp_socket, nickname=vm["name"],
+                                  latency=self.qmp_latency)
+        qmp.connect()
+        return qmp
+        
+    def log_qmp_latency(self):
+        """طباعة نسب زمن أوامر QMP المسجلة حتى الآن (ms)"""
+        if self.qmp_latency.commands():
+            self.log("⏱️ QMP latency:\n" + self.qmp_latency.format())
+        
+    @staticmethod
+    def vm_pid(vm):
+        """PID عملية QEMU إذا كانت حية وهي صاحبة ملف pid هذا
+
+        QEMU لا يحذف ملف pid إلا عند خروج نظيف؛ بعد انهيار أو SIGKILL أو إعادة إقلاع
+        قد يعود نفس الرقم لعملية أخرى، فيُقارن سطر أوامرها (-pidfile) بالملف
+        ويُحذف الملف إذا لم تعد عمليته موجودة
+        """
+        try:
+            pid_file = vm["pid_file"]
+            with open(pid_file, "r") as f:
+                pid = int(f.read().strip())
+        except (OSError, ValueError, KeyError):
+            return None
+        if TrinityComprehensiveLauncher.pid_owns_file(pid, pid_file):
+            return pid
+        try:
+            os.unlink(pid_file)
+        except OSError:
+            pass
+        return None
+
+    @staticmethod
+    def pid_owns_file(pid, pid_file):
+        """هل العملية pid هي QEMU شُغّلت بـ -pidfile <pid_file>؟"""
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                args = f.read().decode(errors="replace").split("\0")
+        except OSError:
+            return False
+        if "qemu" not in os.path.basename(args[0]):
+            return False
+        wanted = os.path.realpath(pid_file)
+        for option, value in zip(args, args[1:]):
+            if option not in ("-pidfile", "--pidfile"):
+                continue
+            # المسار قد يكون نسبيا لمجلد المشغل (QEMU المنفصل ينتقل إلى /)
+            candidates = [os.path.realpath(value)]
+            try:
+                candidates.append(os.path.realpath(
+                    os.path.join(os.readlink(f"/proc/{pid}/cwd"), value)))
+            except OSError:
+                pass
+            if wanted in candidates:
+                return True
+        return False
+            
+    @staticmethod
+    def wait_pid_exit(pid, deadline):
+        while time.monotonic() < deadline:
+            try:
+                os.kill(pid, 0)
+            except OSError:
+                return True
+            time.sleep(0.05)
+        return False
+        
+    def shutdown_vm(self, vm, deadline, exit_grace=10.0):
+        """system_powerdown ثم انتظار SHUTDOWN حتى المهلة العامة؛ التصعيد للمتأخرين فقط"""
+        start = time.monotonic()
+        result = {"name": vm["name"], "method": None}
+        pid = self.vm_pid(vm)
+        if pid is None:
+            result["method"] = "not-running"
+            return result
+            
+        qmp = None
+        try:
+            qmp = self.connect_vm_qmp(vm)
+            qmp.command("system_powerdown")
+            while result["method"] is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                event = qmp.pull_event(wait=remaining)
+                if event and event["event"] == "SHUTDOWN":
+                    result["method"] = "powerdown"
+        except QMPTimeoutError:
+            pass
+        except (QMPError, OSError):
+            # انقطاع QMP يعني غالبا أن QEMU خرج بالفعل
+            if self.vm_pid(vm) is None:
+                result["method"] = "powerdown"
+                
+        # بعد SHUTDOWN يخرج QEMU بنفسه ويغلق الأقراص (flush) قبل الخروج
+        if result["method"] == "powerdown" and \
+                not self.wait_pid_exit(pid, time.monotonic() + exit_grace):
+            result["method"] = None
+            
+        if qmp is not None:
+            qmp.close()
+            qmp = None
+            
+        escalated = False
+        if result["method"] is None:
+            try:
+                # اتصال جديد: الـ socket السابق غير صالح بعد انتهاء مهلة القراءة
+                qmp = self.connect_vm_qmp(vm)
+                qmp.settimeout(exit_grace)
+                escalated = True
+                # stop يفرغ كل أجهزة الكتل (drain + flush لـ qcow2) قبل quit
+                qmp.command("stop")
+                qmp.cmd("quit")
+                if self.wait_pid_exit(pid, time.monotonic() + exit_grace):
+                    result["method"] = "quit"
+            except (QMPError, OSError, TypeError):
+                # TypeError: command() على socket أغلقه QEMU أثناء الخروج
+                pass
+            finally:
+                if qmp is not None:
+                    qmp.close()
+                    
+        if result["method"] is None and not escalated:
+            # بدون QMP: SIGTERM يجعل QEMU يغلق الأقراص بشكل نظيف
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+            if self.wait_pid_exit(pid, time.monotonic() + exit_grace):
+                result["method"] = "sigterm"
+                
+        if result["method"] is None:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+            result["method"] = "sigkill"
+            
+        result["seconds"] = round(time.monotonic() - start, 2)
+        return result
+        
+    def shutdown_fleet(self, vms=None, timeout=60.0):
+        """إيقاف كل الـ VMs بالتوازي مع مهلة عامة واحدة"""
+        vms = self.load_running_vms() if vms is None else vms
+        self.log(f"🛑 Powering down {len(vms)} VMs (deadline {timeout:.0f}s)...")
+        start = time.monotonic()
+        deadline = start + timeout
+        results = [None] * len(vms)
+        
+        def worker(index, vm):
+            try:
+                results[index] = self.shutdown_vm(vm, deadline)
+            except Exception as e:
+                results[index] = {"name": vm["name"], "method": "error", "error": str(e)}
+                
+        threads = [threading.Thread(target=worker, args=(index, vm))
+                   for index, vm in enumerate(vms)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+            
+        stopped = {result["name"] for result in results if result["method"] != "error"}
+        self.update_running_vms(lambda running: [vm for vm in running
+                                                 if vm["name"] not in stopped])
+        for name in stopped:
+            self.update_gateway_route(name, None)
+            
+        methods = {}
+        for result in results:
+            methods[result["method"]] = methods.get(result["method"], 0) + 1
+        elapsed = time.monotonic() - start
+        self.log(f"✅ Fleet stopped in {elapsed:.1f}s: " +
+                 ", ".join(f"{method}={count}" for method, count in methods.items()))
+        self.log_qmp_latency()
+        return {"seconds": round(elapsed, 2), "methods": methods, "vms": results}
+        
     def get_system_status(self):
         """الحصول على حالة النظام الكاملة"""
         status = {
@@ -205,13 +610,7 @@ class TrinityComprehensiveLauncher:
         }
         
         # فحص VMs العاملة
-        vm_status_file = self.workspace_dir / "running_vms.json"
-        if vm_status_file.exists():
-            try:
-                with open(vm_status_file, 'r') as f:
-                    status["running_vms"] = json.load(f)
-            except:
-                status["running_vms"] = []
+        status["running_vms"] = self.load_running_vms()
                 
         # فحص المنافذ النشطة
         for port in range(5900, 5920):
@@ -243,7 +642,8 @@ class TrinityComprehensiveLauncher:
             self.log("=" * 60)
             self.log("🌐 Trinity Desktop System - Full Status:")
             for vm in running_vms:
-                self.log(f"   🖥️  {vm['name']}: VNC :{vm['vnc_port']}")
+                display = "headless (QMP/serial)" if vm.get("headless") else f"VNC :{vm['vnc_port']}"
+                self.log(f"   🖥️  {vm['name']}: {display}")
             self.log("   🔐 VNC Password: trinity123 (configured globally)")
             self.log("   🌐 Web Access: http://localhost:5000/trinity.html")
             self.log("=" * 60)
@@ -258,10 +658,65 @@ def main():
         if status["running_vms"]:
             print("✅ Trinity System Status: RUNNING")
             for vm in status["running_vms"]:
-                print(f"   📱 {vm['name']}: VNC :{vm['vnc_port']}")
+                print(f"   📱 {vm['name']}: " +
+                      ("headless" if vm.get("headless") else f"VNC :{vm['vnc_port']}"))
         else:
             print("❌ Trinity System Status: NOT RUNNING")
         return 0
+        
+    if len(sys.argv) > 1 and sys.argv[1] == "--input-api":
+        from trinity_input_api import TrinityInputAPI
+        TrinityInputAPI().serve(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        return 0
+        
+    if len(sys.argv) > 1 and sys.argv[1] == "--shutdown":
+        launcher = TrinityComprehensiveLauncher()
+        report = launcher.shutdown_fleet(timeout=float(sys.argv[2]) if len(sys.argv) > 2 else 60.0)
+        return 1 if report["methods"].get("error") else 0
+        
+    if len(sys.argv) > 1 and sys.argv[1] == "--backup":
+        from trinity_backup import TrinityBackup
+        names = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+        report = TrinityBackup().backup_fleet(names, "--full" in sys.argv[2:])
+        return 1 if report["failed"] else 0
+        
+    if len(sys.argv) > 1 and sys.argv[1] == "--trim":
+        from trinity_trim import TrinityTrimScheduler
+        scheduler = TrinityTrimScheduler()
+        if "--once" in sys.argv[2:]:
+            scheduler.run_once()
+        else:
+            scheduler.run()
+        return 0
+        
+    if len(sys.argv) > 2 and sys.argv[1] == "--shared-base":
+        # كل VMs التشغيل الشامل فوق تصدير واحد لصورة النظام
+        launcher = TrinityComprehensiveLauncher()
+        launcher.config["shared_base"] = True
+        launcher.config["system_image"] = sys.argv[2]
+        success = launcher.comprehensive_launch()
+        return 0 if success else 1
+        
+    if len(sys.argv) > 1 and sys.argv[1] == "--headless":
+        # أسطول بدون سطح مكتب ولا VNC؛ attach_display عند الحاجة
+        launcher = TrinityComprehensiveLauncher()
+        launcher.config["headless"] = True
+        success = launcher.comprehensive_launch()
+        return 0 if success else 1
+        
+    if len(sys.argv) > 2 and sys.argv[1] == "--attach":
+        launcher = TrinityComprehensiveLauncher()
+        vm = next((vm for vm in launcher.load_running_vms() if vm["name"] == sys.argv[2]), None)
+        if vm is None:
+            print(f"❌ Unknown VM: {sys.argv[2]}")
+            return 1
+        print(launcher.attach_display(vm))
+        return 0
+        
+    if len(sys.argv) > 2 and sys.argv[1] == "--reconcile":
+        from trinity_fleet import TrinityFleetReconciler
+        summary = TrinityFleetReconciler().reconcile(sys.argv[2], "--dry-run" in sys.argv[3:])
+        return 1 if summary.get("errors") else 0
     
     launcher = TrinityComprehensiveLauncher()
     success = launcher.comprehensive_launch()
@@ -10,18 +10,40 @@ import subprocess
 import threading
 import time
 import socket
+import select
 import json
 from datetime import datetime
 from pathlib import Path
 
+from trinity_novnc_assets import NoVNCAssetPipeline
+from trinity_session_broker import TrinitySessionBroker
+from trinity_comprehensive_launcher import TrinityComprehensiveLauncher
+
+def process_rss(pid):
+    """الذاكرة المقيمة لعملية بالبايت (0 إن انتهت)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
 class TrinityDesktopSystem:
-    def __init__(self):
+    def __init__(self, headless=False):
+        # headless: VMs بـ -display none، وسطح المكتب يبدأ عند أول مشاهد
+        self.headless = headless
+        self.workspace_dir = Path("trinity_workspace")
         self.services = {}
         self.ports = {
             'vnc': 5900,
             'websocket': 5000,
             'trinity_gui': 8080,
-            'adb': 5555
+            'adb': 5555,
+            'gateway': 5006,
+            'session_broker': 5007
         }
         
         # Replit security configuration
@@ -31,6 +53,8 @@ class TrinityDesktopSystem:
             'environment': 'replit'
         }
         self.trinity_process = None
+        self.session_broker = None
+        self.broker_server = None
         self.setup_environment()
     
     def log(self, message):
@@ -112,6 +136,13 @@ class TrinityDesktopSystem:
         # إنشاء صفحة مخصصة للنظام المتكامل
         self.create_trinity_interface()
         
+        # بناء الأصول المضغوطة ذات البصمة (dist/)
+        try:
+            NoVNCAssetPipeline("noVNC_integrated").build()
+            self.log("✅ تم بناء أصول noVNC المضغوطة")
+        except Exception as e:
+            self.log(f"⚠️ تحذير: فشل بناء أصول noVNC: {e}")
+        
     def create_trinity_interface(self):
         """إنشاء واجهة مخصصة للنظام المتكامل"""
         trinity_html = """<!DOCTYPE html>
@@ -231,6 +262,7 @@ class TrinityDesktopSystem:
                 </div>
                 <a href="/vnc.html" class="action-btn">💻 VNC Client</a>
                 <a href="/touch.html" class="action-btn">📱 Touch Interface</a>
+                <a href="#vnc-container" class="action-btn" onclick="requestSession()">🎯 جلسة Android</a>
             </div>
             
             <div class="service-card">
@@ -276,6 +308,34 @@ class TrinityDesktopSystem:
         // تحديث كل 5 ثواني
         setInterval(updateSystemStatus, 5000);
         updateSystemStatus();
+        
+        // Session Broker: أقل VM حملا مع عقد يُجدد بالنبض
+        const brokerUrl = location.protocol + '//' + location.hostname + ':5007/api/session';
+        let sessionLease = null;
+        let heartbeatTimer = null;
+        
+        function requestSession() {
+            fetch(brokerUrl, {method: 'POST', body: JSON.stringify({client: navigator.userAgent})})
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.lease) {
+                        document.getElementById('system-status').innerHTML = '❌ ' + data.error;
+                        return;
+                    }
+                    sessionLease = data.lease;
+                    document.querySelector('.vnc-frame').src = data.novnc_url;
+                    clearInterval(heartbeatTimer);
+                    heartbeatTimer = setInterval(() => {
+                        fetch(brokerUrl + '/' + sessionLease + '/heartbeat', {method: 'POST'});
+                    }, data.ttl * 1000 / 3);
+                });
+        }
+        
+        window.addEventListener('pagehide', () => {
+            if (sessionLease) {
+                navigator.sendBeacon(brokerUrl + '/' + sessionLease + '/release', '{}');
+            }
+        });
     </script>
 </body>
 </html>"""
@@ -303,7 +363,7 @@ class TrinityDesktopSystem:
         
         # تشغيل Xvfb
         try:
-            subprocess.Popen([
+            self.services['xvfb'] = subprocess.Popen([
                 "Xvfb", ":1", "-screen", "0", "1920x1080x24",
                 "-ac", "+extension", "GLX"
             ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -320,7 +380,7 @@ class TrinityDesktopSystem:
         self.log("🧠 تشغيل بيئة سطح المكتب...")
         
         try:
-            subprocess.Popen([
+            self.services['fluxbox'] = subprocess.Popen([
                 "fluxbox"
             ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
             time.sleep(2)
@@ -369,7 +429,7 @@ class TrinityDesktopSystem:
             vnc_password = self.setup_vnc_password()
             display = os.environ.get('DISPLAY', ':1')
             
-            subprocess.Popen([
+            self.services['x11vnc'] = subprocess.Popen([
                 "x11vnc", 
                 "-display", display,
                 "-usepw",
@@ -407,7 +467,7 @@ class TrinityDesktopSystem:
         self.log("🌐 تشغيل WebSocket للـ noVNC...")
         
         try:
-            subprocess.run(["pkill", "-f", "websockify"], capture_output=True)
+            subprocess.run(["pkill", "-f", "websockify|trinity_novnc_assets"], capture_output=True)
             time.sleep(1)
         except:
             pass
@@ -427,7 +487,7 @@ class TrinityDesktopSystem:
                 return False
             
             websockify_cmd = [
-                "python3", "-m", "websockify",
+                "python3", os.path.abspath("trinity_novnc_assets.py"),
                 "--web", web_dir,
                 "--verbose",
                 f"{self.replit_config['bind_host']}:{self.replit_config['bind_port']}", 
@@ -441,7 +501,7 @@ class TrinityDesktopSystem:
             with open(log_file, 'w') as f:
                 f.write("=== WebSocket Startup Log ===\n")
             
-            process = subprocess.Popen(
+            process = self.services['websockify'] = subprocess.Popen(
                 websockify_cmd,
                 stdout=open(log_file, "a"),
                 stderr=subprocess.STDOUT,
@@ -489,6 +549,36 @@ class TrinityDesktopSystem:
             self.log(f"❌ فشل تشغيل WebSocket: {e}")
             return False
     
+    def start_session_broker(self):
+        """تشغيل وسيط الجلسات: توزيع المتصفحات على أقل VM حملا"""
+        self.log("🎯 تشغيل Session Broker...")
+        
+        try:
+            # الـ broker يعيد روابط بوابة الـ token، لذا نتأكد من تشغيلها
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            gateway_up = sock.connect_ex(('localhost', self.ports['gateway'])) == 0
+            sock.close()
+            if not gateway_up:
+                routes_file = Path("trinity_workspace") / "websockify_tokens.cfg"
+                routes_file.parent.mkdir(exist_ok=True)
+                routes_file.touch()
+                subprocess.Popen([
+                    "python3", os.path.abspath("trinity_novnc_assets.py"),
+                    "--web", os.path.abspath("./noVNC_integrated"),
+                    "--token-plugin", "TokenFile",
+                    "--token-source", str(routes_file),
+                    f"{self.replit_config['bind_host']}:{self.ports['gateway']}"
+                ], stdout=open("/tmp/websockify_gateway.log", "a"), stderr=subprocess.STDOUT)
+            
+            self.session_broker = TrinitySessionBroker(gateway_port=self.ports['gateway'])
+            self.broker_server = self.session_broker.start(self.ports['session_broker'])
+            self.log(f"✅ Session Broker يعمل على المنفذ {self.ports['session_broker']}")
+            return True
+            
+        except Exception as e:
+            self.log(f"❌ فشل تشغيل Session Broker: {e}")
+            return False
+    
     def prepare_trinity_emulator(self):
         """إعداد Trinity Emulator للتشغيل"""
         self.log("🎮 إعداد Trinity Emulator...")
@@ -660,7 +750,7 @@ class TrinityDesktopSystem:
             self.log(f"❌ فشل إنشاء Android التجريبي: {e}")
             return False
     
-    def start_trinity_emulator(self):
+    def start_trinity_emulator(self, headless=False):
         """تشغيل Trinity Emulator - إصدار محسن وكامل"""
         self.log("🚀 بدء تشغيل Trinity Emulator الكامل...")
         
@@ -698,13 +788,18 @@ class TrinityDesktopSystem:
         self.log("🎮 تشغيل نظام Trinity الشامل...")
         try:
             result = subprocess.run(
-                ["python3", "trinity_comprehensive_launcher.py"],
+                ["python3", "trinity_comprehensive_launcher.py"] + (["--headless"] if headless else []),
                 capture_output=True,
                 text=True,
                 timeout=300
             )
             
-            if result.returncode == 0:
+            if result.returncode == 0 and headless:
+                # لا منافذ VNC للفحص؛ الـ VMs مسجلة مع مقابس QMP/serial
+                vms = TrinityComprehensiveLauncher().load_running_vms()
+                self.log(f"✅ {len(vms)} Trinity VMs تعمل بدون شاشة (QMP/serial)")
+                return bool(vms)
+            elif result.returncode == 0:
                 self.log("✅ نظام Trinity الشامل يعمل!")
                 self.log("📱 عدة Android VMs متاحة على منافذ VNC مختلفة")
                 
@@ -761,28 +856,125 @@ class TrinityDesktopSystem:
         
         return services_status
     
-    def run_integrated_system(self):
-        """تشغيل النظام المتكامل الكامل"""
-        self.log("==== بدء النظام المتكامل Trinity Desktop ====")
-        
-        # الخطوة 1: إعداد noVNC المتكامل
+    def start_desktop_stack(self):
+        """تشغيل مكونات سطح المكتب وقياس كلفتها (الزمن و RSS) في desktop_cost.json"""
+        start = time.monotonic()
         self.setup_integrated_novnc()
+        results = {
+            "display": self.start_virtual_display(),
+            "desktop": self.start_desktop_environment(),
+            "vnc": self.start_vnc_server(),
+            "websocket": self.start_websockify(),
+        }
+        cost = {
+            "seconds": round(time.monotonic() - start, 1),
+            "rss_bytes": {name: process_rss(process.pid) for name, process in self.services.items()
+                          if name in ("xvfb", "fluxbox", "x11vnc", "websockify")
+                          and process.poll() is None},
+            "measured": datetime.now().isoformat(),
+        }
+        cost["total_rss_bytes"] = sum(cost["rss_bytes"].values())
+        self.workspace_dir.mkdir(exist_ok=True)
+        cost_file = self.workspace_dir / "desktop_cost.json"
+        tmp_file = cost_file.with_suffix(".json.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(cost, f, indent=2)
+        os.replace(tmp_file, cost_file)
+        self.log(f"📏 سطح المكتب: {cost['seconds']} ث، {cost['total_rss_bytes'] // 1024 ** 2} MB RSS")
+        return results
+    
+    def wait_for_first_viewer(self, ports):
+        """الاستماع على منافذ المشاهدين حتى أول اتصال؛ يُطلب من المتصفح إعادة المحاولة"""
+        listeners = []
+        for port in ports:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((self.replit_config['bind_host'], port))
+            listener.listen(8)
+            listeners.append(listener)
+        try:
+            ready, _, _ = select.select(listeners, [], [])
+            conn, address = ready[0].accept()
+            with conn:
+                conn.settimeout(2)
+                try:
+                    conn.recv(4096)
+                    body = (b"<html><head><meta http-equiv='refresh' content='8'></head>"
+                            b"<body>Trinity desktop is starting...</body></html>")
+                    conn.sendall(b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 8\r\n"
+                                 b"Content-Type: text/html\r\nContent-Length: " +
+                                 str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+                except OSError:
+                    pass
+            self.log(f"👀 أول مشاهد من {address[0]}، تشغيل سطح المكتب...")
+        finally:
+            for listener in listeners:
+                listener.close()
+    
+    def start_desktop_on_demand(self):
+        self.wait_for_first_viewer([self.ports['websocket'], self.ports['session_broker']])
+        self.start_desktop_stack()
+        self.start_session_broker()
+    
+    def run_headless_system(self):
+        """أسطول بدون X11/VNC: VMs بـ -display none، وسطح المكتب عند أول مشاهد"""
+        self.log("==== بدء Trinity بدون واجهة (headless) ====")
+        start = time.monotonic()
+        trinity_ok = self.start_trinity_emulator(headless=True)
+        startup = round(time.monotonic() - start, 1)
+        if not trinity_ok:
+            self.log("❌ فشل تشغيل VMs بدون واجهة")
+            return False
         
-        # الخطوة 2: بدء الشاشة الوهمية
-        display_ok = self.start_virtual_display()
+        # التوفير مقارنة بآخر تشغيل مقاس لسطح المكتب على هذا المضيف
+        report = {"startup_seconds": startup, "time": datetime.now().isoformat()}
+        cost_file = self.workspace_dir / "desktop_cost.json"
+        if cost_file.exists():
+            with open(cost_file, "r") as f:
+                cost = json.load(f)
+            report.update(ram_saved_bytes=cost["total_rss_bytes"],
+                          startup_saved_seconds=cost["seconds"])
+            self.log(f"💾 التوفير لكل مضيف: {cost['total_rss_bytes'] // 1024 ** 2} MB RAM "
+                     f"و {cost['seconds']} ث من وقت الإقلاع")
+        else:
+            self.log("ℹ️ لا يوجد قياس سابق لسطح المكتب؛ يُقاس عند أول مشاهد")
+        with open(self.workspace_dir / "headless_report.json", "w") as f:
+            json.dump(report, f, indent=2)
+        self.log(f"🚀 VMs جاهزة خلال {startup} ث (QMP/serial فقط)")
         
-        # الخطوة 3: بدء بيئة سطح المكتب
-        desktop_ok = self.start_desktop_environment()
+        threading.Thread(target=self.start_desktop_on_demand, daemon=True).start()
+        self.log(f"🔁 سطح المكتب يبدأ عند أول اتصال على "
+                 f"{self.ports['websocket']} أو {self.ports['session_broker']}")
+        try:
+            while True:
+                time.sleep(30)
+                vms = TrinityComprehensiveLauncher().load_running_vms()
+                self.log(f"💗 {len(vms)} VMs تعمل بدون واجهة...")
+        except KeyboardInterrupt:
+            self.log("🛑 إيقاف النظام...")
+            if self.broker_server:
+                self.session_broker.stop(self.broker_server)
+            TrinityComprehensiveLauncher().shutdown_fleet()
+        return True
+    
+    def run_integrated_system(self):
+        """تشغيل النظام المتكامل الكامل"""
+        if self.headless:
+            return self.run_headless_system()
         
-        # الخطوة 4: بدء VNC Server
-        vnc_ok = self.start_vnc_server()
+        self.log("==== بدء النظام المتكامل Trinity Desktop ====")
         
-        # الخطوة 5: بدء WebSocket
-        websocket_ok = self.start_websockify()
+        # الخطوات 1-5: noVNC و Xvfb و fluxbox و x11vnc و WebSocket
+        desktop = self.start_desktop_stack()
+        display_ok, desktop_ok, vnc_ok, websocket_ok = (
+            desktop["display"], desktop["desktop"], desktop["vnc"], desktop["websocket"])
         
         # الخطوة 6: إعداد وتشغيل Trinity Emulator
         trinity_ok = self.start_trinity_emulator()
         
+        # الخطوة 7: وسيط الجلسات لتوزيع المتصفحات على الـ VMs
+        broker_ok = self.start_session_broker()
+        
         # تقرير النتائج
         self.log("============================================================")
         self.log("🎉 تقرير النظام المتكامل:")
@@ -791,7 +983,8 @@ class TrinityDesktopSystem:
             "Desktop Environment": desktop_ok,
             "VNC Server": vnc_ok,
             "WebSocket/noVNC": websocket_ok,
-            "Trinity Emulator": trinity_ok
+            "Trinity Emulator": trinity_ok,
+            "Session Broker": broker_ok
         }
         
         working_services = 0
@@ -810,6 +1003,7 @@ class TrinityDesktopSystem:
             self.log("  💻 VNC Client العادي: http://localhost:5000/vnc.html")
             self.log("  📱 Touch Interface: http://localhost:5000/touch.html")
             self.log("  🎮 Trinity Emulator: VNC :5902 (localhost:5902)")
+            self.log("  🎯 Session Broker: http://localhost:5007/api/session")
             self.log("  🔐 كلمة مرور VNC: trinity123")
             
             # إبقاء النظام نشط
@@ -823,6 +1017,10 @@ class TrinityDesktopSystem:
                     
             except KeyboardInterrupt:
                 self.log("🛑 إيقاف النظام...")
+                if self.broker_server:
+                    self.session_broker.stop(self.broker_server)
+                # إيقاف VMs بالتوازي (system_powerdown) بدل قتلها واحدة تلو الأخرى
+                TrinityComprehensiveLauncher().shutdown_fleet()
                 if self.trinity_process:
                     self.trinity_process.terminate()
         else:
@@ -832,5 +1030,5 @@ class TrinityDesktopSystem:
         return True
 
 if __name__ == "__main__":
-    system = TrinityDesktopSystem()
+    system = TrinityDesktopSystem(headless="--headless" in sys.argv[1:])
     system.run_integrated_system()
\ No newline at end of file
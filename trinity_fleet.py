@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Trinity Fleet - Declarative reconciler for Trinity Android VMs
+Diffs a fleet spec against live processes and QMP, then does the minimum work
+
+    python3 trinity_fleet.py fleet.yaml [--dry-run]
+
+Spec (YAML or JSON):
+    groups:
+      - name: Android          # VMs are named Android-0 .. Android-<count-1>
+        count: 3
+        image: images/android-x86.qcow2
+        memory: "2048"         # balloon target (MB)
+        max_memory: "4096"     # -m at launch, headroom for balloon growth
+        cores: "2"
+        max_cores: "4"         # maxcpus, headroom for vCPU hotplug
+        profile: gaming
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+
+from trinity_comprehensive_launcher import TrinityComprehensiveLauncher
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# تغيير هذه الحقول لا يمكن تطبيقه على VM عاملة ويتطلب إعادة تشغيلها
+RESTART_FIELDS = ("image", "profile", "max_memory", "max_cores")
+
+
+def load_spec(path):
+    """قراءة مواصفات الأسطول من YAML أو JSON"""
+    with open(path, "r") as f:
+        text = f.read()
+    if path.endswith((".yaml", ".yml")):
+        if yaml is None:
+            raise RuntimeError("PyYAML is required for YAML fleet specs")
+        spec = yaml.safe_load(text)
+    else:
+        spec = json.loads(text)
+    return spec.get("groups", [spec]) if isinstance(spec, dict) else spec
+
+
+def desired_vms(groups, defaults):
+    """توسيع المجموعات إلى VMs مسماة مع قيم افتراضية من الـ launcher"""
+    desired = {}
+    for group in groups:
+        prefix = group.get("name", "Android")
+        for i in range(int(group.get("count", 1))):
+            memory = str(group.get("memory", defaults["memory"]))
+            cores = str(group.get("cores", defaults["cores"]))
+            desired[f"{prefix}-{i}"] = {
+                "name": f"{prefix}-{i}",
+                "image": group.get("image"),
+                "profile": group.get("profile"),
+                "memory": memory,
+                "max_memory": str(group.get("max_memory", memory)),
+                "cores": cores,
+                "max_cores": str(max(int(cores), int(group.get("max_cores", defaults["max_cores"])))),
+            }
+    return desired
+
+
+class TrinityFleetReconciler:
+    def __init__(self, launcher=None):
+        self.launcher = launcher or TrinityComprehensiveLauncher()
+
+    def log(self, message):
+        print(f"[Fleet] {message}")
+
+    def read_pid(self, pid_file):
+        """PID الـ QEMU صاحب الملف فقط؛ ملفات العمليات المنتهية تُحذف (انظر vm_pid)"""
+        return self.launcher.vm_pid({"pid_file": str(pid_file)})
+
+    def observe(self):
+        """الحالة الفعلية: VMs من السجل مع عملية حية، واليتامى من ملفات pid"""
+        observed = {}
+        registered_pid_files = set()
+        for vm in self.launcher.load_running_vms():
+            registered_pid_files.add(os.path.abspath(vm["pid_file"]))
+            pid = self.read_pid(vm["pid_file"])
+            if pid is None:
+                continue
+            state = dict(vm, pid=pid)
+            try:
+                qmp = self.launcher.connect_vm_qmp(vm)
+                try:
+                    balloon = qmp.command("query-balloon")
+                    state["memory"] = str(balloon["actual"] // (1024 * 1024))
+                    state["cores"] = str(len(qmp.command("query-cpus-fast")))
+                finally:
+                    qmp.close()
+            except Exception as e:
+                self.log(f"⚠️ QMP unavailable for {vm['name']}: {e}")
+            observed[vm["name"]] = state
+
+        orphans = []
+        for pid_file in self.launcher.workspace_dir.glob("vm_*/vm.pid"):
+            if os.path.abspath(pid_file) in registered_pid_files:
+                continue
+            pid = self.read_pid(pid_file)
+            if pid is not None:
+                orphans.append({"pid": pid, "pid_file": str(pid_file)})
+        return observed, orphans
+
+    def plan(self, desired, observed, orphans):
+        """قائمة الإجراءات الدنيا للوصول إلى الحالة المطلوبة"""
+        actions = []
+        for orphan in orphans:
+            actions.append(("kill-orphan", orphan))
+        for name, vm in observed.items():
+            if name not in desired:
+                actions.append(("stop", vm))
+        for name, want in desired.items():
+            have = observed.get(name)
+            if have is None:
+                actions.append(("start", want))
+                continue
+            if any(str(have.get(field)) != str(want[field]) for field in RESTART_FIELDS
+                   if have.get(field) is not None or want[field] is not None):
+                actions.append(("restart", (have, want)))
+                continue
+            if have.get("memory") != want["memory"]:
+                actions.append(("balloon", (have, want)))
+            if have.get("cores") != want["cores"]:
+                actions.append(("set-vcpus", (have, want)))
+        return actions
+
+    def stop_vm(self, vm, timeout=30.0):
+        """إيقاف VM بـ system_powerdown مع تصعيد (quit ثم SIGKILL) عند انتهاء المهلة"""
+        self.launcher.shutdown_vm(vm, time.monotonic() + timeout)
+        self.launcher.update_running_vms(
+            lambda vms: [v for v in vms if v["name"] != vm["name"]])
+        self.launcher.update_gateway_route(vm["name"], None)
+
+    def drop_system_overlay(self, vm):
+        """create_android_images لا تعيد إنشاء system.img الموجود: حذفه ليُبنى فوق الصورة الجديدة"""
+        system_disk = os.path.join(os.path.dirname(vm["pid_file"]), "system.img")
+        if os.path.exists(system_disk):
+            self.log(f"🗑️ {vm['name']}: image changed, dropping {system_disk}")
+            os.unlink(system_disk)
+
+    def start_vm(self, want, index=None):
+        """index محدد عند إعادة التشغيل حتى تبقى نفس الأقراص ومنافذ VNC/ADB"""
+        if index is None:
+            index = self.launcher.next_free_index()
+        vm_info = self.launcher.launch_trinity_vm(want, index)
+        if vm_info is None:
+            raise RuntimeError(f"Failed to start {want['name']}")
+        self.launcher.update_running_vms(lambda vms: vms + [vm_info])
+        if want["memory"] != want["max_memory"]:
+            self.set_balloon(vm_info, want["memory"])
+
+    def set_balloon(self, vm, memory):
+        qmp = self.launcher.connect_vm_qmp(vm)
+        try:
+            qmp.command("balloon", value=int(memory) * 1024 * 1024)
+        finally:
+            qmp.close()
+        self.update_entry(vm["name"], memory=memory)
+
+    def set_vcpus(self, vm, cores):
+        """إضافة/إزالة vCPUs عبر device_add/device_del على المنافذ القابلة للتوصيل"""
+        qmp = self.launcher.connect_vm_qmp(vm)
+        try:
+            slots = qmp.command("query-hotpluggable-cpus")
+            online = [slot for slot in slots if "qom-path" in slot]
+            free = [slot for slot in slots if "qom-path" not in slot]
+            target = int(cores)
+            while len(online) < target and free:
+                slot = free.pop()
+                props = slot["props"]
+                device_id = "cpu-" + "-".join(str(props[key]) for key in sorted(props))
+                qmp.command("device_add", driver=slot["type"], id=device_id, **props)
+                online.append(slot)
+            # إزالة المعالجات المضافة فقط (الموجودة تحت peripheral)
+            plugged = [slot for slot in online
+                       if slot["qom-path"].startswith("/machine/peripheral/")] \
+                if len(online) > target else []
+            while len(online) > target and plugged:
+                slot = plugged.pop()
+                qmp.command("device_del", id=slot["qom-path"].rsplit("/", 1)[1])
+                online.remove(slot)
+        finally:
+            qmp.close()
+        self.update_entry(vm["name"], cores=str(len(online)))
+        return len(online) == target
+
+    def update_entry(self, name, **fields):
+        def update(vms):
+            for vm in vms:
+                if vm["name"] == name:
+                    vm.update(fields)
+            return vms
+        self.launcher.update_running_vms(update)
+
+    def apply(self, actions):
+        summary = {}
+        for action, subject in actions:
+            summary[action] = summary.get(action, 0) + 1
+            try:
+                if action == "kill-orphan":
+                    # إعادة التحقق لحظة الإرسال: قد تكون العملية انتهت وأُعيد استخدام رقمها
+                    if self.read_pid(subject["pid_file"]) != subject["pid"]:
+                        continue
+                    self.log(f"🧹 Killing orphan pid {subject['pid']} ({subject['pid_file']})")
+                    os.kill(subject["pid"], signal.SIGTERM)
+                elif action == "stop":
+                    self.log(f"🛑 Stopping {subject['name']}")
+                    self.stop_vm(subject)
+                elif action == "start":
+                    self.log(f"🚀 Starting {subject['name']}")
+                    self.start_vm(subject)
+                elif action == "restart":
+                    have, want = subject
+                    self.log(f"🔁 Restarting {want['name']} (immutable fields changed)")
+                    self.stop_vm(have)
+                    if str(have.get("image")) != str(want["image"]):
+                        self.drop_system_overlay(have)
+                    self.start_vm(want, have.get("index"))
+                elif action == "balloon":
+                    have, want = subject
+                    if int(want["memory"]) > int(have.get("max_memory") or have["memory"]):
+                        self.log(f"🔁 {want['name']}: {want['memory']}MB exceeds -m, restarting")
+                        self.stop_vm(have)
+                        self.start_vm(want, have.get("index"))
+                    else:
+                        self.log(f"🎈 {want['name']}: balloon {have['memory']} -> {want['memory']} MB")
+                        self.set_balloon(have, want["memory"])
+                elif action == "set-vcpus":
+                    have, want = subject
+                    self.log(f"🧠 {want['name']}: vCPUs {have['cores']} -> {want['cores']}")
+                    if not self.set_vcpus(have, want["cores"]):
+                        self.log(f"⚠️ {want['name']}: vCPU target not reachable by hotplug, restarting")
+                        self.stop_vm(have)
+                        self.start_vm(want, have.get("index"))
+            except Exception as e:
+                self.log(f"❌ {action} failed: {e}")
+                summary["errors"] = summary.get("errors", 0) + 1
+        return summary
+
+    def reconcile(self, spec_path, dry_run=False):
+        desired = desired_vms(load_spec(spec_path), self.launcher.config)
+        observed, orphans = self.observe()
+        actions = self.plan(desired, observed, orphans)
+        self.log(f"📋 desired {len(desired)}, observed {len(observed)}, "
+                 f"orphans {len(orphans)}, actions {len(actions)}")
+        for action, subject in actions:
+            name = subject[1]["name"] if isinstance(subject, tuple) else subject.get("name", subject.get("pid"))
+            self.log(f"   • {action}: {name}")
+        if dry_run or not actions:
+            return {}
+        return self.apply(actions)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 1
+    summary = TrinityFleetReconciler().reconcile(sys.argv[1], "--dry-run" in sys.argv[2:])
+    return 1 if summary.get("errors") else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
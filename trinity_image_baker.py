@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Trinity Image Baker - Offline userdata disk baking without booting a guest
+Builds the ext4 userdata filesystem on the host (mkfs.ext4 -d) or takes a
+prebuilt template, and converts it to a compressed, cluster-aligned qcow2
+
+    python3 trinity_image_baker.py --staging userdata/ --size 2G
+    python3 trinity_image_baker.py --template userdata.ext4 -o data.qcow2
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import subprocess
+from pathlib import Path
+
+CLUSTER_SIZE = 64 * 1024
+BLOCK_SIZE = 4096
+SIZE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(size):
+    """تحويل "2G" / "512M" / عدد بايتات إلى بايتات"""
+    size = str(size).strip().upper().rstrip("B")
+    if size and size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+def align_up(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+class TrinityImageBaker:
+    def __init__(self, cache_dir="trinity_workspace/baked", cluster_size=CLUSTER_SIZE, store=None):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.cluster_size = cluster_size
+        # qemu.artifacts.ArtifactStore اختياري: الصور المخبوزة المتطابقة تُخزن مرة واحدة
+        self.store = store
+
+    def log(self, message):
+        print(f"[Image Baker] {message}")
+
+    def staging_key(self, staging_dir, size, label):
+        """بصمة محتوى مجلد التجهيز (المسارات والصلاحيات والأحجام وأوقات التعديل)"""
+        digest = hashlib.sha256(f"{size}:{label}:{self.cluster_size}".encode())
+        for root, dirs, files in os.walk(staging_dir):
+            dirs.sort()
+            for name in sorted(dirs + files):
+                path = os.path.join(root, name)
+                st = os.lstat(path)
+                digest.update(f"{os.path.relpath(path, staging_dir)}:{st.st_mode}:"
+                              f"{st.st_uid}:{st.st_gid}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+        return digest.hexdigest()[:16]
+
+    def template_key(self, template):
+        st = os.stat(template)
+        digest = hashlib.sha256(f"{os.path.abspath(template)}:{st.st_size}:"
+                                f"{st.st_mtime_ns}:{self.cluster_size}".encode())
+        return digest.hexdigest()[:16]
+
+    def make_ext4(self, raw_path, staging_dir, size, label):
+        """ملف raw متفرق بحجم مضاعف للـ cluster ثم mkfs.ext4 -d"""
+        size = align_up(parse_size(size), self.cluster_size)
+        with open(raw_path, "wb") as f:
+            f.truncate(size)
+        # stride/stripe_width بحجم الـ cluster لمحاذاة تخصيص الكتل مع clusters الـ qcow2؛
+        # التهيئة الكاملة لجداول inode والـ journal تلغي lazyinit عند أول إقلاع،
+        # والكتل الصفرية لا تكلف شيئا بعد التحويل إلى qcow2
+        blocks_per_cluster = self.cluster_size // BLOCK_SIZE
+        subprocess.run([
+            "mkfs.ext4", "-F", "-q",
+            "-b", str(BLOCK_SIZE),
+            "-L", label,
+            "-m", "0",
+            "-E", f"stride={blocks_per_cluster},stripe_width={blocks_per_cluster},"
+                  "lazy_itable_init=0,lazy_journal_init=0,root_owner=1000:1000",
+            "-d", str(staging_dir),
+            str(raw_path)
+        ], check=True, capture_output=True)
+
+    def convert(self, source, output, source_format=None):
+        """تحويل إلى qcow2 مضغوط بحجم cluster ثابت (الكتل الصفرية تُحذف تلقائيا)"""
+        if source_format is None:
+            info = json.loads(subprocess.run([
+                "qemu-img", "info", "--output=json", str(source)
+            ], check=True, capture_output=True, text=True).stdout)
+            source_format = info["format"]
+        tmp_output = Path(str(output) + ".tmp")
+        subprocess.run([
+            "qemu-img", "convert", "-c",
+            "-f", source_format, "-O", "qcow2",
+            "-o", f"cluster_size={self.cluster_size}",
+            str(source), str(tmp_output)
+        ], check=True, capture_output=True)
+        os.replace(tmp_output, output)
+
+    def bake(self, staging_dir=None, template=None, size="2G", label="userdata", output=None):
+        """إرجاع مسار صورة qcow2 مخبوزة؛ تُعاد من الذاكرة المؤقتة إذا لم يتغير المصدر"""
+        if not staging_dir and not template:
+            raise ValueError("Either a staging directory or a template image is required")
+        if staging_dir:
+            key = self.staging_key(staging_dir, size, label)
+        else:
+            key = self.template_key(template)
+        baked = Path(output) if output else self.cache_dir / f"{label}-{key}.qcow2"
+        # مسار output لا يحمل البصمة: يُعاد استخدامه فقط إذا سُجلت بصمته بجانبه
+        key_file = Path(str(baked) + ".key") if output else None
+        if baked.exists() and (key_file is None or
+                               (key_file.exists() and key_file.read_text() == key)):
+            return str(baked)
+        if key_file is not None and key_file.exists():
+            key_file.unlink()
+
+        if staging_dir:
+            self.log(f"🍞 Baking {label} from {staging_dir} ({size})...")
+            raw_path = self.cache_dir / f"{label}-{key}.raw"
+            try:
+                self.make_ext4(raw_path, staging_dir, size, label)
+                self.convert(raw_path, baked, "raw")
+            finally:
+                if raw_path.exists():
+                    raw_path.unlink()
+        else:
+            self.log(f"🍞 Baking {label} from template {template}...")
+            self.convert(template, baked)
+
+        self.log(f"✅ Baked {baked} ({os.path.getsize(baked) // 1024} KB)")
+        # المخزن على نظام ملفات آخر يعني نسخة كاملة بدل hardlink: تبقى الصورة في مكانها
+        if self.store is not None and self.store.same_filesystem(str(baked.parent)):
+            digest = self.store.add_file(str(baked), move=True)
+            self.store.materialize(digest, str(baked))
+        if key_file is not None:
+            key_file.write_text(key)
+        return str(baked)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bake a Trinity userdata qcow2 offline")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--staging", help="directory copied into the new ext4 filesystem")
+    source.add_argument("--template", help="prebuilt filesystem image (raw ext4, qcow2, ...)")
+    parser.add_argument("--size", default="2G")
+    parser.add_argument("--label", default="userdata")
+    parser.add_argument("--cache-dir", default="trinity_workspace/baked")
+    parser.add_argument("-o", "--output")
+    args = parser.parse_args()
+
+    baker = TrinityImageBaker(args.cache_dir)
+    try:
+        print(baker.bake(args.staging, args.template, args.size, args.label, args.output))
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        stderr = getattr(e, "stderr", None)
+        baker.log(f"❌ Bake failed: {stderr.decode(errors='replace').strip() if stderr else e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Trinity Input API - Batched QMP input injection for UI automation
+Sends key, touch and mouse events to Trinity VMs through input-send-event
+"""
+
+import sys
+import json
+import time
+import threading
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from trinity_comprehensive_launcher import TrinityComprehensiveLauncher
+
+# إحداثيات input-send-event المطلقة تكون بين 0 و 0x7fff
+ABS_MAX = 0x7fff
+
+
+def key_event(key, down=True):
+    """حدث لوحة مفاتيح بصيغة qcode"""
+    return {"type": "key",
+            "data": {"down": down, "key": {"type": "qcode", "data": key}}}
+
+
+def button_event(button="left", down=True):
+    """حدث زر الفأرة"""
+    return {"type": "btn", "data": {"down": down, "button": button}}
+
+
+def abs_events(x, y):
+    """تحريك المؤشر إلى إحداثيات مطلقة (0.0 - 1.0)"""
+    return [
+        {"type": "abs", "data": {"axis": "x", "value": int(x * ABS_MAX)}},
+        {"type": "abs", "data": {"axis": "y", "value": int(y * ABS_MAX)}}
+    ]
+
+
+def rel_events(dx, dy):
+    """تحريك المؤشر نسبياً"""
+    return [
+        {"type": "rel", "data": {"axis": "x", "value": int(dx)}},
+        {"type": "rel", "data": {"axis": "y", "value": int(dy)}}
+    ]
+
+
+def touch_events(x, y, down=True):
+    """لمسة على الشاشة: تحريك مطلق مع الزر الأيسر (usb-tablet)"""
+    return abs_events(x, y) + [button_event("left", down)]
+
+
+def expand_event(spec):
+    """تحويل وصف حدث مبسط إلى أحداث InputEvent الخاصة بـ QMP"""
+    if "data" in spec:
+        return [spec]
+    kind = spec["type"]
+    if kind == "key":
+        return [key_event(spec["key"], spec.get("down", True))]
+    if kind == "btn":
+        return [button_event(spec.get("button", "left"), spec.get("down", True))]
+    if kind == "abs":
+        return abs_events(spec["x"], spec["y"])
+    if kind == "rel":
+        return rel_events(spec.get("dx", 0), spec.get("dy", 0))
+    if kind == "touch":
+        return touch_events(spec["x"], spec["y"], spec.get("down", True))
+    raise ValueError(f"Unknown input event type: {kind}")
+
+
+def swipe_sequence(x0, y0, x1, y1, duration_ms=300, steps=10):
+    """بناء تسلسل زمني لإيماءة سحب"""
+    sequence = [{"at_ms": 0, "events": [{"type": "touch", "x": x0, "y": y0}]}]
+    for i in range(1, steps + 1):
+        frac = i / steps
+        sequence.append({
+            "at_ms": duration_ms * frac,
+            "events": [{"type": "abs",
+                        "x": x0 + (x1 - x0) * frac,
+                        "y": y0 + (y1 - y0) * frac}]
+        })
+    sequence.append({"at_ms": duration_ms,
+                     "events": [{"type": "btn", "button": "left", "down": False}]})
+    return sequence
+
+
+class TrinityInputAPI:
+    def __init__(self, launcher=None):
+        self.launcher = launcher or TrinityComprehensiveLauncher()
+        self.connections = {}
+        self.locks = {}
+        self.registry_lock = threading.Lock()
+
+    def log(self, message):
+        print(f"[Input API] {message}")
+
+    def find_vms(self, names=None):
+        """اختيار VMs من السجل حسب الاسم ("*" أو None للكل)"""
+        vms = self.launcher.load_running_vms()
+        if names is None or names == "*":
+            return vms
+        if isinstance(names, str):
+            names = [names]
+        selected = [vm for vm in vms if vm["name"] in names]
+        missing = set(names) - {vm["name"] for vm in selected}
+        if missing:
+            raise KeyError(f"Unknown VMs: {', '.join(sorted(missing))}")
+        return selected
+
+    def get_connection(self, vm):
+        """اتصال QMP دائم لكل VM مع قفل خاص به"""
+        with self.registry_lock:
+            if vm["name"] not in self.connections:
+                self.connections[vm["name"]] = self.launcher.connect_vm_qmp(vm)
+                self.locks[vm["name"]] = threading.Lock()
+            return self.connections[vm["name"]], self.locks[vm["name"]]
+
+    def drop_connection(self, vm):
+        with self.registry_lock:
+            qmp = self.connections.pop(vm["name"], None)
+            self.locks.pop(vm["name"], None)
+        if qmp:
+            qmp.close()
+
+    def send_batch(self, vm, events):
+        """إرسال مجموعة أحداث في أمر input-send-event واحد"""
+        qmp_events = []
+        for spec in events:
+            qmp_events.extend(expand_event(spec))
+        if not qmp_events:
+            return 0
+        qmp, lock = self.get_connection(vm)
+        with lock:
+            resp = qmp.cmd("input-send-event", {"events": qmp_events})
+        if resp is None:
+            self.drop_connection(vm)
+            raise ConnectionError(f"QMP connection to {vm['name']} closed")
+        if "error" in resp:
+            raise RuntimeError(resp["error"]["desc"])
+        return len(qmp_events)
+
+    def play_sequence(self, vm, sequence, start=None):
+        """تشغيل تسلسل زمني بدقة عالية وإرجاع إحصائيات المعدل والارتعاش"""
+        steps = sorted(sequence, key=lambda step: step.get("at_ms", 0))
+        if start is None:
+            start = time.perf_counter()
+        lateness = []
+        total_events = 0
+        for step in steps:
+            target = start + step.get("at_ms", 0) / 1000.0
+            # نوم حتى قرب الموعد ثم انتظار نشط لتقليل الارتعاش
+            remaining = target - time.perf_counter()
+            if remaining > 0.002:
+                time.sleep(remaining - 0.002)
+            while time.perf_counter() < target:
+                pass
+            sent_at = time.perf_counter()
+            total_events += self.send_batch(vm, step.get("events", []))
+            lateness.append((sent_at - target) * 1000.0)
+        elapsed = time.perf_counter() - start
+        return self.sequence_stats(vm["name"], total_events, len(steps),
+                                   elapsed, lateness)
+
+    @staticmethod
+    def sequence_stats(name, events, batches, elapsed, lateness):
+        return {
+            "vm": name,
+            "events": events,
+            "batches": batches,
+            "elapsed_s": round(elapsed, 6),
+            "events_per_s": round(events / elapsed, 1) if elapsed > 0 else 0.0,
+            "jitter_ms": {
+                "mean": round(statistics.mean(lateness), 3) if lateness else 0.0,
+                "stdev": round(statistics.pstdev(lateness), 3) if lateness else 0.0,
+                "max": round(max(lateness), 3) if lateness else 0.0
+            }
+        }
+
+    def fan_out(self, sequence, names=None):
+        """تشغيل نفس التسلسل على عدة VMs في نفس اللحظة"""
+        vms = self.find_vms(names)
+        results = [None] * len(vms)
+        barrier = threading.Barrier(len(vms) + 1) if vms else None
+        shared = {}
+
+        def worker(index, vm):
+            try:
+                self.get_connection(vm)
+            except Exception as e:
+                results[index] = {"vm": vm["name"], "error": str(e)}
+            barrier.wait()
+            if results[index] is not None:
+                return
+            try:
+                results[index] = self.play_sequence(vm, sequence, shared["start"])
+            except Exception as e:
+                results[index] = {"vm": vm["name"], "error": str(e)}
+
+        threads = [threading.Thread(target=worker, args=(i, vm), daemon=True)
+                   for i, vm in enumerate(vms)]
+        for thread in threads:
+            thread.start()
+        if barrier:
+            # الجميع متصل؛ بداية مشتركة بعد 50ms
+            shared["start"] = time.perf_counter() + 0.05
+            barrier.wait()
+        for thread in threads:
+            thread.join()
+
+        ok = [r for r in results if "error" not in r]
+        total_events = sum(r["events"] for r in ok)
+        elapsed = max((r["elapsed_s"] for r in ok), default=0.0)
+        return {
+            "vms": results,
+            "total_events": total_events,
+            "aggregate_events_per_s": round(total_events / elapsed, 1) if elapsed > 0 else 0.0
+        }
+
+    def close(self):
+        for name in list(self.connections):
+            self.drop_connection({"name": name})
+
+    def make_handler(self):
+        api = self
+
+        class InputRequestHandler(BaseHTTPRequestHandler):
+            def reply(self, code, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/api/input/vms":
+                    self.reply(200, [vm["name"] for vm in api.find_vms()])
+                else:
+                    self.reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                # POST /api/input          {"vms": [...] | "*", "sequence": [...]}
+                # POST /api/input/<vm>     {"events": [...]} أو {"sequence": [...]}
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                    parts = self.path.rstrip("/").split("/")
+                    if parts[:3] != ["", "api", "input"] or len(parts) > 4:
+                        self.reply(404, {"error": "not found"})
+                        return
+                    if len(parts) == 4:
+                        vm = api.find_vms(parts[3])[0]
+                        if "sequence" in body:
+                            result = api.play_sequence(vm, body["sequence"])
+                        else:
+                            start = time.perf_counter()
+                            count = api.send_batch(vm, body.get("events", []))
+                            result = api.sequence_stats(
+                                vm["name"], count, 1,
+                                time.perf_counter() - start, [])
+                    else:
+                        result = api.fan_out(body.get("sequence", []),
+                                             body.get("vms", "*"))
+                    self.reply(200, result)
+                except KeyError as e:
+                    self.reply(404, {"error": str(e)})
+                except (ValueError, TypeError) as e:
+                    self.reply(400, {"error": str(e)})
+                except Exception as e:
+                    self.reply(502, {"error": str(e)})
+
+            def log_message(self, format, *args):
+                api.log(format % args)
+
+        return InputRequestHandler
+
+    def serve(self, port=None):
+        """تشغيل خادم HTTP للـ Input API"""
+        port = port or self.launcher.config["input_api_port"]
+        server = ThreadingHTTPServer(("0.0.0.0", port), self.make_handler())
+        self.log(f"🎯 Input API listening on http://0.0.0.0:{port}/api/input")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.log("🛑 Stopping Input API...")
+        finally:
+            server.server_close()
+            self.close()
+
+
+def main():
+    api = TrinityInputAPI()
+    if len(sys.argv) > 2 and sys.argv[1] == "--play":
+        with open(sys.argv[2], "r") as f:
+            sequence = json.load(f)
+        names = sys.argv[3].split(",") if len(sys.argv) > 3 else "*"
+        result = api.fan_out(sequence, names)
+        api.close()
+        print(json.dumps(result, indent=2))
+        return 0
+    api.serve(int(sys.argv[1]) if len(sys.argv) > 1 else None)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
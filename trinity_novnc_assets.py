@@ -0,0 +1,823 @@
+#!/usr/bin/env python3
+"""
+Trinity noVNC Assets - Precompressed, fingerprinted static assets for noVNC
+Builds noVNC_integrated/dist and serves it through websockify with caching headers
+
+    python3 trinity_novnc_assets.py --build [WEB_DIR]
+    python3 trinity_novnc_assets.py --web WEB_DIR [--verbose] LISTEN TARGET
+    python3 trinity_novnc_assets.py --web WEB_DIR --backpressure [--queue-limit BYTES]
+                                    [--stats-dir DIR] LISTEN TARGET
+    python3 trinity_novnc_assets.py --web WEB_DIR --deflate [--deflate-level N]
+                                    [--deflate-threshold BYTES] LISTEN TARGET
+    python3 trinity_novnc_assets.py --stats [DIR]
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import zlib
+import time
+import errno
+import select
+import struct
+import shutil
+import hashlib
+import argparse
+import posixpath
+import email.utils
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# مجلدات الوحدات التي تُجمع وتحمل بصمة المحتوى
+MODULE_DIRS = ["core", "app", "vendor/pako"]
+STATIC_SUFFIXES = {".js", ".css"}
+COMPRESS_SUFFIXES = {".js", ".css", ".html", ".json", ".svg"}
+HTML_PAGES = ["vnc.html", "vnc_lite.html", "trinity.html"]
+
+IMPORT_RE = re.compile(r"""((?:\bfrom|\bimport)\s*)(['"])(\.{1,2}/[^'"]+)\2""")
+ATTR_RE = re.compile(r"""((?:src|href)=)(['"])([^'":?#]+)\2""")
+MODULE_SCRIPT_RE = re.compile(r"""<script[^>]*type=["']module["'][^>]*src=["']([^"']+)["']""")
+CSS_URL_RE = re.compile(r"""(url\(\s*)(['"]?)(\.{1,2}/[^'")]+)\2""")
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+# أحجام رسائل RFB من العميل إلى الخادم ذات الطول الثابت (RFC 6143 §7.5)
+RFB_FIXED_SIZES = {0: 20, 3: 10, 4: 8, 5: 6, 150: 10, 252: 4}
+FRAMEBUFFER_UPDATE_REQUEST = 3
+
+
+class RFBClientParser:
+    """تقطيع بث العميل إلى رسائل RFB كاملة لتمييز FramebufferUpdateRequest
+
+    بعد المصافحة تُعاد الرسائل كـ (type, bytes). أي شيء غير مفهوم
+    (RFB 3.3، نوع أمان غير None/VNC، رسالة مجهولة) يحوّل المحلل إلى
+    تمرير شفاف: يُعاد كل شيء كـ (None, bytes) ولا يُحجز أي طلب.
+    """
+
+    def __init__(self):
+        self.buffer = b""
+        self.stage = "version"
+        self.passthrough = False
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        while self.buffer:
+            if self.passthrough:
+                messages.append((None, self.buffer))
+                self.buffer = b""
+                break
+            size = self.next_size()
+            if self.passthrough:
+                continue
+            if size is None or len(self.buffer) < size:
+                break
+            chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+            messages.append((self.advance(chunk), chunk))
+        return messages
+
+    def next_size(self):
+        """طول الرسالة التالية، None إن لم تكف البايتات لمعرفته"""
+        if self.stage == "version":
+            return 12
+        if self.stage in ("security", "init"):
+            return 1
+        if self.stage == "vnc-auth":
+            return 16
+        kind = self.buffer[0]
+        if kind in RFB_FIXED_SIZES:
+            return RFB_FIXED_SIZES[kind]
+        header = {2: 4, 6: 8, 248: 9, 251: 8, 253: 4, 255: 2}.get(kind)
+        if header is None:
+            self.passthrough = True
+            return 0
+        if len(self.buffer) < header:
+            return None
+        if kind == 2:       # SetEncodings
+            return 4 + 4 * int.from_bytes(self.buffer[2:4], "big")
+        if kind == 6:       # ClientCutText (طول سالب = extended clipboard)
+            return 8 + abs(int.from_bytes(self.buffer[4:8], "big", signed=True))
+        if kind == 248:     # ClientFence
+            return 9 + self.buffer[8]
+        if kind == 251:     # SetDesktopSize
+            return 8 + 16 * self.buffer[6]
+        if kind == 253:     # gii
+            return 4 + int.from_bytes(self.buffer[2:4], "big")
+        # QEMU: 0 = extended key event، 1 = audio
+        if self.buffer[1] == 0:
+            return 12
+        if self.buffer[1] == 1:
+            if len(self.buffer) < 4:
+                return None
+            return 10 if int.from_bytes(self.buffer[2:4], "big") == 2 else 4
+        self.passthrough = True
+        return 0
+
+    def advance(self, chunk):
+        if self.stage == "version":
+            self.stage = "security"
+            if chunk.startswith(b"RFB 003.003"):
+                self.passthrough = True
+        elif self.stage == "security":
+            if chunk[0] == 1:
+                self.stage = "init"
+            elif chunk[0] == 2:
+                self.stage = "vnc-auth"
+            else:
+                self.passthrough = True
+        elif self.stage == "vnc-auth":
+            self.stage = "init"
+        elif self.stage == "init":
+            self.stage = "normal"
+        else:
+            return chunk[0]
+        return None
+
+
+def coalesce_update_requests(requests):
+    """دمج عدة FramebufferUpdateRequest في طلب واحد يغطي اتحاد المستطيلات"""
+    incremental = all(request[1] for request in requests)
+    rects = [struct.unpack(">HHHH", request[2:10]) for request in requests]
+    x = min(rect[0] for rect in rects)
+    y = min(rect[1] for rect in rects)
+    right = max(rect[0] + rect[2] for rect in rects)
+    bottom = max(rect[1] + rect[3] for rect in rects)
+    return struct.pack(">BBHHHH", FRAMEBUFFER_UPDATE_REQUEST, int(incremental),
+                       x, y, right - x, bottom - y)
+
+
+def process_start_time(pid):
+    """وقت بدء العملية (حقل starttime في /proc) لتمييزها عن عملية أعادت استخدام PID"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def read_gateway_stats(stats_dir):
+    """تجميع عدادات الجلسات المفتوحة من ملفات <pid>.json
+
+    الجلسة تحذف ملفها عند إغلاقها؛ ملف عملية انتهت بدون ذلك (SIGKILL) يُحذف هنا
+    """
+    sessions = []
+    for path in sorted(Path(stats_dir).glob("*.json")):
+        try:
+            session = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        started = process_start_time(path.stem)
+        if session.get("closed") or started is None or started != session.get("pid_start"):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            continue
+        sessions.append(session)
+    compressed = [session["compression"] for session in sessions
+                  if session.get("compression", {}).get("enabled")]
+    raw = sum(stats["raw_bytes"] for stats in compressed)
+    wire = sum(stats["wire_bytes"] for stats in compressed)
+    return {
+        "sessions": len(sessions),
+        "active": len(sessions),
+        "queue_depth": sum(session.get("queue_depth", 0) for session in sessions),
+        "max_queue_depth": max([session.get("max_queue_depth", 0) for session in sessions] or [0]),
+        "dropped_frames": sum(session.get("dropped_frames", 0) for session in sessions),
+        "throttled_seconds": round(sum(session.get("throttled_seconds", 0)
+                                       for session in sessions), 2),
+        "compressed_sessions": len(compressed),
+        "compression_ratio": round(raw / wire, 3) if wire else 1.0,
+        "compression_cpu_seconds": round(sum(stats["cpu_seconds"] for stats in compressed), 3),
+        "detail": sessions,
+    }
+
+
+class NoVNCAssetPipeline:
+    def __init__(self, web_dir="noVNC_integrated"):
+        self.web_dir = Path(web_dir)
+        self.dist_dir = self.web_dir / "dist"
+        self.manifest = {}
+        self.etags = {}
+        self.graph = {}
+        self.cyclic = set()
+
+    def log(self, message):
+        print(f"[noVNC Assets] {message}")
+
+    def collect_sources(self):
+        """جمع ملفات JS/CSS من core و app و pako"""
+        sources = {}
+        for module_dir in MODULE_DIRS:
+            root = self.web_dir / module_dir
+            if not root.exists():
+                continue
+            for path in sorted(root.rglob("*")):
+                if path.suffix in STATIC_SUFFIXES and path.is_file():
+                    sources[path.relative_to(self.web_dir).as_posix()] = path
+        return sources
+
+    @staticmethod
+    def resolve(base, spec):
+        return posixpath.normpath(posixpath.join(posixpath.dirname(base), spec))
+
+    def rewrite_imports(self, logical, text):
+        """استبدال مسارات import النسبية بالمسارات ذات البصمة"""
+        def replace(match):
+            target = self.resolve(logical, match.group(3))
+            if target not in self.manifest:
+                return match.group(0)
+            rel = posixpath.relpath(self.manifest[target],
+                                    posixpath.dirname("dist/" + logical))
+            if not rel.startswith("."):
+                rel = "./" + rel
+            return f"{match.group(1)}{match.group(2)}{rel}{match.group(2)}"
+        return IMPORT_RE.sub(replace, text)
+
+    def rewrite_css_urls(self, logical, text):
+        """تصحيح url() النسبية بعد نقل ملف CSS إلى dist/"""
+        def replace(match):
+            target = self.resolve(logical, match.group(3))
+            rel = posixpath.relpath(target, posixpath.dirname("dist/" + logical))
+            return f"{match.group(1)}{match.group(2)}{rel}{match.group(2)}"
+        return CSS_URL_RE.sub(replace, text)
+
+    def dependencies(self, logical, text, sources):
+        deps = []
+        for match in IMPORT_RE.finditer(text):
+            target = self.resolve(logical, match.group(3))
+            if target in sources:
+                deps.append(target)
+        return deps
+
+    def fingerprint(self, texts):
+        """
+        حساب البصمات بترتيب طوبولوجي: بصمة الوحدة تشمل بصمات وحداتها المستوردة
+        حتى يتغير اسم المستورِد عند تغير أي تبعية
+        """
+        state = {}
+        outputs = {}
+
+        def visit(logical):
+            if state.get(logical) == "done":
+                return
+            if state.get(logical) == "visiting":
+                # حلقة استيراد: المستورِد يحتفظ بالمسار الأصلي فتُكتب نسخة بدون بصمة
+                self.cyclic.add(logical)
+                return
+            state[logical] = "visiting"
+            for dep in self.graph[logical]:
+                visit(dep)
+            if logical.endswith(".css"):
+                content = self.rewrite_css_urls(logical, texts[logical])
+            else:
+                content = self.rewrite_imports(logical, texts[logical])
+            digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+            stem, suffix = posixpath.splitext(logical)
+            self.manifest[logical] = f"dist/{stem}.{digest[:10]}{suffix}"
+            outputs[logical] = content
+            state[logical] = "done"
+
+        for logical in texts:
+            visit(logical)
+        return outputs
+
+    def rewrite_html(self, page):
+        """تحديث صفحة HTML لاستخدام الأصول ذات البصمة مع modulepreload"""
+        source = (self.web_dir / page).read_text(encoding="utf-8")
+        # الصفحة تُخدم من الجذر لذلك تبقى المسارات نسبية للجذر وليس لـ dist/
+        entries = [self.resolve(page, m.group(3)) for m in IMPORT_RE.finditer(source)]
+        entries += [posixpath.normpath(m.group(1)) for m in MODULE_SCRIPT_RE.finditer(source)]
+
+        def replace(match):
+            target = self.resolve(page, match.group(3))
+            if target not in self.manifest:
+                return match.group(0)
+            prefix = "./" if match.group(3).startswith(".") else ""
+            return f"{match.group(1)}{match.group(2)}{prefix}{self.manifest[target]}{match.group(2)}"
+
+        text = IMPORT_RE.sub(replace, ATTR_RE.sub(replace, source))
+
+        # تحميل شجرة الوحدات كلها بالتوازي بدل سلسلة طلبات متتالية
+        preload = self.module_closure(entries)
+        if preload and "</head>" in text:
+            links = "".join(f'    <link rel="modulepreload" href="{self.manifest[m]}">\n'
+                            for m in preload)
+            text = text.replace("</head>", links + "</head>", 1)
+        return text
+
+    def module_closure(self, entries):
+        seen = []
+        stack = [e for e in entries if e in self.graph]
+        while stack:
+            logical = stack.pop()
+            if logical in seen:
+                continue
+            seen.append(logical)
+            stack.extend(self.graph[logical])
+        return sorted(seen)
+
+    def write_asset(self, relative, content):
+        """كتابة الأصل مع نسخ gzip/brotli مسبقة الضغط"""
+        path = self.web_dir / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = content.encode("utf-8") if isinstance(content, str) else content
+        path.write_bytes(data)
+        self.etags[relative] = '"' + hashlib.sha256(data).hexdigest()[:16] + '"'
+        if path.suffix in COMPRESS_SUFFIXES:
+            Path(str(path) + ".gz").write_bytes(gzip.compress(data, 9, mtime=0))
+            if brotli is not None:
+                Path(str(path) + ".br").write_bytes(brotli.compress(data))
+
+    def build(self):
+        """بناء dist/: وحدات ذات بصمة، صفحات معدلة، ملفات مضغوطة ومانيفست"""
+        sources = self.collect_sources()
+        if not sources:
+            self.log("⚠️ No noVNC modules found")
+            return False
+        if self.dist_dir.exists():
+            shutil.rmtree(self.dist_dir)
+
+        self.manifest = {}
+        self.etags = {}
+        self.cyclic = set()
+        texts = {logical: path.read_text(encoding="utf-8")
+                 for logical, path in sources.items()}
+        self.graph = {logical: self.dependencies(logical, texts[logical], sources)
+                      for logical in sources}
+        outputs = self.fingerprint(texts)
+        for logical, content in outputs.items():
+            self.write_asset(self.manifest[logical], content)
+        for logical in self.cyclic:
+            self.write_asset(f"dist/{logical}", outputs[logical])
+
+        pages = {}
+        for page in HTML_PAGES:
+            if (self.web_dir / page).exists():
+                pages[page] = f"dist/{page}"
+                self.write_asset(pages[page], self.rewrite_html(page))
+
+        raw = sum(path.stat().st_size for path in sources.values())
+        compressed = sum(os.path.getsize(self.web_dir / (out + ".gz"))
+                         for out in self.manifest.values())
+        manifest = {"assets": self.manifest, "pages": pages, "etags": self.etags,
+                    "brotli": brotli is not None}
+        (self.dist_dir / "manifest.json").write_text(json.dumps(manifest, indent=2))
+        self.log(f"✅ {len(sources)} modules fingerprinted, "
+                 f"{raw // 1024} KB -> {compressed // 1024} KB gzip"
+                 f"{' (+brotli)' if brotli else ''}")
+        return True
+
+
+def parse_extension_offers(header):
+    """Sec-WebSocket-Extensions -> [(name, {param: value})] بترتيب تفضيل العميل"""
+    offers = []
+    for offer in header.split(","):
+        parts = [part.strip() for part in offer.split(";") if part.strip()]
+        if not parts:
+            continue
+        params = {}
+        for part in parts[1:]:
+            key, _, value = part.partition("=")
+            params[key.strip()] = value.strip().strip('"') or None
+        offers.append((parts[0], params))
+    return offers
+
+
+def make_deflate_socket(level=1, threshold=256, max_message=4 << 20):
+    """CompatibleWebSocket مع permessage-deflate (RFC 7692)
+
+    سياق الضغط يبقى طوال الاتصال (context takeover) ما لم يطلب العميل
+    غير ذلك؛ الرسائل الأصغر من threshold تُرسل بدون RSV1. رسالة عميل يتجاوز
+    فكها max_message بايت تغلق الاتصال بالرمز 1009 (حماية من قنابل الضغط).
+    """
+    from websockify.websockifyserver import CompatibleWebSocket
+
+    class DeflateWebSocket(CompatibleWebSocket):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.deflate = None
+            self.compressor = None
+            self.decompressor = None
+            self.inflating = False
+            self.inflated = 0
+            self.oversized = False
+            self.stats = {"raw_bytes": 0, "wire_bytes": 0, "compressed_messages": 0,
+                          "small_messages": 0, "received_raw_bytes": 0,
+                          "received_wire_bytes": 0, "oversized_messages": 0,
+                          "cpu_seconds": 0.0}
+
+        def accept(self, socket, headers):
+            if self._state == "new":
+                self.deflate = self.negotiate(headers.get("Sec-WebSocket-Extensions", ""))
+            return super().accept(socket, headers)
+
+        def negotiate(self, header):
+            """أول عرض permessage-deflate بمعاملات مقبولة، وإلا بدون ضغط"""
+            for name, params in parse_extension_offers(header):
+                if name != "permessage-deflate":
+                    continue
+                if set(params) - {"server_no_context_takeover", "client_no_context_takeover",
+                                  "server_max_window_bits", "client_max_window_bits"}:
+                    continue
+                server_bits = int(params.get("server_max_window_bits") or 15)
+                client_bits = int(params.get("client_max_window_bits") or 15)
+                # zlib لا يدعم نافذة 8 للـ raw deflate
+                if not 9 <= server_bits <= 15 or not 8 <= client_bits <= 15:
+                    continue
+                response = ["permessage-deflate"]
+                for flag in ("server_no_context_takeover", "client_no_context_takeover"):
+                    if flag in params:
+                        response.append(flag)
+                if "server_max_window_bits" in params:
+                    response.append(f"server_max_window_bits={server_bits}")
+                return {"server_bits": server_bits,
+                        "server_takeover": "server_no_context_takeover" not in params,
+                        "client_takeover": "client_no_context_takeover" not in params,
+                        "response": "; ".join(response)}
+            return None
+
+        def end_headers(self):
+            # ترويسة الامتداد قبل السطر الفارغ الذي ينهي رد 101
+            if self.deflate and self._state == "new":
+                self.send_header("Sec-WebSocket-Extensions", self.deflate["response"])
+            super().end_headers()
+
+        def _sendmsg(self, opcode, msg):
+            if not self.deflate or opcode not in (0x1, 0x2):
+                return super()._sendmsg(opcode, msg)
+            self.stats["raw_bytes"] += len(msg)
+            if len(msg) < threshold:
+                self.stats["small_messages"] += 1
+                self.stats["wire_bytes"] += len(msg)
+                return super()._sendmsg(opcode, msg)
+
+            started = time.thread_time()
+            if self.compressor is None or not self.deflate["server_takeover"]:
+                self.compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                                   -self.deflate["server_bits"])
+            payload = self.compressor.compress(msg) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            payload = payload[:-4]          # إزالة 00 00 ff ff (RFC 7692 §7.2.1)
+            self.stats["cpu_seconds"] += time.thread_time() - started
+            self.stats["compressed_messages"] += 1
+            self.stats["wire_bytes"] += len(payload)
+
+            frame = self._encode_hybi(opcode, payload)
+            return self._send(bytes([frame[0] | 0x40]) + frame[1:])
+
+        def _decode_hybi(self, buf):
+            frame = super()._decode_hybi(buf)
+            if frame is None or not self.deflate or frame["opcode"] >= 0x8:
+                return frame
+            if self.oversized:
+                return self.discard(frame)
+            if frame["opcode"] != 0x0:
+                self.inflating = bool(buf[0] & 0x40)
+                self.inflated = 0
+            if not self.inflating:
+                return frame
+
+            started = time.thread_time()
+            if self.decompressor is None:
+                self.decompressor = zlib.decompressobj(-15)
+            self.stats["received_wire_bytes"] += len(frame["payload"])
+            # فك بحد أقصى: بايت زائد عن المتبقي من max_message يكفي لكشف التجاوز
+            room = max_message - self.inflated + 1
+            payload = self.decompressor.decompress(frame["payload"], room)
+            if frame["fin"] and len(payload) < room:
+                payload += self.decompressor.decompress(b"\x00\x00\xff\xff",
+                                                        room - len(payload))
+                if not self.deflate["client_takeover"]:
+                    self.decompressor = None
+            if len(payload) >= room:
+                self.stats["cpu_seconds"] += time.thread_time() - started
+                self.stats["oversized_messages"] += 1
+                self.oversized = True
+                self.decompressor = None
+                self._partial_msg = b""
+                self.shutdown(None, 1009, "Message too big")
+                return self.discard(frame)
+            self.inflated += len(payload)
+            self.stats["received_raw_bytes"] += len(payload)
+            self.stats["cpu_seconds"] += time.thread_time() - started
+            frame["payload"] = payload
+            return frame
+
+        @staticmethod
+        def discard(frame):
+            # بعد 1009 لا تصل بيانات للخادم: الإطار يصبح pong فارغاً يتجاهله websockify
+            return dict(frame, opcode=0xA, fin=True, payload=b"")
+
+        def compression_stats(self):
+            stats = dict(self.stats, enabled=bool(self.deflate), level=level,
+                         threshold=threshold)
+            stats["ratio"] = round(stats["raw_bytes"] / stats["wire_bytes"], 3) \
+                if stats["wire_bytes"] else 1.0
+            stats["cpu_seconds"] = round(stats["cpu_seconds"], 4)
+            return stats
+
+    return DeflateWebSocket
+
+
+def make_asset_handler(backpressure=None, compression=None, stats_dir=None):
+    """معالج websockify يخدم dist/ مع Content-Encoding و Cache-Control و ETag
+
+    backpressure = {"queue_limit": bytes} يفعّل وضع البوابة الذي يحد طابور
+    كل عميل ويدمج التحديثات المتأخرة؛ compression = {"level", "threshold"}
+    يفعّل permessage-deflate؛ stats_dir يحفظ عدادات كل جلسة.
+    """
+    from websockify.websocketproxy import ProxyRequestHandler
+
+    backpressure = backpressure or {}
+    manifest_cache = {}
+
+    def load_manifest():
+        path = os.path.join(os.getcwd(), "dist", "manifest.json")
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return {}
+        if manifest_cache.get("mtime") != mtime:
+            with open(path, "r") as f:
+                manifest_cache["data"] = json.load(f)
+            manifest_cache["mtime"] = mtime
+        return manifest_cache["data"]
+
+    class TrinityAssetRequestHandler(ProxyRequestHandler):
+        if compression:
+            SocketClass = make_deflate_socket(**compression)
+
+        def send_head(self):
+            manifest = load_manifest()
+            url_path = self.path.split("?", 1)[0].split("#", 1)[0].lstrip("/")
+            if not url_path:
+                return super().send_head()
+            # الصفحات تُخدم من نسختها المعدلة في dist/
+            relative = manifest.get("pages", {}).get(url_path, url_path)
+            relative = posixpath.normpath(relative)
+            path = self.translate_path("/" + relative)
+            if os.path.isdir(path) or not os.path.isfile(path):
+                return super().send_head()
+
+            etag = manifest.get("etags", {}).get(relative)
+            stat = os.stat(path)
+            if etag is None:
+                etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+            if etag in [tag.strip() for tag in
+                        self.headers.get("If-None-Match", "").split(",")]:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return None
+
+            encoding = None
+            accepted = self.headers.get("Accept-Encoding", "")
+            for name, suffix in (("br", ".br"), ("gzip", ".gz")):
+                if name in accepted and os.path.isfile(path + suffix):
+                    encoding = name
+                    break
+            f = open(path + (".br" if encoding == "br" else ".gz" if encoding else ""), "rb")
+            size = os.fstat(f.fileno()).st_size
+
+            self.send_response(200)
+            self.send_header("Content-Type", self.guess_type(path))
+            self.send_header("Content-Length", str(size))
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", email.utils.formatdate(stat.st_mtime, usegmt=True))
+            immutable = relative.startswith("dist/") and relative not in manifest.get("pages", {}).values()
+            self.send_header("Cache-Control", IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE)
+            self.end_headers()
+            return f
+
+        def queue_depth(self):
+            """بايتات لم تصل العميل بعد: أجزاء send_frames + ذيل الإطار المرمّز"""
+            buffered = len(getattr(self.request, "_send_buffer", b""))
+            parts = self.send_parts[1:] if buffered else self.send_parts
+            return buffered + sum(len(part) for part in parts)
+
+        def write_stats(self, stats, closed=False):
+            """عدادات الجلسة في <stats_dir>/<pid>.json (websockify يشعّب عملية لكل عميل)
+
+            الملف يُحذف عند إغلاق الجلسة، فلا تتراكم الجلسات السابقة في المجاميع
+            """
+            if not stats_dir:
+                return
+            stats_file = Path(stats_dir) / f"{os.getpid()}.json"
+            if closed:
+                try:
+                    stats_file.unlink()
+                except OSError:
+                    pass
+                return
+            stats = dict(stats, updated=time.time(),
+                         pid_start=process_start_time(os.getpid()))
+            if hasattr(self.request, "compression_stats"):
+                stats["compression"] = self.request.compression_stats()
+            Path(stats_dir).mkdir(parents=True, exist_ok=True)
+            tmp_file = stats_file.with_suffix(".json.tmp")
+            with open(tmp_file, "w") as f:
+                json.dump(stats, f)
+            os.replace(tmp_file, stats_file)
+
+        def do_proxy(self, target):
+            """حلقة websockify مع سقف لطابور العميل
+
+            عند تجاوز queue_limit يتوقف القراءة من VNC (ضغط TCP على الخادم)
+            وتُحجز طلبات FramebufferUpdateRequest من العميل؛ بعد تفريغ الطابور
+            يُرسل طلب تزايدي واحد مدمج بدل تسليم تحديثات قديمة بالترتيب.
+            """
+            if not backpressure:
+                stats = {"target": f"{self.server.target_host}:{self.server.target_port}",
+                         "started": time.time()}
+                try:
+                    return super().do_proxy(target)
+                finally:
+                    self.write_stats(stats, closed=True)
+                    self.log_compression()
+
+            high = backpressure["queue_limit"]
+            low = high // 4
+            parser = RFBClientParser()
+            withheld = []
+            throttled_since = None
+            stats = {"target": f"{self.server.target_host}:{self.server.target_port}",
+                     "started": time.time(), "queue_depth": 0, "max_queue_depth": 0,
+                     "dropped_frames": 0, "coalesced_requests": 0,
+                     "throttled_seconds": 0.0, "bytes_to_client": 0}
+            next_stats = 0.0
+            cqueue = []
+            c_pend = 0
+            tqueue = []
+
+            if self.server.heartbeat:
+                self.heartbeat = time.time() + self.server.heartbeat
+            else:
+                self.heartbeat = None
+
+            try:
+                while True:
+                    now = time.time()
+                    if self.heartbeat is not None and now > self.heartbeat:
+                        self.heartbeat = now + self.server.heartbeat
+                        self.send_ping()
+
+                    depth = self.queue_depth() + sum(len(buf) for buf in cqueue)
+                    stats["queue_depth"] = depth
+                    stats["max_queue_depth"] = max(stats["max_queue_depth"], depth)
+                    behind = depth > (low if throttled_since else high)
+                    if behind and throttled_since is None:
+                        throttled_since = now
+                    elif not behind and throttled_since is not None:
+                        stats["throttled_seconds"] += now - throttled_since
+                        throttled_since = None
+                        if withheld:
+                            tqueue.append(coalesce_update_requests(withheld))
+                            stats["dropped_frames"] += len(withheld) - 1
+                            stats["coalesced_requests"] += 1
+                            withheld = []
+                    if now >= next_stats:
+                        self.write_stats(stats)
+                        next_stats = now + 1.0
+
+                    rlist = [self.request] if throttled_since else [self.request, target]
+                    wlist = []
+                    if tqueue:
+                        wlist.append(target)
+                    if cqueue or c_pend:
+                        wlist.append(self.request)
+                    try:
+                        ins, outs, excepts = select.select(rlist, wlist, [], 1)
+                    except OSError as e:
+                        if e.errno != errno.EINTR:
+                            raise
+                        continue
+                    if excepts:
+                        raise Exception("Socket exception")
+
+                    if self.request in outs:
+                        c_pend = self.send_frames(cqueue)
+                        cqueue = []
+
+                    if self.request in ins:
+                        bufs, closed = self.recv_frames()
+                        for buf in bufs:
+                            for kind, message in parser.feed(buf):
+                                if kind == FRAMEBUFFER_UPDATE_REQUEST and throttled_since:
+                                    withheld.append(message)
+                                else:
+                                    tqueue.append(message)
+                        if closed:
+                            if self.verbose:
+                                self.log_message("%s:%s: Client closed connection",
+                                                 self.server.target_host, self.server.target_port)
+                            raise self.CClose(closed['code'], closed['reason'])
+
+                    if target in outs:
+                        dat = tqueue.pop(0)
+                        sent = target.send(dat)
+                        if sent == len(dat):
+                            self.print_traffic(">")
+                        else:
+                            tqueue.insert(0, dat[sent:])
+                            self.print_traffic(".>")
+
+                    if target in ins:
+                        buf = target.recv(self.buffer_size)
+                        if len(buf) == 0:
+                            if self.verbose:
+                                self.log_message("%s:%s: Target closed connection",
+                                                 self.server.target_host, self.server.target_port)
+                            raise self.CClose(1000, "Target closed")
+                        cqueue.append(buf)
+                        stats["bytes_to_client"] += len(buf)
+                        self.print_traffic("{")
+            finally:
+                if throttled_since is not None:
+                    stats["throttled_seconds"] += time.time() - throttled_since
+                stats["dropped_frames"] += len(withheld)
+                self.write_stats(stats, closed=True)
+                if self.verbose:
+                    self.log_message("backpressure: max queue %d bytes, %d frames dropped, "
+                                     "%.1fs throttled", stats["max_queue_depth"],
+                                     stats["dropped_frames"], stats["throttled_seconds"])
+                self.log_compression()
+
+        def log_compression(self):
+            if not self.verbose or not hasattr(self.request, "compression_stats"):
+                return
+            stats = self.request.compression_stats()
+            if stats["enabled"]:
+                self.log_message("permessage-deflate: %d -> %d bytes (ratio %.2f), "
+                                 "%.1f ms CPU", stats["raw_bytes"], stats["wire_bytes"],
+                                 stats["ratio"], stats["cpu_seconds"] * 1000)
+
+    return TrinityAssetRequestHandler
+
+
+def serve(argv):
+    """تشغيل websockify مع معالج الأصول (بديل python3 -m websockify)"""
+    parser = argparse.ArgumentParser(description="websockify with cached noVNC assets")
+    parser.add_argument("--web", required=True)
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--token-plugin")
+    parser.add_argument("--token-source")
+    parser.add_argument("--backpressure", action="store_true",
+                        help="bound per-client queue and coalesce stale updates")
+    parser.add_argument("--queue-limit", type=int, default=1024 * 1024)
+    parser.add_argument("--deflate", action="store_true",
+                        help="negotiate permessage-deflate (RFC 7692)")
+    parser.add_argument("--deflate-level", type=int, default=1)
+    parser.add_argument("--deflate-threshold", type=int, default=256,
+                        help="messages smaller than this are sent uncompressed")
+    parser.add_argument("--deflate-max-message", type=int, default=4 << 20,
+                        help="close with 1009 when a client message inflates beyond this")
+    parser.add_argument("--stats-dir")
+    parser.add_argument("listen")
+    parser.add_argument("target", nargs="?")
+    args = parser.parse_args(argv)
+
+    from websockify.websocketproxy import WebSocketProxy
+
+    listen_host, listen_port = args.listen.rsplit(":", 1)
+    options = {"listen_host": listen_host, "listen_port": int(listen_port),
+               "web": args.web, "verbose": args.verbose}
+    if args.target:
+        target_host, target_port = args.target.rsplit(":", 1)
+        options.update(target_host=target_host, target_port=int(target_port))
+    if args.token_plugin:
+        from websockify import token_plugins
+        options["token_plugin"] = getattr(token_plugins, args.token_plugin)(args.token_source)
+    backpressure = compression = None
+    if args.backpressure:
+        backpressure = {"queue_limit": args.queue_limit}
+    if args.deflate:
+        compression = {"level": args.deflate_level, "threshold": args.deflate_threshold,
+                       "max_message": args.deflate_max_message}
+    handler = make_asset_handler(backpressure, compression, args.stats_dir)
+    server = WebSocketProxy(RequestHandlerClass=handler, **options)
+    server.start_server()
+    return 0
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--build":
+        web_dir = sys.argv[2] if len(sys.argv) > 2 else "noVNC_integrated"
+        return 0 if NoVNCAssetPipeline(web_dir).build() else 1
+    if len(sys.argv) > 1 and sys.argv[1] == "--stats":
+        stats_dir = sys.argv[2] if len(sys.argv) > 2 else "trinity_workspace/gateway_stats"
+        print(json.dumps(read_gateway_stats(stats_dir), indent=2))
+        return 0
+    return serve(sys.argv[1:])
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Trinity QMP Benchmark - Synchronous vs. pipelined asyncio QMP throughput
+Sends the same commands to every VM with QEMUMonitorProtocol (one round
+trip per command, one VM after another) and with AsyncQEMUMonitorProtocol
+(all VMs concurrently, every command in flight at once)
+
+    python3 trinity_qmp_bench.py [--commands 200] [--command query-status]
+    python3 trinity_qmp_bench.py --fake 200 --latency 0.2 --commands 50
+    python3 trinity_qmp_bench.py --fake 4 --reply-mb 8 --commands 10
+    python3 trinity_qmp_bench.py --fake 4 --events 1000 --commands 20
+    python3 trinity_qmp_bench.py --fake 32 --mux --commands 200
+    python3 trinity_qmp_bench.py --fake 4 --latency 0.2 --qmp-latency
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "TrinityEmulator", "python"))
+from qemu import qmp as qmp_module
+from qemu.qmp import QEMUMonitorProtocol
+from qemu.aqmp import AsyncQEMUMonitorProtocol
+from qemu.qmpmux import QMPMultiplexer
+from qemu.qmpstats import QMPLatencyStats
+
+from trinity_comprehensive_launcher import TrinityComprehensiveLauncher
+
+
+class FakeQMPServers:
+    """خوادم QMP وهمية في خيط منفصل: تنفذ الأوامر بالترتيب مع زمن معالجة ثابت"""
+
+    def __init__(self, count, latency_ms=0.0, reply_bytes=0, events=0):
+        self.count = count
+        self.latency = latency_ms / 1000.0
+        # رد كبير بحجم reply_bytes تقريبا (يشبه query-qmp-schema) و/أو سيل أحداث قبل كل رد
+        if reply_bytes:
+            node = {"name": "node", "meta-type": "object", "members": [
+                {"name": "member", "type": "str", "default": None}] * 4}
+            copies = max(1, reply_bytes // len(json.dumps(node)))
+            self.payload = json.dumps([node] * copies).encode()
+        else:
+            self.payload = b'{"status": "running", "running": true}'
+        event = {"event": "BLOCK_JOB_PENDING", "data": {"type": "commit", "id": "job0"},
+                 "timestamp": {"seconds": 1700000000, "microseconds": 0}}
+        self.events = (json.dumps(event).encode() + b"\r\n") * events
+        self.tmp_dir = tempfile.mkdtemp(prefix="qmp-bench-")
+        self.sockets = [os.path.join(self.tmp_dir, f"vm{index}.sock") for index in range(count)]
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+
+    async def handle(self, reader, writer):
+        writer.write(b'{"QMP": {"version": {}, "capabilities": []}}\r\n')
+        decoder = json.JSONDecoder()
+        buf = ""
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            buf += data.decode()
+            pos = 0
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                try:
+                    request, pos = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    break
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                if self.events:
+                    writer.write(self.events)
+                cmd_id = b""
+                if "id" in request:
+                    cmd_id = b', "id": ' + json.dumps(request["id"]).encode()
+                writer.write(b'{"return": ' + self.payload + cmd_id + b"}\r\n")
+            buf = buf[pos:]
+            await writer.drain()
+        writer.close()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        for path in self.sockets:
+            self.loop.run_until_complete(asyncio.start_unix_server(self.handle, path))
+        self.ready.set()
+        self.loop.run_forever()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        self.ready.wait()
+        return [{"name": f"fake-{index}", "qmp_socket": path}
+                for index, path in enumerate(self.sockets)]
+
+
+def bench_sync(vms, command, count, latency=None):
+    """أمر واحد في كل رحلة ذهاب وإياب، VM بعد الأخرى"""
+    start = time.perf_counter()
+    for vm in vms:
+        qmp = QEMUMonitorProtocol(vm["qmp_socket"], latency=latency)
+        qmp.connect()
+        try:
+            for _ in range(count):
+                qmp.cmd(command)
+                qmp.clear_events()
+        finally:
+            qmp.close()
+    return time.perf_counter() - start
+
+
+async def bench_async(vms, command, count):
+    """كل الـ VMs معا، وكل الأوامر معلقة في نفس الوقت على كل اتصال"""
+    async def drive(vm):
+        async with AsyncQEMUMonitorProtocol(vm["qmp_socket"], nickname=vm["name"]) as qmp:
+            await qmp.connect()
+            await asyncio.gather(*(qmp.execute(command) for _ in range(count)))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(drive(vm) for vm in vms))
+    return time.perf_counter() - start
+
+
+async def bench_mux(vms, command, count):
+    """N عملاء عبر مُجمّع واحد على مقبس QMP الأول مقابل N عملاء على N مقابس منفصلة"""
+    start = time.perf_counter()
+    await bench_async(vms, command, count)
+    separate_s = time.perf_counter() - start
+
+    listen = os.path.join(tempfile.mkdtemp(prefix="qmp-mux-"), "mux.sock")
+    mux = QMPMultiplexer(vms[0]["qmp_socket"], [listen])
+    await mux.start()
+    try:
+        start = time.perf_counter()
+        await bench_async([{"name": vm["name"], "qmp_socket": listen} for vm in vms],
+                          command, count)
+        mux_s = time.perf_counter() - start
+    finally:
+        await mux.close()
+    return separate_s, mux_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync vs. asyncio QMP benchmark")
+    parser.add_argument("--commands", type=int, default=100, help="commands per VM")
+    parser.add_argument("--command", default="query-status")
+    parser.add_argument("--fake", type=int, metavar="N",
+                        help="benchmark against N in-process fake QMP servers")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="fake server processing time per command (ms)")
+    parser.add_argument("--reply-mb", type=float, default=0.0,
+                        help="fake reply size per command (MB)")
+    parser.add_argument("--events", type=int, default=0,
+                        help="fake events sent before each reply")
+    parser.add_argument("--mux", action="store_true",
+                        help="compare N clients on N sockets with N clients sharing one "
+                             "socket through QMPMultiplexer (needs --fake N)")
+    parser.add_argument("--qmp-latency", action="store_true",
+                        help="time the sync run with QMPLatencyStats and report per-phase "
+                             "percentiles (send / wait for QEMU / read+parse)")
+    parser.add_argument("-o", "--output")
+    args = parser.parse_args()
+
+    if args.fake:
+        vms = FakeQMPServers(args.fake, args.latency,
+                             int(args.reply_mb * 1024 * 1024), args.events).start()
+    else:
+        vms = [vm for vm in TrinityComprehensiveLauncher().load_running_vms()
+               if vm.get("qmp_socket")]
+    if not vms:
+        print("❌ No VMs with a QMP socket (use --fake N)")
+        return 1
+    # مئات الاتصالات المتزامنة تحتاج واصفات ملفات كافية
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, min(hard, 4 * len(vms) + 64)), hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+    total = len(vms) * args.commands
+    if args.mux:
+        if not args.fake:
+            print("❌ --mux needs --fake N: a real VM has one client per QMP socket")
+            return 1
+        separate_s, mux_s = asyncio.run(bench_mux(vms, args.command, args.commands))
+        result = {
+            "clients": len(vms), "commands_per_client": args.commands,
+            "command": args.command, "fake_latency_ms": args.latency,
+            "separate_sockets": {"seconds": round(separate_s, 3),
+                                 "commands_per_s": round(total / separate_s)},
+            "multiplexed": {"seconds": round(mux_s, 3),
+                            "commands_per_s": round(total / mux_s)},
+        }
+    else:
+        latency = QMPLatencyStats() if args.qmp_latency else None
+        sync_s = bench_sync(vms, args.command, args.commands, latency)
+        async_s = asyncio.run(bench_async(vms, args.command, args.commands))
+        result = {
+            "vms": len(vms), "commands_per_vm": args.commands, "command": args.command,
+            "fake_latency_ms": args.latency if args.fake else None,
+            "json": "orjson" if qmp_module.orjson is not None else "json",
+            "sync": {"seconds": round(sync_s, 3), "commands_per_s": round(total / sync_s)},
+            "async": {"seconds": round(async_s, 3), "commands_per_s": round(total / async_s)},
+            "speedup": round(sync_s / async_s, 1),
+        }
+        if args.fake and args.reply_mb:
+            result["reply_mb"] = args.reply_mb
+            for mode, seconds in (("sync", sync_s), ("async", async_s)):
+                result[mode]["mb_per_s"] = round(total * args.reply_mb / seconds, 1)
+        if args.fake and args.events:
+            result["events_per_command"] = args.events
+            for mode, seconds in (("sync", sync_s), ("async", async_s)):
+                result[mode]["events_per_s"] = round(total * args.events / seconds)
+        if latency is not None:
+            result["sync"]["latency_ms"] = latency.summary().get(args.command)
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Trinity Rebalancer - Live migration of Android VMs between launcher instances
+Each host runs a migration agent; the rebalancer moves VMs from hot to cool hosts
+
+Two launcher instances on one machine can stand in for two hosts:
+    export TRINITY_MIGRATION_TOKEN=<shared secret>
+    python3 trinity_rebalancer.py --agent 5007
+    python3 trinity_rebalancer.py --agent 5008 trinity_workspace_b 5930 5575
+    python3 trinity_rebalancer.py --migrate Android-Main http://localhost:5007 http://localhost:5008
+
+Agents and clients authenticate with TRINITY_MIGRATION_TOKEN; agents listen
+(and accept incoming migrations) on TRINITY_MIGRATION_HOST, 127.0.0.1 by
+default: set it to the host's own address for migrations between hosts.
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import socket
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from trinity_comprehensive_launcher import TrinityComprehensiveLauncher
+
+
+def migration_token():
+    """السر المشترك بين الوكلاء؛ بدونه لا يعمل الوكيل ولا العميل"""
+    token = os.environ.get("TRINITY_MIGRATION_TOKEN")
+    if not token:
+        raise RuntimeError("TRINITY_MIGRATION_TOKEN is not set")
+    return token
+
+
+def agent_call(url, path, payload=None, timeout=60):
+    """استدعاء HTTP لوكيل الترحيل وإرجاع JSON"""
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(url.rstrip("/") + path, data=data,
+                                     headers={"Content-Type": "application/json",
+                                              "Authorization": f"Bearer {migration_token()}"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def tune_migration(dirty_rate, bandwidth):
+    """
+    اختيار معاملات الترحيل من معدل الكتابة (MB/s) وعرض النطاق (MB/s)
+    يعيد (capabilities, parameters)
+    """
+    params = {"max-bandwidth": int(bandwidth * 1024 * 1024)}
+    if dirty_rate is None:
+        # لا يوجد قياس (QEMU < 5.2): إعدادات محافظة
+        params["downtime-limit"] = 300
+        return {"auto-converge": True}, params
+
+    ratio = dirty_rate / bandwidth
+    if ratio < 0.3:
+        params["downtime-limit"] = 100
+        auto_converge = False
+    elif ratio < 0.8:
+        params["downtime-limit"] = 300
+        auto_converge = False
+    else:
+        # الذاكرة تتسخ أسرع من قدرة الشبكة: إبطاء vCPUs حتى يتقارب الترحيل
+        params["downtime-limit"] = 500
+        params["cpu-throttle-initial"] = min(60, max(20, int(ratio * 20)))
+        params["cpu-throttle-increment"] = 10
+        auto_converge = True
+    return {"auto-converge": auto_converge}, params
+
+
+class TrinityMigrationAgent:
+    def __init__(self, launcher=None, advertise_host="127.0.0.1",
+                 bandwidth_mbps=1000, token=None, commit_retries=5):
+        self.launcher = launcher or TrinityComprehensiveLauncher()
+        # الوكيل وترحيلات -incoming تستمع على هذا العنوان فقط، لا على كل الواجهات
+        self.advertise_host = advertise_host
+        self.bandwidth_mbps = bandwidth_mbps
+        self.token = token or migration_token()
+        self.commit_retries = commit_retries
+
+    def log(self, message):
+        print(f"[Rebalancer] {message}")
+
+    def find_vm(self, name):
+        for vm in self.launcher.load_running_vms():
+            if vm["name"] == name:
+                return vm
+        raise KeyError(f"Unknown VM: {name}")
+
+    def get_status(self):
+        """حمل المضيف وقائمة VMs العاملة"""
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        vms = [vm["name"] for vm in self.launcher.load_running_vms()
+               if vm.get("status") == "running"]
+        return {"host": self.advertise_host, "load": round(load, 3), "vms": vms}
+
+    def free_port(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind((self.advertise_host, 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def prepare_incoming(self, request):
+        """تشغيل VM الهدف بوضع -incoming وتسجيلها كـ incoming"""
+        name = request["name"]
+        if any(vm["name"] == name for vm in self.launcher.load_running_vms()):
+            raise ValueError(f"{name} already registered on this host")
+        index = self.launcher.next_free_index()
+        port = self.free_port()
+        vm_config = {"name": name,
+                     "memory": request.get("memory") or self.launcher.config["memory"],
+                     "cores": request.get("cores") or self.launcher.config["cores"],
+                     "profile": request.get("profile")}
+        # حجم RAM وعدد vCPU القصوى يجب أن تطابق المصدر حتى يقبل QEMU الترحيل
+        for key in ("max_memory", "max_cores"):
+            if request.get(key):
+                vm_config[key] = request[key]
+        vm_info = self.launcher.launch_trinity_vm(
+            vm_config, index, extra_args=["-incoming", f"tcp:{self.advertise_host}:{port}"])
+        if vm_info is None:
+            raise RuntimeError(f"Failed to start incoming VM for {name}")
+        vm_info["status"] = "incoming"
+        self.launcher.update_running_vms(lambda vms: vms + [vm_info])
+        self.log(f"📥 {name} waiting for migration on port {port}")
+        return {"uri": f"tcp:{self.advertise_host}:{port}",
+                "host": self.advertise_host,
+                "vnc_port": vm_info["vnc_port"]}
+
+    def commit_incoming(self, request):
+        """اكتمل الترحيل: تحويل السجل إلى running ونشر مسار البوابة"""
+        name = request["name"]
+
+        def mark_running(vms):
+            for vm in vms:
+                if vm["name"] == name:
+                    vm["status"] = "running"
+            return vms
+
+        self.launcher.update_running_vms(mark_running)
+        vm = self.find_vm(name)
+        # VM بدون شاشة: attach_display تفتح VNC على UNIX socket بدل localhost:None
+        self.launcher.attach_display(vm)
+        self.log(f"✅ {name} now owned by this host")
+        return {"name": name, "status": "running"}
+
+    def abort_incoming(self, request):
+        """فشل الترحيل: إيقاف VM الهدف وحذفها من السجل"""
+        name = request["name"]
+        try:
+            vm = self.find_vm(name)
+            qmp = self.launcher.connect_vm_qmp(vm)
+            qmp.cmd("quit")
+            qmp.close()
+        except Exception as e:
+            self.log(f"⚠️ Could not stop incoming {name}: {e}")
+        self.launcher.update_running_vms(
+            lambda vms: [vm for vm in vms if vm["name"] != name])
+        self.log(f"🛑 Incoming migration of {name} aborted")
+        return {"name": name, "status": "aborted"}
+
+    @staticmethod
+    def measure_dirty_rate(qmp, calc_time=1):
+        """قياس معدل اتساخ الذاكرة (MB/s) أو None إذا لم يدعمه QEMU"""
+        resp = qmp.cmd("calc-dirty-rate", {"calc-time": calc_time})
+        if resp is None or "error" in resp:
+            return None
+        deadline = time.monotonic() + calc_time + 5
+        while time.monotonic() < deadline:
+            time.sleep(0.2)
+            resp = qmp.cmd("query-dirty-rate")
+            if resp and resp.get("return", {}).get("status") == "measured":
+                return resp["return"]["dirty-rate"]
+        return None
+
+    def migrate_out(self, name, target_url):
+        """ترحيل VM حية إلى وكيل آخر ونقل ملكيتها"""
+        vm = self.find_vm(name)
+        qmp = self.launcher.connect_vm_qmp(vm)
+        try:
+            dirty_rate = self.measure_dirty_rate(qmp)
+            capabilities, params = tune_migration(dirty_rate, self.bandwidth_mbps)
+            self.log(f"📊 {name}: dirty rate {dirty_rate} MB/s -> {params}")
+
+            target = agent_call(target_url, "/api/migration/incoming",
+                                {key: vm.get(key) for key in (
+                                    "name", "memory", "max_memory", "cores",
+                                    "max_cores", "profile")})
+            try:
+                qmp.command("migrate-set-capabilities", capabilities=[
+                    {"capability": cap, "state": state}
+                    for cap, state in capabilities.items()])
+                qmp.command("migrate-set-parameters", **params)
+                # لا يوجد تخزين مشترك بين المضيفين: نسخ الأقراص مع الذاكرة
+                qmp.command("migrate", uri=target["uri"], blk=True)
+                info = self.wait_for_migration(qmp, params)
+            except Exception:
+                agent_call(target_url, "/api/migration/abort", {"name": name})
+                raise
+
+            committed = self.commit_remote(target_url, name)
+            if committed:
+                # المسار القديم يوجه للمضيف الجديد حتى تبقى روابط المتصفح صالحة
+                self.launcher.update_gateway_route(
+                    name, f"{target['host']}:{target['vnc_port']}")
+                self.launcher.update_running_vms(
+                    lambda vms: [v for v in vms if v["name"] != name])
+                qmp.cmd("quit")
+            else:
+                # المصدر متوقف (postmigrate) والهدف لم يؤكد الملكية: لا إيقاف ولا حذف،
+                # فقط إخراجها من VMs العاملة حتى يحسم المشغل أي نسخة تبقى
+                self.mark_uncommitted(name, target_url)
+        finally:
+            qmp.close()
+
+        self.log(f"🚚 {name} migrated to {target_url} "
+                 f"(downtime {info.get('downtime')} ms, "
+                 f"{info.get('total-time')} ms total)"
+                 + ("" if committed else " but NOT committed"))
+        return {"name": name, "target": target_url, "committed": committed,
+                "dirty_rate_mbps": dirty_rate,
+                "downtime_ms": info.get("downtime"),
+                "total_time_ms": info.get("total-time"),
+                "ram": info.get("ram", {})}
+
+    def commit_remote(self, target_url, name):
+        """تأكيد الملكية لدى الهدف بعد اكتمال الترحيل، مع إعادة المحاولة"""
+        for attempt in range(self.commit_retries):
+            try:
+                agent_call(target_url, "/api/migration/commit", {"name": name})
+                return True
+            except Exception as e:
+                self.log(f"⚠️ {name}: commit on {target_url} failed "
+                         f"(attempt {attempt + 1}/{self.commit_retries}): {e}")
+                time.sleep(min(2 ** attempt, 30))
+        return False
+
+    def mark_uncommitted(self, name, target_url):
+        def mark(vms):
+            for vm in vms:
+                if vm["name"] == name:
+                    vm["status"] = "migrated-uncommitted"
+                    vm["migrated_to"] = target_url
+            return vms
+
+        self.launcher.update_running_vms(mark)
+        self.log(f"❗ {name}: migrated to {target_url} but the commit failed; "
+                 f"source kept paused as migrated-uncommitted")
+
+    def wait_for_migration(self, qmp, params, timeout=1800):
+        """متابعة query-migrate ورفع downtime-limit إذا لم يتقارب الترحيل"""
+        downtime_limit = params["downtime-limit"]
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            info = qmp.command("query-migrate")
+            status = info.get("status")
+            if status == "completed":
+                return info
+            if status in ("failed", "cancelled"):
+                raise RuntimeError(f"Migration {status}: {info.get('error-desc', '')}")
+            expected = info.get("expected-downtime")
+            if expected and expected > downtime_limit * 2 and downtime_limit < 2000:
+                downtime_limit = min(2000, downtime_limit * 2)
+                qmp.command("migrate-set-parameters", **{"downtime-limit": downtime_limit})
+            time.sleep(0.5)
+        qmp.cmd("migrate_cancel")
+        raise RuntimeError("Migration timed out")
+
+    def make_handler(self):
+        agent = self
+        routes = {
+            "/api/migration/incoming": agent.prepare_incoming,
+            "/api/migration/commit": agent.commit_incoming,
+            "/api/migration/abort": agent.abort_incoming,
+            "/api/migration/send": lambda req: agent.migrate_out(req["name"], req["target"])
+        }
+
+        class MigrationRequestHandler(BaseHTTPRequestHandler):
+            def authorized(self):
+                header = self.headers.get("Authorization", "")
+                if hmac.compare_digest(header.encode("utf-8"),
+                                       f"Bearer {agent.token}".encode("utf-8")):
+                    return True
+                self.reply(401, {"error": "unauthorized"})
+                return False
+
+            def reply(self, code, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if not self.authorized():
+                    return
+                if self.path == "/api/migration/status":
+                    self.reply(200, agent.get_status())
+                else:
+                    self.reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                if not self.authorized():
+                    return
+                handler = routes.get(self.path)
+                if handler is None:
+                    self.reply(404, {"error": "not found"})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    self.reply(200, handler(json.loads(self.rfile.read(length) or b"{}")))
+                except KeyError as e:
+                    self.reply(404, {"error": str(e)})
+                except ValueError as e:
+                    self.reply(409, {"error": str(e)})
+                except Exception as e:
+                    self.reply(500, {"error": str(e)})
+
+            def log_message(self, format, *args):
+                agent.log(format % args)
+
+        return MigrationRequestHandler
+
+    def serve(self, port):
+        server = ThreadingHTTPServer((self.advertise_host, port), self.make_handler())
+        self.log(f"🔁 Migration agent on {self.advertise_host}:{port} "
+                 f"(workspace {self.launcher.workspace_dir})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.log("🛑 Stopping migration agent...")
+        finally:
+            server.server_close()
+
+
+class TrinityRebalancer:
+    def __init__(self, agent_urls, threshold=0.25):
+        self.agent_urls = agent_urls
+        self.threshold = threshold
+
+    def log(self, message):
+        print(f"[Rebalancer] {message}")
+
+    def rebalance_once(self):
+        """نقل VM واحدة من أكثر المضيفين حملاً إلى أقلهم إذا تجاوز الفرق الحد"""
+        status = {url: agent_call(url, "/api/migration/status")
+                  for url in self.agent_urls}
+        hot = max(status, key=lambda url: status[url]["load"])
+        cool = min(status, key=lambda url: status[url]["load"])
+        delta = status[hot]["load"] - status[cool]["load"]
+        if hot == cool or delta < self.threshold or not status[hot]["vms"]:
+            self.log(f"⚖️ Balanced (load delta {delta:.2f})")
+            return None
+        name = status[hot]["vms"][-1]
+        self.log(f"🔥 {hot} load {status[hot]['load']} -> moving {name} to {cool}")
+        return agent_call(hot, "/api/migration/send",
+                          {"name": name, "target": cool}, timeout=1900)
+
+    def run(self, interval=60):
+        while True:
+            try:
+                self.rebalance_once()
+            except KeyboardInterrupt:
+                raise
+            except Exception as e:
+                self.log(f"❌ Rebalance error: {e}")
+            time.sleep(interval)
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) >= 2 and args[0] == "--agent":
+        launcher_args = args[2:3] + [int(port) for port in args[3:5]]
+        launcher = TrinityComprehensiveLauncher(*launcher_args)
+        host = os.environ.get("TRINITY_MIGRATION_HOST", "127.0.0.1")
+        TrinityMigrationAgent(launcher, advertise_host=host).serve(int(args[1]))
+        return 0
+    if len(args) == 4 and args[0] == "--migrate":
+        result = agent_call(args[2], "/api/migration/send",
+                            {"name": args[1], "target": args[3]}, timeout=1900)
+        print(json.dumps(result, indent=2))
+        return 0
+    if len(args) >= 3 and args[0] == "--rebalance":
+        try:
+            TrinityRebalancer(args[1:]).run()
+        except KeyboardInterrupt:
+            pass
+        return 0
+    print(__doc__)
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,575 @@
+#!/usr/bin/env python3
+"""
+Trinity RFB Benchmark - Headless load generator for the VNC -> websockify -> noVNC path
+Drives N concurrent RFB sessions (raw TCP or WebSocket) and reports latency as JSON
+
+    python3 trinity_rfb_bench.py rfb://localhost:5910 --sessions 4 --duration 30
+    python3 trinity_rfb_bench.py ws://localhost:5001/websockify --sessions 20
+    python3 trinity_rfb_bench.py --spawn-vm 5 --sessions 8 -o bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import select
+import socket
+import struct
+import argparse
+import threading
+import statistics
+import subprocess
+import urllib.parse
+from collections import deque
+
+try:
+    from Crypto.Cipher import DES
+except ImportError:
+    DES = None
+
+ENCODINGS = {
+    "raw": 0,
+    "copyrect": 1,
+    "zlib": 6,
+    "hextile": 5,
+    "zrle": 16,
+}
+ENCODING_NAMES = {number: name for name, number in ENCODINGS.items()}
+PSEUDO_DESKTOP_SIZE = -223
+PSEUDO_LAST_RECT = -224
+
+# مفاتيح X11 المستخدمة لحقن الإدخال: حرف ثم BackSpace حتى لا يمتلئ السطر
+XK_A = 0x61
+XK_BACKSPACE = 0xff08
+
+
+class WebSocketStream:
+    """عميل WebSocket بسيط (RFC 6455) بواجهة تشبه socket"""
+
+    def __init__(self, url, timeout=10):
+        parsed = urllib.parse.urlparse(url)
+        self.sock = socket.create_connection(
+            (parsed.hostname, parsed.port or 80), timeout=timeout)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = (f"GET {path} HTTP/1.1\r\n"
+                   f"Host: {parsed.hostname}:{parsed.port}\r\n"
+                   "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                   f"Sec-WebSocket-Key: {key}\r\n"
+                   "Sec-WebSocket-Version: 13\r\n"
+                   "Sec-WebSocket-Protocol: binary\r\n\r\n")
+        self.sock.sendall(request.encode())
+        response = b""
+        while b"\r\n\r\n" not in response:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("WebSocket handshake failed")
+            response += chunk
+        header, self.buffer = response.split(b"\r\n\r\n", 1)
+        self.buffer = bytearray(self.buffer)
+        if b" 101 " not in header.split(b"\r\n", 1)[0]:
+            raise ConnectionError(header.split(b"\r\n", 1)[0].decode(errors="replace"))
+        self.frame_buffer = bytearray()
+        self.wire_bytes = 0
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def pending(self):
+        return bool(self.frame_buffer or self.buffer)
+
+    def _raw(self, count):
+        while len(self.buffer) < count:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("WebSocket closed")
+            self.wire_bytes += len(chunk)
+            self.buffer.extend(chunk)
+        data = bytes(self.buffer[:count])
+        del self.buffer[:count]
+        return data
+
+    def _read_frame(self):
+        head = self._raw(2)
+        opcode = head[0] & 0x0f
+        length = head[1] & 0x7f
+        if length == 126:
+            length = struct.unpack(">H", self._raw(2))[0]
+        elif length == 127:
+            length = struct.unpack(">Q", self._raw(8))[0]
+        mask = self._raw(4) if head[1] & 0x80 else None
+        payload = self._raw(length)
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        if opcode == 0x8:
+            raise ConnectionError("WebSocket closed by server")
+        if opcode == 0x9:
+            self._send_frame(0xa, payload)
+            return b""
+        return payload
+
+    def recv_exact(self, count):
+        while len(self.frame_buffer) < count:
+            self.frame_buffer.extend(self._read_frame())
+        data = bytes(self.frame_buffer[:count])
+        del self.frame_buffer[:count]
+        return data
+
+    def _send_frame(self, opcode, payload):
+        header = bytearray([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header.append(0x80 | length)
+        elif length < 65536:
+            header.append(0x80 | 126)
+            header += struct.pack(">H", length)
+        else:
+            header.append(0x80 | 127)
+            header += struct.pack(">Q", length)
+        mask = os.urandom(4)
+        header += mask
+        self.sock.sendall(bytes(header) + bytes(b ^ mask[i % 4] for i, b in enumerate(payload)))
+
+    def sendall(self, data):
+        self._send_frame(0x2, data)
+
+    def close(self):
+        try:
+            self._send_frame(0x8, b"")
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class TCPStream:
+    def __init__(self, host, port, timeout=10):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.buffer = bytearray()
+        self.wire_bytes = 0
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def pending(self):
+        return bool(self.buffer)
+
+    def recv_exact(self, count):
+        while len(self.buffer) < count:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("RFB connection closed")
+            self.wire_bytes += len(chunk)
+            self.buffer.extend(chunk)
+        data = bytes(self.buffer[:count])
+        del self.buffer[:count]
+        return data
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        self.sock.close()
+
+
+def open_stream(url):
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme in ("ws", "wss"):
+        return WebSocketStream(url)
+    return TCPStream(parsed.hostname, parsed.port or 5900)
+
+
+def vnc_auth_response(password, challenge):
+    """استجابة VNC Authentication (DES بمفتاح معكوس البتات)"""
+    if DES is None:
+        raise RuntimeError("VNC password auth needs pycryptodome (Crypto.Cipher.DES)")
+    key = (password.encode() + b"\0" * 8)[:8]
+    key = bytes(int(f"{b:08b}"[::-1], 2) for b in key)
+    return DES.new(key, DES.MODE_ECB).encrypt(challenge)
+
+
+class RFBSession:
+    def __init__(self, url, encodings, password=None, inject="key"):
+        self.url = url
+        self.encodings = encodings
+        self.password = password
+        self.inject = inject
+        self.stream = None
+        self.width = self.height = 0
+        self.bpp = 4
+        self.updates = 0
+        self.rects = 0
+        self.frame_bytes = []
+        self.encoding_stats = {}
+        self.latencies = []
+        self.pending_input = None
+        self.inject_count = 0
+        # مناطق التحديثات التلقائية (وميض المؤشر، ساعة...) لتمييزها عن أثر الإدخال
+        self.idle_regions = deque(maxlen=4)
+        self.background_updates = 0
+        self.elapsed = 0.0
+        self.error = None
+
+    def handshake(self):
+        stream = self.stream = open_stream(self.url)
+        version = stream.recv_exact(12)
+        if not version.startswith(b"RFB "):
+            raise ConnectionError(f"Not an RFB server: {version!r}")
+        stream.sendall(b"RFB 003.008\n")
+        count = stream.recv_exact(1)[0]
+        if count == 0:
+            length = struct.unpack(">I", stream.recv_exact(4))[0]
+            raise ConnectionError(stream.recv_exact(length).decode(errors="replace"))
+        types = stream.recv_exact(count)
+        if 1 in types:
+            stream.sendall(b"\x01")
+        elif 2 in types and self.password is not None:
+            stream.sendall(b"\x02")
+            stream.sendall(vnc_auth_response(self.password, stream.recv_exact(16)))
+        else:
+            raise ConnectionError(f"Unsupported security types {list(types)}")
+        if struct.unpack(">I", stream.recv_exact(4))[0] != 0:
+            raise ConnectionError("RFB authentication failed")
+
+        stream.sendall(b"\x01")  # shared session
+        self.width, self.height = struct.unpack(">HH", stream.recv_exact(4))
+        stream.recv_exact(16)
+        name_length = struct.unpack(">I", stream.recv_exact(4))[0]
+        stream.recv_exact(name_length)
+
+        # 32bpp true colour حتى يكون حجم البكسل ثابتاً
+        stream.sendall(struct.pack(">BxxxBBBBHHHBBBxxx", 0, 32, 24, 0, 1,
+                                   255, 255, 255, 16, 8, 0))
+        codes = [ENCODINGS[name] for name in self.encodings]
+        codes += [PSEUDO_DESKTOP_SIZE, PSEUDO_LAST_RECT]
+        stream.sendall(struct.pack(f">BxH{len(codes)}i", 2, len(codes), *codes))
+        self.request_update(incremental=False)
+
+    def request_update(self, incremental=True):
+        self.stream.sendall(struct.pack(">BBHHHH", 3, 1 if incremental else 0,
+                                        0, 0, self.width, self.height))
+
+    def send_input(self):
+        """حقن حدث إدخال وتسجيل وقته لقياس زمن الاستجابة"""
+        if self.inject == "pointer":
+            x = (self.inject_count * 37) % max(1, self.width)
+            y = (self.inject_count * 17) % max(1, self.height)
+            message = struct.pack(">BBHH", 5, 0, x, y)
+        else:
+            key = XK_A if self.inject_count % 2 == 0 else XK_BACKSPACE
+            message = (struct.pack(">BBxxI", 4, 1, key) +
+                       struct.pack(">BBxxI", 4, 0, key))
+        self.inject_count += 1
+        self.pending_input = time.perf_counter()
+        self.stream.sendall(message)
+
+    def rect_payload_size(self, encoding, width, height):
+        """قراءة بيانات المستطيل وإرجاع عدد البايتات حسب الترميز"""
+        stream = self.stream
+        if encoding == 0:
+            size = width * height * self.bpp
+            stream.recv_exact(size)
+            return size
+        if encoding == 1:
+            stream.recv_exact(4)
+            return 4
+        if encoding in (6, 16):
+            length = struct.unpack(">I", stream.recv_exact(4))[0]
+            stream.recv_exact(length)
+            return 4 + length
+        if encoding == 5:
+            return self.read_hextile(width, height)
+        raise ConnectionError(f"Unexpected encoding {encoding}")
+
+    def read_hextile(self, width, height):
+        stream = self.stream
+        size = 0
+        for ty in range(0, height, 16):
+            for tx in range(0, width, 16):
+                tw = min(16, width - tx)
+                th = min(16, height - ty)
+                subencoding = stream.recv_exact(1)[0]
+                size += 1
+                if subencoding & 1:
+                    stream.recv_exact(tw * th * self.bpp)
+                    size += tw * th * self.bpp
+                    continue
+                extra = 0
+                if subencoding & 2:
+                    extra += self.bpp
+                if subencoding & 4:
+                    extra += self.bpp
+                if extra:
+                    stream.recv_exact(extra)
+                    size += extra
+                if subencoding & 8:
+                    count = stream.recv_exact(1)[0]
+                    per_rect = 2 + (self.bpp if subencoding & 16 else 0)
+                    stream.recv_exact(count * per_rect)
+                    size += 1 + count * per_rect
+        return size
+
+    def read_update(self):
+        """قراءة FramebufferUpdate كامل وتحديث الإحصائيات"""
+        stream = self.stream
+        count = struct.unpack(">xH", stream.recv_exact(3))[0]
+        total = 4
+        regions = set()
+        for _ in range(count):
+            x, y, width, height, encoding = struct.unpack(">HHHHi", stream.recv_exact(12))
+            total += 12
+            if encoding == PSEUDO_LAST_RECT:
+                break
+            if encoding == PSEUDO_DESKTOP_SIZE:
+                self.width, self.height = width, height
+                continue
+            size = self.rect_payload_size(encoding, width, height)
+            total += size
+            if width > 0 and height > 0:
+                regions.add((x, y, width, height))
+            name = ENCODING_NAMES.get(encoding, str(encoding))
+            stats = self.encoding_stats.setdefault(name, {"rects": 0, "bytes": 0, "pixels": 0})
+            stats["rects"] += 1
+            stats["bytes"] += size
+            stats["pixels"] += width * height
+            self.rects += 1
+        self.updates += 1
+        self.frame_bytes.append(total)
+        if not regions:
+            return
+        regions = frozenset(regions)
+        if self.pending_input is None:
+            if regions not in self.idle_regions:
+                self.idle_regions.append(regions)
+        elif regions in self.idle_regions:
+            # نفس مناطق تحديث تلقائي سابق: ليس أثر الإدخال المنتظر
+            self.background_updates += 1
+        else:
+            self.latencies.append((time.perf_counter() - self.pending_input) * 1000.0)
+            self.pending_input = None
+
+    def read_message(self):
+        message_type = self.stream.recv_exact(1)[0]
+        if message_type == 0:
+            self.read_update()
+            self.request_update()
+        elif message_type == 1:
+            _, count = struct.unpack(">xHH", self.stream.recv_exact(5))
+            self.stream.recv_exact(count * 6)
+        elif message_type == 2:
+            pass
+        elif message_type == 3:
+            length = struct.unpack(">xxxI", self.stream.recv_exact(7))[0]
+            self.stream.recv_exact(length)
+        else:
+            raise ConnectionError(f"Unknown server message {message_type}")
+
+    def run(self, duration, inject_interval, start_barrier=None):
+        try:
+            self.handshake()
+        except Exception as e:
+            self.error = str(e)
+        if start_barrier is not None:
+            start_barrier.wait()
+        if self.error:
+            return
+        started = time.perf_counter()
+        next_inject = started + inject_interval
+        try:
+            while True:
+                now = time.perf_counter()
+                if now - started >= duration:
+                    break
+                if now >= next_inject:
+                    # إدخال لم يصل أثره يُحتسب مفقوداً ولا يدخل في زمن الاستجابة
+                    self.send_input()
+                    next_inject = now + inject_interval
+                # انتظار بداية رسالة فقط؛ الرسالة نفسها تُقرأ كاملة بدون مهلة قصيرة
+                if self.stream.pending() or select.select([self.stream.sock], [], [], 0.02)[0]:
+                    self.read_message()
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.elapsed = time.perf_counter() - started
+            self.stream.close()
+
+    def report(self):
+        if self.error and not self.updates:
+            return {"url": self.url, "error": self.error}
+        elapsed = self.elapsed or 1e-9
+        encodings = {}
+        for name, stats in self.encoding_stats.items():
+            encodings[name] = dict(stats, bytes_per_rect=round(stats["bytes"] / stats["rects"], 1))
+        return {
+            "url": self.url,
+            "framebuffer": [self.width, self.height],
+            "updates": self.updates,
+            "updates_per_s": round(self.updates / elapsed, 2),
+            "bytes_per_frame": round(statistics.mean(self.frame_bytes), 1) if self.frame_bytes else 0,
+            "wire_bytes": self.stream.wire_bytes if self.stream else 0,
+            "encodings": encodings,
+            "inputs": self.inject_count,
+            "background_updates": self.background_updates,
+            "latency_ms": latency_summary(self.latencies),
+            "error": self.error
+        }
+
+
+def latency_summary(samples):
+    if not samples:
+        return {"samples": 0}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))], 3)
+
+    return {"samples": len(ordered), "min": round(ordered[0], 3),
+            "p50": pct(50), "p95": pct(95), "p99": pct(99),
+            "max": round(ordered[-1], 3), "mean": round(statistics.mean(ordered), 3)}
+
+
+def listening_pid(port):
+    """العثور على العملية التي تستمع على منفذ TCP عبر /proc"""
+    inodes = set()
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                for line in f.readlines()[1:]:
+                    fields = line.split()
+                    if fields[3] == "0A" and int(fields[1].rsplit(":", 1)[1], 16) == port:
+                        inodes.add(fields[9])
+        except OSError:
+            continue
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            for fd in os.listdir(f"/proc/{pid}/fd"):
+                link = os.readlink(f"/proc/{pid}/fd/{fd}")
+                if link.startswith("socket:[") and link[8:-1] in inodes:
+                    return int(pid)
+        except OSError:
+            continue
+    return None
+
+
+def process_tree_cpu(root_pid):
+    """مجموع وقت CPU (ثوان) للعملية وكل أحفادها (websockify يشعب عملية لكل اتصال)
+
+    cutime/cstime تضيف وقت الأبناء المنتهين بعد أن ينتظرهم الأب، فلا يضيع وقت اتصال أُغلق
+    """
+    ticks = os.sysconf("SC_CLK_TCK")
+    children = {}
+    times = {}
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(pid))
+        times[int(pid)] = sum(int(value) for value in fields[11:15])
+    total = 0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += times.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return total / ticks
+
+
+def spawn_test_vm(display):
+    """VM اختبار: شاشة QEMU monitor نصية فقط، كل ضغطة مفتاح تغير منطقة صغيرة
+
+    مؤشر الشاشة النصية يومض كل 250ms ولا خيار لإيقافه؛ RFBSession يتجاهل تحديثاته
+    لأنها تكرر مناطق تحديثات تلقائية سابقة. بعد المحث "(qemu) " (7 أحرف) يغطي أثر
+    المفتاح خليتين في كتلتي VNC مختلفتين فلا يطابق الوميض
+    """
+    cmd = ["qemu-system-x86_64", "-nodefaults", "-S", "-vga", "none",
+           "-monitor", "vc:1024x768", "-vnc", f"127.0.0.1:{display}"]
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", 5900 + display), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Test VM did not open its VNC port")
+
+
+def run_benchmark(url, sessions, duration, inject_interval, encodings, password, inject):
+    parsed = urllib.parse.urlparse(url)
+    gateway_pid = listening_pid(parsed.port) if parsed.scheme in ("ws", "wss") else None
+    clients = [RFBSession(url, encodings, password, inject) for _ in range(sessions)]
+    barrier = threading.Barrier(sessions + 1)
+    threads = [threading.Thread(target=c.run, args=(duration, inject_interval, barrier), daemon=True)
+               for c in clients]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    cpu_start = process_tree_cpu(gateway_pid) if gateway_pid else None
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_start
+
+    reports = [c.report() for c in clients]
+    all_latencies = [sample for c in clients for sample in c.latencies]
+    result = {
+        "target": url,
+        "sessions": sessions,
+        "duration_s": duration,
+        "encodings": encodings,
+        "failed_sessions": sum(1 for r in reports if "updates" not in r),
+        "total_updates_per_s": round(sum(r.get("updates_per_s", 0) for r in reports), 2),
+        "latency_ms": latency_summary(all_latencies),
+        "sessions_detail": reports
+    }
+    if gateway_pid:
+        cpu = process_tree_cpu(gateway_pid) - cpu_start
+        result["gateway"] = {"pid": gateway_pid, "cpu_s": round(cpu, 3),
+                             "cpu_percent": round(100.0 * cpu / wall, 1)}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RFB/WebSocket latency benchmark")
+    parser.add_argument("target", nargs="?",
+                        help="rfb://host:port or ws://host:port/websockify[?token=VM]")
+    parser.add_argument("--sessions", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--inject-interval", type=float, default=0.2)
+    parser.add_argument("--inject", choices=["key", "pointer"], default="key")
+    parser.add_argument("--encodings", default="zrle,hextile,copyrect,raw")
+    parser.add_argument("--password")
+    parser.add_argument("--spawn-vm", type=int, metavar="DISPLAY",
+                        help="start a local QEMU test-pattern VM on this VNC display")
+    parser.add_argument("-o", "--output")
+    args = parser.parse_args()
+
+    vm = None
+    if args.spawn_vm is not None:
+        vm = spawn_test_vm(args.spawn_vm)
+        args.target = args.target or f"rfb://127.0.0.1:{5900 + args.spawn_vm}"
+    if not args.target:
+        parser.error("a target URL or --spawn-vm is required")
+    try:
+        result = run_benchmark(args.target, args.sessions, args.duration,
+                               args.inject_interval, args.encodings.split(","),
+                               args.password, args.inject)
+    finally:
+        if vm:
+            vm.kill()
+            vm.wait()
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    return 0 if result["failed_sessions"] < args.sessions else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
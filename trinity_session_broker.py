@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Trinity Session Broker - Least-loaded VM assignment for browser sessions
+Leases a free VM to each browser session (live CPU + connected VNC clients),
+keeps it alive with heartbeats and reclaims it when the lease expires
+
+    POST /api/session                 -> {"lease", "vm", "websocket_url", "novnc_url", "ttl"}
+    POST /api/session/<lease>/heartbeat
+    POST /api/session/<lease>/release
+    GET  /api/session/status
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import secrets
+import threading
+from urllib.parse import quote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from trinity_comprehensive_launcher import TrinityComprehensiveLauncher
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+TCP_ESTABLISHED = "01"
+
+
+def process_ticks(pid):
+    """utime + stime لعملية QEMU (None إذا انتهت)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return int(fields[11]) + int(fields[12])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def established_by_port():
+    """عدد اتصالات TCP القائمة لكل منفذ محلي (قراءة واحدة لكل الـ VMs)"""
+    counts = {}
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if fields[3] == TCP_ESTABLISHED:
+                        port = int(fields[1].rsplit(":", 1)[1], 16)
+                        counts[port] = counts.get(port, 0) + 1
+        except (OSError, StopIteration):
+            pass
+    return counts
+
+
+class DisplayUnavailableError(Exception):
+    """تعذر فتح شاشة VM المؤجرة (QMP أو socket)"""
+
+
+class TrinitySessionBroker:
+    def __init__(self, launcher=None, lease_ttl=30.0, sample_interval=2.0,
+                 client_weight=50.0, gateway_port=5006):
+        self.launcher = launcher or TrinityComprehensiveLauncher()
+        self.lease_ttl = lease_ttl
+        self.sample_interval = sample_interval
+        # عميل VNC متصل يساوي نصف نواة مشغولة في حساب الحمل
+        self.client_weight = client_weight
+        self.gateway_port = gateway_port
+        self.lock = threading.Lock()
+        self.vms = {}
+        self.free = []      # heap: (load, seq, name) للـ VMs غير المؤجرة
+        self.leases = {}
+        self.expiry = []    # heap: (expires, lease_id)؛ المدخلات القديمة تُتجاهل
+        self.seq = 0
+        self.stop_event = threading.Event()
+
+    def log(self, message):
+        print(f"[Session Broker] {message}")
+
+    def load(self, entry):
+        return entry["cpu"] + self.client_weight * entry["clients"]
+
+    def push_free(self, name):
+        self.seq += 1
+        heapq.heappush(self.free, (self.load(self.vms[name]), self.seq, name))
+
+    def sample(self):
+        """تحديث الحمل من /proc ثم إعادة بناء heap الـ VMs الحرة"""
+        now = time.monotonic()
+        registry = {vm["name"]: vm for vm in self.launcher.load_running_vms()}
+        clients = established_by_port()
+        samples = {}
+        for name, vm in registry.items():
+            try:
+                with open(vm["pid_file"]) as f:
+                    pid = int(f.read().strip())
+            except (OSError, ValueError):
+                continue
+            ticks = process_ticks(pid)
+            if ticks is not None:
+                samples[name] = (vm, pid, ticks)
+
+        gone = []
+        with self.lock:
+            for name in list(self.vms):
+                if name not in samples:
+                    lease_id = self.vms.pop(name)["lease"]
+                    if self.leases.pop(lease_id, None):
+                        gone.append(lease_id)
+            for name, (vm, pid, ticks) in samples.items():
+                entry = self.vms.get(name)
+                if entry is None or entry["pid"] != pid:
+                    lease = entry["lease"] if entry else None
+                    entry = self.vms[name] = {"vm": vm, "pid": pid, "ticks": ticks,
+                                              "t": now, "cpu": 0.0, "lease": lease}
+                else:
+                    elapsed = now - entry["t"]
+                    if elapsed > 0:
+                        entry["cpu"] = 100.0 * (ticks - entry["ticks"]) / CLK_TCK / elapsed
+                    entry.update(vm=vm, ticks=ticks, t=now)
+                entry["clients"] = clients.get(vm["vnc_port"], 0)
+            self.free = []
+            for name, entry in self.vms.items():
+                if entry["lease"] is None and not entry.get("detaching"):
+                    self.seq += 1
+                    self.free.append((self.load(entry), self.seq, name))
+            heapq.heapify(self.free)
+        for lease_id in gone:
+            self.launcher.update_gateway_route(lease_id, None)
+        self.expire()
+
+    def expire(self):
+        """استرجاع الـ VMs التي انتهت مهلة تأجيرها"""
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            while self.expiry and self.expiry[0][0] <= now:
+                expires, lease_id = heapq.heappop(self.expiry)
+                lease = self.leases.get(lease_id)
+                if lease and lease["expires"] == expires:
+                    expired.append(self._release_locked(lease_id))
+        for lease in expired:
+            self.log(f"⌛ Lease expired, reclaiming {lease['vm']}")
+            self.launcher.update_gateway_route(lease["lease"], None)
+            self.detach(lease["vm"])
+
+    def _release_locked(self, lease_id):
+        lease = self.leases.pop(lease_id)
+        entry = self.vms.get(lease["vm"])
+        if entry is not None and entry["lease"] == lease_id:
+            entry["lease"] = None
+            if entry["vm"].get("headless"):
+                # لا تعود حرة قبل إيقاف VNC، وإلا قد يُغلق شاشة المستأجر التالي
+                entry["detaching"] = True
+            else:
+                self.push_free(lease["vm"])
+        return lease
+
+    def detach(self, name):
+        """إيقاف VNC لـ VM بدون شاشة بعد انتهاء عقدها، ثم إعادتها إلى الـ VMs الحرة"""
+        with self.lock:
+            entry = self.vms.get(name)
+            vm = entry["vm"] if entry is not None and entry.get("detaching") else None
+        if vm is None:
+            return
+        try:
+            self.launcher.detach_display(vm)
+        except Exception as e:
+            self.log(f"⚠️ {name}: detaching VNC failed: {e}")
+        with self.lock:
+            entry = self.vms.get(name)
+            if entry is not None and entry.get("detaching"):
+                entry["detaching"] = False
+                if entry["lease"] is None:
+                    self.push_free(name)
+
+    def acquire(self, client=None):
+        """تأجير أقل VM حملا؛ القرار O(log n) تحت القفل"""
+        self.expire()
+        start = time.perf_counter()
+        with self.lock:
+            while self.free:
+                _, _, name = heapq.heappop(self.free)
+                entry = self.vms.get(name)
+                if entry is not None and entry["lease"] is None:
+                    break
+            else:
+                raise LookupError("no free VM available")
+            lease_id = secrets.token_urlsafe(16)
+            expires = time.monotonic() + self.lease_ttl
+            entry["lease"] = lease_id
+            self.leases[lease_id] = {
+                "lease": lease_id, "vm": name, "client": client,
+                "expires": expires, "vnc_port": entry["vm"]["vnc_port"],
+            }
+            vm = entry["vm"]
+            heapq.heappush(self.expiry, (expires, lease_id))
+            load = self.load(entry)
+        decision_us = (time.perf_counter() - start) * 1e6
+
+        # token خاص بالعقد: ينتهي الوصول عبر البوابة عند انتهاء العقد
+        # VM بدون شاشة تفتح VNC (UNIX socket) عند أول مشاهد فقط
+        try:
+            route = self.launcher.attach_display(vm)
+        except Exception as e:
+            self.release(lease_id)
+            raise DisplayUnavailableError(f"{name}: display unavailable: {e}") from e
+        self.launcher.update_gateway_route(lease_id, route)
+        self.log(f"🎯 {name} -> {client or 'anonymous'} (load {load:.1f}, {decision_us:.0f}µs)")
+        return {"lease": lease_id, "vm": name, "ttl": self.lease_ttl,
+                "load": round(load, 1), "decision_us": round(decision_us, 1)}
+
+    def heartbeat(self, lease_id):
+        with self.lock:
+            lease = self.leases[lease_id]
+            lease["expires"] = time.monotonic() + self.lease_ttl
+            heapq.heappush(self.expiry, (lease["expires"], lease_id))
+        return {"lease": lease_id, "vm": lease["vm"], "ttl": self.lease_ttl}
+
+    def release(self, lease_id):
+        with self.lock:
+            lease = self._release_locked(lease_id)
+        self.launcher.update_gateway_route(lease_id, None)
+        self.detach(lease["vm"])
+        self.log(f"👋 Released {lease['vm']}")
+        return {"lease": lease_id, "vm": lease["vm"], "released": True}
+
+    def status(self):
+        with self.lock:
+            return {
+                "vms": {name: {"cpu": round(entry["cpu"], 1), "clients": entry["clients"],
+                               "leased": entry["lease"] is not None}
+                        for name, entry in self.vms.items()},
+                "leases": len(self.leases),
+                "free": sum(1 for entry in self.vms.values() if entry["lease"] is None),
+            }
+
+    def sampler(self):
+        while not self.stop_event.wait(self.sample_interval):
+            try:
+                self.sample()
+            except Exception as e:
+                self.log(f"⚠️ Sampling failed: {e}")
+
+    def make_handler(self):
+        broker = self
+
+        class SessionRequestHandler(BaseHTTPRequestHandler):
+            def reply(self, code, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                # الصفحات تُخدم من منفذ websockify، والـ broker على منفذ آخر
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_OPTIONS(self):
+                self.send_response(204)
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.send_header("Access-Control-Allow-Methods", "GET, POST")
+                self.send_header("Access-Control-Allow-Headers", "Content-Type")
+                self.end_headers()
+
+            def do_GET(self):
+                if self.path == "/api/session/status":
+                    self.reply(200, broker.status())
+                else:
+                    self.reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    # sendBeacon يرسل text/plain، لذا لا نعتمد على Content-Type
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                    parts = self.path.rstrip("/").split("/")
+                    if parts == ["", "api", "session"]:
+                        result = broker.acquire(body.get("client"))
+                        host = (self.headers.get("Host") or "localhost").split(":")[0]
+                        scheme = "wss" if self.headers.get("X-Forwarded-Proto") == "https" else "ws"
+                        path = f"websockify?token={result['lease']}"
+                        result["websocket_url"] = f"{scheme}://{host}:{broker.gateway_port}/{path}"
+                        result["novnc_url"] = (f"/vnc.html?autoconnect=true&resize=scale"
+                                               f"&host={host}&port={broker.gateway_port}"
+                                               f"&path={quote(path, safe='')}")
+                    elif len(parts) == 5 and parts[:3] == ["", "api", "session"] \
+                            and parts[4] == "heartbeat":
+                        result = broker.heartbeat(parts[3])
+                    elif len(parts) == 5 and parts[:3] == ["", "api", "session"] \
+                            and parts[4] == "release":
+                        result = broker.release(parts[3])
+                    else:
+                        self.reply(404, {"error": "not found"})
+                        return
+                    self.reply(200, result)
+                except KeyError as e:
+                    self.reply(404, {"error": f"unknown lease {e}"})
+                except (LookupError, DisplayUnavailableError) as e:
+                    self.reply(503, {"error": str(e)})
+                except (ValueError, TypeError) as e:
+                    self.reply(400, {"error": str(e)})
+
+            def log_message(self, format, *args):
+                pass
+
+        return SessionRequestHandler
+
+    def start(self, port=None):
+        """تشغيل الخادم وخيط أخذ العينات في الخلفية؛ يُرجع الخادم"""
+        port = port or self.launcher.config["session_broker_port"]
+        self.sample()
+        server = ThreadingHTTPServer(("0.0.0.0", port), self.make_handler())
+        threading.Thread(target=self.sampler, daemon=True).start()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.log(f"🎯 Session broker listening on http://0.0.0.0:{port}/api/session")
+        return server
+
+    def stop(self, server):
+        self.stop_event.set()
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    broker = TrinitySessionBroker()
+    server = broker.start(int(sys.argv[1]) if len(sys.argv) > 1 else None)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        broker.log("🛑 Stopping session broker...")
+    finally:
+        broker.stop(server)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Trinity Storage Daemon - Shared read-only Android system image over NBD
+One qemu-storage-daemon per base image exports it read-only on a UNIX socket;
+every VM gets a private qcow2 overlay whose backing file is that export
+
+    python3 trinity_storage_daemon.py --export images/android-x86.img
+    python3 trinity_storage_daemon.py --stop
+    python3 trinity_storage_daemon.py --measure images/android-x86.img [count] [settle]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import socket
+import hashlib
+import threading
+import subprocess
+from pathlib import Path
+
+
+def meminfo_cached():
+    """حجم الـ page cache على المضيف بالبايت"""
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("Cached:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def read_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            for line in f:
+                if line.startswith("read_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def open_handles(pid, path):
+    """عدد واصفات الملفات المفتوحة على path في عملية واحدة
+    
+    المقارنة بالـ inode لا بالاسم: QEMU قد يفتح الصورة عبر hardlink في مخزن الصور"""
+    count = 0
+    target = os.stat(path)
+    try:
+        for fd in os.listdir(f"/proc/{pid}/fd"):
+            try:
+                st = os.stat(f"/proc/{pid}/fd/{fd}")
+                if (st.st_dev, st.st_ino) == (target.st_dev, target.st_ino):
+                    count += 1
+            except OSError:
+                pass
+    except OSError:
+        pass
+    return count
+
+
+class TrinityStorageDaemon:
+    lock = threading.Lock()
+
+    def __init__(self, workspace_dir="trinity_workspace"):
+        self.daemon_dir = Path(workspace_dir) / "storage-daemon"
+        self.daemon_dir.mkdir(parents=True, exist_ok=True)
+        self.state_file = self.daemon_dir / "exports.json"
+
+    def log(self, message):
+        print(f"[Storage Daemon] {message}")
+
+    def binary(self):
+        local = Path("TrinityEmulator") / "qemu-storage-daemon"
+        if local.exists():
+            return str(local)
+        return shutil.which("qemu-storage-daemon") or "qemu-storage-daemon"
+
+    def load_state(self):
+        if not self.state_file.exists():
+            return {}
+        with open(self.state_file, "r") as f:
+            return json.load(f)
+
+    def save_state(self, state):
+        tmp_file = self.state_file.with_suffix(".json.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    @staticmethod
+    def export_name(image):
+        return "base-" + hashlib.sha1(os.path.abspath(image).encode()).hexdigest()[:12]
+
+    @staticmethod
+    def export_uri(name, socket_path):
+        return f"nbd+unix:///{name}?socket={socket_path}"
+
+    @staticmethod
+    def alive(export):
+        try:
+            os.kill(export["pid"], 0)
+        except OSError:
+            return False
+        return os.path.exists(export["socket"])
+
+    def ensure_export(self, image, timeout=10.0):
+        """تشغيل (أو إعادة استخدام) daemon يصدّر الصورة للقراءة فقط؛ يعيد URI الـ NBD"""
+        image = os.path.abspath(image)
+        name = self.export_name(image)
+        with self.lock:
+            state = self.load_state()
+            export = state.get(name)
+            if export and self.alive(export):
+                return self.export_uri(name, export["socket"])
+
+            info = json.loads(subprocess.run([
+                "qemu-img", "info", "--output=json", image
+            ], check=True, capture_output=True, text=True).stdout)
+            socket_path = str((self.daemon_dir / f"{name}.sock").absolute())
+            qmp_path = str((self.daemon_dir / f"{name}.qmp").absolute())
+            for path in (socket_path, qmp_path):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+            cmd = [
+                self.binary(),
+                "--blockdev", f"driver=file,node-name=file0,filename={image},read-only=on",
+                "--blockdev", f"driver={info['format']},node-name=base,file=file0,read-only=on",
+                "--nbd-server", f"addr.type=unix,addr.path={socket_path}",
+                "--export", f"type=nbd,device=base,name={name}",
+                "--chardev", f"socket,id=qmp0,path={qmp_path},server,nowait",
+                "--monitor", "chardev=qmp0",
+            ]
+            self.log(f"📀 Exporting {image} as {name}...")
+            # الابن يرث نسخته من ملف السجل؛ نسخة هذه العملية تُغلق فورا
+            with open(self.daemon_dir / f"{name}.log", "a") as log_file:
+                process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=log_file,
+                                           start_new_session=True)
+            deadline = time.monotonic() + timeout
+            while not os.path.exists(socket_path):
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"qemu-storage-daemon failed to export {image}")
+                time.sleep(0.1)
+
+            state[name] = {"image": image, "pid": process.pid, "socket": socket_path,
+                           "qmp_socket": qmp_path, "format": info["format"]}
+            self.save_state(state)
+            return self.export_uri(name, socket_path)
+
+    def stop(self, name=None):
+        with self.lock:
+            state = self.load_state()
+            for export_name in [name] if name else list(state):
+                export = state.pop(export_name, None)
+                if export and self.alive(export):
+                    os.kill(export["pid"], signal.SIGTERM)
+                    self.log(f"🛑 Stopped export {export_name}")
+            self.save_state(state)
+
+    def status(self):
+        state = self.load_state()
+        return {name: dict(export, running=self.alive(export)) for name, export in state.items()}
+
+
+def free_port_range(count, start):
+    """أول count منافذ متتالية حرة ابتداء من start"""
+    base = start
+    while base + count <= 65536:
+        for port in range(base, base + count):
+            with socket.socket() as sock:
+                try:
+                    sock.bind(("127.0.0.1", port))
+                except OSError:
+                    base = port + 1
+                    break
+        else:
+            return base
+    raise RuntimeError(f"No {count} free consecutive ports from {start}")
+
+
+def measure(base_image, count=4, settle=120.0):
+    """مقارنة page cache وقراءات الإقلاع: overlay على الملف مباشرة مقابل overlay على NBD"""
+    from trinity_comprehensive_launcher import TrinityComprehensiveLauncher
+
+    base_image = os.path.abspath(base_image)
+    results = {}
+    # منافذ خاصة بكل وضع حتى لا تصطدم بأسطول يعمل على المنافذ الافتراضية
+    vnc_base, adb_base = 5960, 5655
+    for mode in ("direct", "shared"):
+        vnc_base = free_port_range(count, vnc_base)
+        adb_base = free_port_range(count, adb_base)
+        launcher = TrinityComprehensiveLauncher(f"trinity_workspace/measure-{mode}",
+                                                vnc_base, adb_base)
+        vnc_base += count
+        adb_base += count
+        daemon = TrinityStorageDaemon(launcher.workspace_dir)
+        if mode == "shared":
+            daemon.ensure_export(base_image)
+        try:
+            # بداية باردة للمقارنة العادلة (تتطلب root)
+            with open("/proc/sys/vm/drop_caches", "w") as f:
+                f.write("3\n")
+        except OSError:
+            pass
+        cached_before = meminfo_cached()
+        vms = []
+        for index in range(count):
+            vm_config = {"name": f"Measure-{mode}-{index}", "image": base_image,
+                         "shared_base": mode == "shared"}
+            vm = launcher.launch_trinity_vm(vm_config, index)
+            if vm:
+                vms.append(vm)
+        time.sleep(settle)
+
+        pids = [pid for pid in (launcher.vm_pid(vm) for vm in vms) if pid]
+        if mode == "shared":
+            pids += [export["pid"] for export in daemon.status().values() if export["running"]]
+        results[mode] = {
+            "vms": len(vms),
+            "page_cache_delta": meminfo_cached() - cached_before,
+            "read_bytes": sum(read_bytes(pid) for pid in pids),
+            "base_image_handles": sum(open_handles(pid, base_image) for pid in pids),
+        }
+        launcher.shutdown_fleet(vms)
+        daemon.stop()
+        for vm in vms:
+            shutil.rmtree(Path(vm["pid_file"]).parent, ignore_errors=True)
+
+    print(f"{'metric':<22}{'direct':>16}{'shared':>16}")
+    for metric in ("page_cache_delta", "read_bytes", "base_image_handles"):
+        print(f"{metric:<22}{results['direct'][metric]:>16}{results['shared'][metric]:>16}")
+    return results
+
+
+def main():
+    daemon = TrinityStorageDaemon()
+    if len(sys.argv) > 2 and sys.argv[1] == "--export":
+        print(daemon.ensure_export(sys.argv[2]))
+        return 0
+    if len(sys.argv) > 1 and sys.argv[1] == "--stop":
+        daemon.stop(sys.argv[2] if len(sys.argv) > 2 else None)
+        return 0
+    if len(sys.argv) > 2 and sys.argv[1] == "--measure":
+        count = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+        settle = float(sys.argv[4]) if len(sys.argv) > 4 else 120.0
+        print(json.dumps(measure(sys.argv[2], count, settle), indent=2))
+        return 0
+    print(json.dumps(daemon.status(), indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
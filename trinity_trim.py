@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Trinity Trim - Scheduled guest-fstrim to keep qcow2 images compact
+Runs guest-fstrim through qemu-ga on idle VMs, one VM at a time, and records
+how much qcow2 allocation each trim released
+
+    python3 trinity_trim.py [--once]
+
+VM drives are opened with discard=unmap,detect-zeroes=unmap, so the guest's
+TRIM frees the qcow2 clusters (and punches holes in the host file).
+"""
+
+import os
+import sys
+import json
+import time
+import random
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "TrinityEmulator", "python"))
+from qemu.qmp import QEMUMonitorProtocol
+
+from trinity_comprehensive_launcher import TrinityComprehensiveLauncher
+from trinity_session_broker import process_ticks, established_by_port
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+
+class TrinityTrimScheduler:
+    def __init__(self, launcher=None):
+        self.launcher = launcher or TrinityComprehensiveLauncher()
+        self.config = self.launcher.config
+        self.state_file = self.launcher.workspace_dir / "trim_state.json"
+
+    def log(self, message):
+        print(f"[Trim] {message}")
+
+    def load_state(self):
+        if not self.state_file.exists():
+            return {}
+        with open(self.state_file, "r") as f:
+            return json.load(f)
+
+    def save_state(self, state):
+        tmp_file = self.state_file.with_suffix(".json.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    def is_idle(self, vm, sample=2.0):
+        """خاملة = CPU أقل من العتبة ولا عملاء VNC متصلين"""
+        pid = self.launcher.vm_pid(vm)
+        if pid is None:
+            return False
+        if established_by_port().get(vm.get("vnc_port"), 0):
+            return False
+        before = process_ticks(pid)
+        time.sleep(sample)
+        after = process_ticks(pid)
+        if before is None or after is None:
+            return False
+        cpu = 100.0 * (after - before) / CLK_TCK / sample
+        return cpu < self.config["trim_idle_cpu"]
+
+    def allocation(self, vm):
+        """البايتات المخصصة فعلا على المضيف لكل قرص (actual-size)"""
+        qmp = self.launcher.connect_vm_qmp(vm)
+        try:
+            return {device["device"]: device["inserted"]["image"].get("actual-size", 0)
+                    for device in qmp.command("query-block")
+                    if device.get("inserted") and not device["inserted"].get("ro")}
+        finally:
+            qmp.close()
+
+    def guest_fstrim(self, vm, timeout=600.0):
+        """guest-fstrim عبر qemu-ga؛ guest-sync أولا لتجاهل ردود قديمة في القناة"""
+        qga = QEMUMonitorProtocol(vm["qga_socket"])
+        qga.connect(negotiate=False)
+        try:
+            # بدون وكيل في الضيف لا يصل أي رد؛ مهلة قصيرة للمزامنة
+            qga.settimeout(5.0)
+            sync_id = random.randint(1, 2 ** 31)
+            reply = qga.cmd("guest-sync", {"id": sync_id})
+            if not reply or reply.get("return") != sync_id:
+                raise RuntimeError("guest agent did not sync")
+            qga.settimeout(timeout)
+            reply = qga.cmd("guest-fstrim")
+            if not reply or "error" in reply:
+                raise RuntimeError(reply["error"]["desc"] if reply else "no reply")
+            return reply["return"].get("paths", [])
+        finally:
+            qga.close()
+
+    def trim_vm(self, vm):
+        before = self.allocation(vm)
+        start = time.monotonic()
+        paths = self.guest_fstrim(vm)
+        after = self.allocation(vm)
+        reclaimed = {device: before[device] - after.get(device, 0) for device in before}
+        result = {
+            "time": time.time(),
+            "seconds": round(time.monotonic() - start, 2),
+            "allocated_before": sum(before.values()),
+            "allocated_after": sum(after.values()),
+            "reclaimed": sum(reclaimed.values()),
+            "drives": reclaimed,
+            "guest_trimmed": sum(path.get("trimmed", 0) for path in paths),
+            "errors": [path["error"] for path in paths if path.get("error")],
+        }
+        self.log(f"✂️ {vm['name']}: reclaimed {result['reclaimed'] / 1024 ** 2:.1f} MB "
+                 f"(guest trimmed {result['guest_trimmed'] / 1024 ** 2:.1f} MB) "
+                 f"in {result['seconds']:.1f}s")
+        return result
+
+    def due_vms(self, state):
+        """الـ VMs التي حان دورها، الأقدم تقليما أولا"""
+        now = time.time()
+        vms = [vm for vm in self.launcher.load_running_vms() if vm.get("qga_socket")]
+        due = [vm for vm in vms
+               if now - state.get(vm["name"], {}).get("last", 0) >= self.config["trim_interval"]]
+        return sorted(due, key=lambda vm: state.get(vm["name"], {}).get("last", 0))
+
+    def run_once(self):
+        """دورة واحدة: VM واحدة في كل مرة مع فاصل بينها؛ المشغولة تؤجل للدورة التالية"""
+        state = self.load_state()
+        trimmed = 0
+        for index, vm in enumerate(self.due_vms(state)):
+            if index:
+                time.sleep(self.config["trim_stagger"])
+            if not self.is_idle(vm):
+                self.log(f"⏭️ {vm['name']} busy, deferring")
+                continue
+            try:
+                result = self.trim_vm(vm)
+            except Exception as e:
+                self.log(f"⚠️ {vm['name']}: trim failed: {e}")
+                continue
+            entry = state.setdefault(vm["name"], {"reclaimed_total": 0, "history": []})
+            entry["last"] = result["time"]
+            entry["reclaimed_total"] += result["reclaimed"]
+            entry["history"] = (entry["history"] + [result])[-20:]
+            self.save_state(state)
+            trimmed += 1
+        return trimmed
+
+    def run(self, check_interval=300):
+        self.log(f"🕒 Trim scheduler started (every {self.config['trim_interval']}s per VM, "
+                 f"{self.config['trim_stagger']}s stagger)")
+        try:
+            while True:
+                self.run_once()
+                time.sleep(check_interval)
+        except KeyboardInterrupt:
+            self.log("🛑 Stopping trim scheduler...")
+
+
+def main():
+    scheduler = TrinityTrimScheduler()
+    if "--once" in sys.argv[1:]:
+        scheduler.run_once()
+    else:
+        scheduler.run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())